@@ -2,13 +2,15 @@ import functools
 import logging
 import libSerialization
 import pymel.core as pymel
+from omtk.libs import libNetwork
 
 
 def CallFnOnNetworkByClass(_sFn, _sCls):
     fnFilter = lambda x: libSerialization.isNetworkInstanceOfClass(x, _sCls)
     networks = libSerialization.getConnectedNetworks(pymel.selected(), key=fnFilter)
     for network in networks:
-        rigPart = libSerialization.import_network(network)
+        # Only the parts of the module used by the function will be imported.
+        rigPart = libNetwork.import_network_lazy(network)
 
         if not hasattr(rigPart, _sFn):
             logging.warning("Can't find attribute {0} in {1}".format(_sFn, network)); continue
@@ -1,16 +1,25 @@
+import contextlib
 import logging
 import os
 import inspect
 import libSerialization
 import json
 import pymel.core as pymel
+from maya import OpenMaya
 
+import classBuildPlan
 import classCtrl
 import classModule
 import className
 import classNode
 import classRig
+from omtk.libs import libGeometry
+from omtk.libs import libNetwork
 from omtk.libs import libPython
+from omtk.libs import libPymel
+from omtk.libs import libRigging
+from omtk.libs import libSerializationIO
+from omtk.libs import libSkeleton
 log = logging.getLogger('omtk')
 
 # Load configuration file
@@ -22,11 +31,51 @@ if os.path.exists(config_path):
     with open(config_path) as fp:
         config = json.load(fp)
 
+#
+# Scene callbacks
+#
+
+def _on_scene_changed(*args):
+    """
+    Discard anything cached from the previous scene.
+    """
+    libPython.invalidate_all_memoized()
+    libPymel.invalidate_scene_snapshot()
+    libNetwork.invalidate()
+    libRigging.invalidate_ray_cast_cache()
+    libGeometry.invalidate_mesh_snapshot()
+    libSerializationIO.invalidate_cache()
+
+def _on_scene_saved(*args):
+    """
+    Store the definition of the rigs in the binary cache. (see libSerializationIO)
+    """
+    if not config.get('binary_cache', False):
+        return
+    # Note: The cache can be stored in the scene (before saving) or next to it (after saving, when the path is known).
+    is_before_save = args and args[-1] == 'before'
+    if is_before_save != (libSerializationIO.CACHE_LOCATION == 'fileInfo'):
+        return
+    rigs = find()
+    if rigs:
+        libSerializationIO.save_cache(rigs)
+
+# Remove the callbacks registered by a previous import of the module (see _reload).
+for _callback_id in globals().get('_callback_ids', []):
+    OpenMaya.MMessage.removeCallback(_callback_id)
+_callback_ids = [
+    OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterOpen, _on_scene_changed),
+    OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterNew, _on_scene_changed),
+    OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kBeforeSave, _on_scene_saved, 'before'),
+    OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterSave, _on_scene_saved, 'after')
+]
+
 def _reload():
     reload(className)
     reload(classNode)
     reload(classCtrl)
     reload(classModule)
+    reload(classBuildPlan)
     reload(classRig)
 
 def create(*args, **kwargs):
@@ -41,41 +90,72 @@ def create(*args, **kwargs):
 
     return cls(*args, **kwargs)
 
-def find():
+def _import_rig(network, use_cache=True):
+    # Already imported in this session?
+    rig = libNetwork.get_index().get_imported(network, module='omtk')
+    if rig is not None:
+        return rig
+
+    # Try the binary cache, it is only used if the networks did not change since it was saved.
+    if use_cache and config.get('binary_cache', False):
+        rig = libSerializationIO.load_cache(network)
+        if rig is not None:
+            libNetwork.get_index().set_imported(network, rig, module='omtk')
+            return rig
+
+    return libNetwork.import_network(network, module='omtk')
+
+def find(lazy=False, use_cache=True):
     """
+    :param lazy: If True, the rigs modules, ctrls and attributes will only be imported when accessed.
+    :param use_cache: If True, the rigs can be restored from the binary cache. (see libSerializationIO)
     :return: All the rigs embedded in the current maya scene.
     """
-    #TODO: Find why when a scene is open for a long time, this function is slower
-    networks = libSerialization.getNetworksByClass('Rig')
-    return [libSerialization.import_network(network, module='omtk') for network in networks]
+    # Note: The networks and the imported rigs are cached until the networks change. (see libNetwork)
+    networks = libNetwork.get_networks_by_class('Rig')
+    if lazy:
+        return [libNetwork.import_network_lazy(network) for network in networks]
+    return [_import_rig(network, use_cache=use_cache) for network in networks]
 
 
 def find_one(*args, **kwargs):
     return next(iter(find(*args, **kwargs)), None)
 
+@contextlib.contextmanager
+def _invalidate_import_on_error(network):
+    """
+    The imported rigs are shared and modified in place, if their build fail they need to be imported again.
+    """
+    try:
+        yield
+    except Exception:
+        libNetwork.invalidate_network(network)
+        raise
+
 #@libPython.profiler
 @libPython.log_execution_time('build_all')
 def build_all():
     """
     Build all the rigs embedded in the current maya scene.
     """
-    networks = libSerialization.getNetworksByClass('Rig')
+    networks = libNetwork.get_networks_by_class('Rig')
     for network in networks:
-        rigroot = libSerialization.import_network(network)
-        if rigroot.build():
-            pymel.delete(network)
-            libSerialization.export_network(rigroot)
+        rigroot = libNetwork.import_network(network)
+        with _invalidate_import_on_error(network):
+            if rigroot.build():
+                # Only update the networks that changed instead of re-creating all of them.
+                libNetwork.export_network_diff(rigroot, network=network)
 
 #@libPython.profiler
 @libPython.log_execution_time('unbuild_all')
 def unbuild_all():
-    networks = libSerialization.getNetworksByClass('Rig')
+    networks = libNetwork.get_networks_by_class('Rig')
     for network in networks:
-        rigroot = libSerialization.import_network(network)
-        rigroot.unbuild()
-        pymel.delete(network)
-        # Write changes to scene
-        network = libSerialization.export_network(rigroot)
+        rigroot = libNetwork.import_network(network)
+        with _invalidate_import_on_error(network):
+            rigroot.unbuild()
+            # Write changes to scene
+            network, _ = libNetwork.export_network_diff(rigroot, network=network)
         pymel.select(network)
 
 def detect(*args, **kwargs):
@@ -83,176 +163,79 @@ def detect(*args, **kwargs):
     Fully automatic routine that create rig elements by analysing the joints structure.
     This is only meant as a quick way to get started and is in no way production ready.
     It is recommended that the 't-pose' or 45 angle 't-pose' is respected on the character before running this routine.
+    One rig is created for each joint root in the scene. (see libSkeleton.analyse_skeleton)
+    :return: A list of the created rigs.
     """
-    jnts = pymel.ls(type='joint')
-
-    # Validate the joints hyerarchy since it is mandatory to autorig.
-    roots = []
-    for jnt in jnts:
-        root = jnt.root()
-        if root and root not in roots:
-            roots.append(root)
-
-    if len(roots) > 1:
-        log.error("There are more than one joint root in the scene. Please clean up.")
+    if libSkeleton.numpy is None:
+        log.error("numpy is required to detect the rig layout.")
         return None
 
-    root = next(iter(roots), None)
-    if not root:
+    # Read the whole hierarchy and the world positions once instead of querying each joint.
+    # The shared snapshot is only invalidated when the dag change and the joints could have moved since.
+    snapshot = libPymel.SceneSnapshot()
+    indices = snapshot.get_indices_by_type('joint')
+    if not indices:
         log.error("Found no joint root.")
         return None
 
-    # Get the rig heights and radius
-    height = 0
-    radius = 0
-    for jnt in jnts:
-        pos = jnt.getTranslation(space='world')
-
-        pos_x = pos.x
-        h = pos.y
-        pos_z = pos.z
+    # A joint parented to something else than a joint is considered a root.
+    numpy = libSkeleton.numpy
+    jnt_index_by_index = numpy.full(len(snapshot), -1, dtype=numpy.int64)
+    jnt_index_by_index[indices] = numpy.arange(len(indices))
+    parents = snapshot.parents[indices]
+    parents = numpy.where(parents == -1, -1, jnt_index_by_index[parents])
+    positions = snapshot.get_world_translations(indices)
 
-        r = pow(pow(pos_x, 2) + pow(pos_z, 2), 0.5)
+    layouts = libSkeleton.analyse_skeleton(parents, positions)
 
-        if h > height:
-            height = h
-
-        if r > radius:
-            radius = r
-
-    MINIMUM_HEIGHT=0.01
-    if height < MINIMUM_HEIGHT:
-        log.error("Skeletton height is too small. Expected more than {0}".format(MINIMUM_HEIGHT))
-        return None
+    def get_jnts(chain):
+        return [snapshot.get_node(indices[i]) for i in chain]
 
+    MINIMUM_HEIGHT = 0.01
     MINIMUM_RADIUS = 0.01
-    if radius < MINIMUM_RADIUS:
-        log.error("Skeletton radius is too small. Expected more than {0}".format(MINIMUM_RADIUS))
-        return None
-
-    #
-    # Configure Rig
-    #
-    rig = create()
-
-    def get_arms(jnts):
-        chains = []
-        for jnt in jnts:
-            arm_jnts = get_arm(jnt)
-            if arm_jnts:
-                chains.append(arm_jnts)
-        return chains
-
-    # Detect hands?
-    def get_arm(jnt):
-        children = jnt.getChildren()
-
-        # Hand have a minimum of three fingers or not fingers at all
-        # todo: More robust!
-        if len(children) < 2 and len(children) != 0:
-            return False
-
-        # At least two parents (upperarm and forearm)
-        forearm = jnt.getParent()
-        upperarm = forearm.getParent() if isinstance(forearm, pymel.PyNode) else None
-        if not upperarm or not forearm:
-            return False
-
-        # Arms don't point upward, don't confuse ourself with the spine
-        upperarm_dir = get_direction(upperarm, forearm)
-        MAX_DIRECTION_Y = 0.75
-        if abs(upperarm_dir.y) > MAX_DIRECTION_Y:
-            return False
-
-        arm_jnts = [upperarm, forearm, jnt]
-        log.debug("Found Arm using {0}".format(arm_jnts))
-        return arm_jnts
-
-    def get_legs(jnts):
-        chains = []
-        for jnt in jnts:
-            leg_jnts = get_leg(jnt)
-            if leg_jnts:
-                chains.append(leg_jnts)
-        return chains
-
-    def get_direction(jnt_inn, jnt_out):
-        val = jnt_out.getTranslation(space='world') - jnt_inn.getTranslation(space='world')
-        val.normalize()
-        return val
-
-    def get_leg(jnt):
-        # The tip of the leg never have childrens
-        if len(jnt.getChildren()) > 0:
-            return False
-
-        # A leg have 5 joints from with the first two point to the ground
-        parents = []
-        parent = jnt
-        while parent:
-            parent = parent.getParent()
-            parents.append(parent)
-
-        if len(parents) < 5:
-            return False
-
-        thigh = parents[3]
-        calf = parents[2]
-        foot = parents[1]
-        toe = parents[0]
-
-        # Validate thigh direction
-        DIR_MINIMUM = -0.5
-        thigh_dir = get_direction(thigh, calf)
-        if thigh_dir.y >= DIR_MINIMUM:
-            return False
-
-        # Validate calf direction
-        calf_dir = get_direction(calf, foot)
-        if calf_dir.y >= DIR_MINIMUM:
-            return False
-
-        #print jnt, parents[3], parents[2],
-        leg_jnts = [thigh, calf, foot, toe, jnt]
-        log.debug("Found Leg using {0}".format(leg_jnts))
-        return leg_jnts
-
-    #def get_spines(jnts):
-    #    chains = []
-    #    for jnt in jnts:
-    #        spine_jnts = get_spine(jnt)
-    #        if spine_jnts:
-    #            chains.append(spine_jnts)
-    #    return chains
-
-    log.debug("Detected rig layout:")
-    log.debug("\tHeight: {0}".format(height))
-    log.debug("\tRadius: {0}".format(radius))
-
-    from omtk.modules.rigTwistbone import Twistbone
-    from omtk.modules.rigLeg import Leg
-    from omtk.modules.rigArm import Arm
-
-    # Detect legs
-    legs_jnts = get_legs(jnts)
-    for leg_jnts in legs_jnts:
-        for leg_jnt in leg_jnts:
-            jnts.remove(leg_jnt)
-        rig.append(Leg(leg_jnts))
-        rig.append(Twistbone([leg_jnts[0], leg_jnts[1]]))
-        rig.append(Twistbone([leg_jnts[1], leg_jnts[2]]))
-
-    # Detect arms
-    arms_jnts = get_arms(jnts)
-    for arm_jnts in arms_jnts:
-        for arm_jnt in arm_jnts:
-            jnts.remove(arm_jnt)
-        rig.append(Arm(arm_jnts))
-        rig.append(Twistbone([arm_jnts[0], arm_jnts[1]]))
-        rig.append(Twistbone([arm_jnts[1], arm_jnts[2]]))
-
-    print len(jnts)
-
-    rig.build()
-
-    libSerialization.export_network(rig)
+    rigs = []
+    for layout in layouts:
+        root = snapshot.get_node(indices[layout.root])
+
+        log.debug("Detected rig layout for {0}:".format(root))
+        log.debug("\tHeight: {0}".format(layout.height))
+        log.debug("\tRadius: {0}".format(layout.radius))
+
+        if layout.height < MINIMUM_HEIGHT:
+            log.warning("Skeletton {0} height is too small. Expected more than {1}".format(root, MINIMUM_HEIGHT))
+            continue
+
+        if layout.radius < MINIMUM_RADIUS:
+            log.warning("Skeletton {0} radius is too small. Expected more than {1}".format(root, MINIMUM_RADIUS))
+            continue
+
+        #
+        # Configure Rig
+        #
+        rig = create(name=root.nodeName()) if len(layouts) > 1 else create()
+
+        for leg_jnts in layout.legs:
+            leg_jnts = get_jnts(leg_jnts)
+            log.debug("Found Leg using {0}".format(leg_jnts))
+            rig.add_module('Leg', leg_jnts)
+            rig.add_module('Twistbone', [leg_jnts[0], leg_jnts[1]])
+            rig.add_module('Twistbone', [leg_jnts[1], leg_jnts[2]])
+
+        for arm_jnts in layout.arms:
+            arm_jnts = get_jnts(arm_jnts)
+            log.debug("Found Arm using {0}".format(arm_jnts))
+            rig.add_module('Arm', arm_jnts)
+            rig.add_module('Twistbone', [arm_jnts[0], arm_jnts[1]])
+            rig.add_module('Twistbone', [arm_jnts[1], arm_jnts[2]])
+
+        for spine_jnts in layout.spines:
+            spine_jnts = get_jnts(spine_jnts)
+            log.debug("Found Spine using {0}".format(spine_jnts))
+            rig.add_module('FK', spine_jnts)
+
+        rig.build()
+
+        libSerialization.export_network(rig)
+        rigs.append(rig)
+
+    return rigs
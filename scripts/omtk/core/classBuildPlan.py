@@ -0,0 +1,221 @@
+import heapq
+import logging
+
+log = logging.getLogger('omtk')
+
+
+class BuildPlan(object):
+    """
+    A BuildPlan resolve the order in which the modules of a Rig need to be built.
+    The dependencies between modules are computed once from their inputs.
+    A module depend on the module owning each of it's parent objects (the first module using it as input) since:
+    - Module.get_parent_obj will hook the module on it's parent module. (see Rig.get_module_chains_by_inputs)
+    - BaseCtrl.get_spaceswitch_targets will use any module in the parent hierarchy as a target.
+
+    Iterating a BuildPlan yield the modules in a valid build order.
+    Modules without any relation keep the legacy order (by hierarchy depth, then by declaration order).
+    """
+
+    def __init__(self, rig, modules=None):
+        self.rig = rig
+        self.modules = list(modules) if modules is not None else list(rig.modules)
+
+        self._dependencies = {}  # module -> set of modules that need to be built before
+        self._dependents = {}  # module -> set of modules that need to be built after
+        self._durations = {}  # module -> build time in seconds
+        self._status_by_module = {}  # module -> (status, reason)
+        self._order = []
+
+        # Per-node cache shared between modules since most of them share the same ancestors.
+        self._depth_by_obj = {}
+
+        self._resolve()
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __str__(self):
+        return '<BuildPlan {0} modules>'.format(len(self._order))
+
+    #
+    # Resolving
+    #
+
+    def _get_depth(self, obj):
+        """
+        :return: The number of parents of obj. Equivalent to libPymel.get_num_parents but cached.
+        """
+        if obj is None:
+            return -1
+
+        # Resolve the ancestors we don't know about yet.
+        stack = []
+        while obj is not None and obj not in self._depth_by_obj:
+            stack.append(obj)
+            obj = obj.getParent()
+
+        depth = self._depth_by_obj[obj] if obj is not None else -1
+        for node in reversed(stack):
+            depth += 1
+            self._depth_by_obj[node] = depth
+        return depth
+
+    def _get_module_depth(self, module):
+        chain_jnt = module.chain_jnt
+        if not chain_jnt:
+            return -1
+        return self._get_depth(chain_jnt.start)
+
+    def _resolve(self):
+        known_modules = set(self.modules)
+        for module in self.modules:
+            self._dependents[module] = set()
+
+        # Resolve the modules owning the parent hierarchy of all the modules in one pass.
+        parent_by_module = dict((module, module.parent) for module in self.modules)
+        chain_by_parent = self.rig.get_module_chains_by_inputs(set(parent_by_module.values()))
+
+        for module in self.modules:
+            chain = chain_by_parent.get(parent_by_module[module], ())
+            dependencies = set(owner for owner in chain if owner is not module) & known_modules
+            self._dependencies[module] = dependencies
+            for dependency in dependencies:
+                self._dependents[dependency].add(module)
+
+        # Kahn algorithm. Ties are resolved using the legacy sorting key.
+        sort_key_by_module = dict(
+            (module, (self._get_module_depth(module), i)) for i, module in enumerate(self.modules)
+        )
+        num_pending_by_module = dict((module, len(self._dependencies[module])) for module in self.modules)
+        heap = [(sort_key_by_module[module], module) for module in self.modules if not num_pending_by_module[module]]
+        heapq.heapify(heap)
+
+        order = []
+        while heap:
+            _, module = heapq.heappop(heap)
+            order.append(module)
+            for dependent in self._dependents[module]:
+                num_pending_by_module[dependent] -= 1
+                if not num_pending_by_module[dependent]:
+                    heapq.heappush(heap, (sort_key_by_module[dependent], dependent))
+
+        # In case of circular dependencies, fallback to the legacy order for the remaining modules.
+        if len(order) != len(self.modules):
+            remaining = [module for module in self.modules if num_pending_by_module[module]]
+            log.warning("Found circular dependencies between modules {0}. They will be built in hierarchy order.".format(
+                ', '.join(str(module) for module in remaining)
+            ))
+            order.extend(sorted(remaining, key=lambda module: sort_key_by_module[module]))
+
+        self._order = order
+
+    #
+    # Queries
+    #
+
+    def get_dependencies(self, module):
+        """
+        :return: The modules that need to be built before the provided module.
+        """
+        return set(self._dependencies.get(module, ()))
+
+    def get_dependents(self, module, recursive=False):
+        """
+        :return: The modules that need to be built after the provided module.
+        :param recursive: If True, the dependents of the dependents will also be returned.
+        """
+        if not recursive:
+            return set(self._dependents.get(module, ()))
+
+        result = set()
+        stack = [module]
+        while stack:
+            for dependent in self._dependents.get(stack.pop(), ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    stack.append(dependent)
+        return result
+
+    def get_levels(self):
+        """
+        Group the modules by their distance to the root of the dependency graph.
+        All the modules in the same level are independent and can be prepared in any order.
+        :return: A list of list of modules.
+        """
+        level_by_module = {}
+        for module in self._order:
+            dependencies = [dependency for dependency in self._dependencies[module] if dependency in level_by_module]
+            level_by_module[module] = max(level_by_module[dependency] + 1 for dependency in dependencies) if dependencies else 0
+
+        levels = []
+        for module in self._order:
+            level = level_by_module[module]
+            while len(levels) <= level:
+                levels.append([])
+            levels[level].append(module)
+        return levels
+
+    #
+    # Report
+    #
+
+    STATUS_BUILT = 'built'
+    STATUS_REBUILT = 'rebuilt'
+    STATUS_SKIPPED = 'skipped'
+
+    def set_status(self, module, status, reason=None):
+        self._status_by_module[module] = (status, reason)
+
+    def get_status(self, module):
+        """
+        :return: A tuple containing the status of the module during the last execution and the reason.
+        """
+        return self._status_by_module.get(module, (None, None))
+
+    def get_report(self):
+        """
+        :return: A list of tuple (module, status, reason) in build order.
+        """
+        return [(module,) + self.get_status(module) for module in self._order]
+
+    #
+    # Timing
+    #
+
+    def set_duration(self, module, duration):
+        self._durations[module] = duration
+
+    def get_duration(self, module):
+        return self._durations.get(module, 0.0)
+
+    def get_critical_path(self, durations=None):
+        """
+        Resolve the longest chain of dependent modules.
+        :param durations: A dict of build time by module. If not provided, the durations recorded during the last execution will be used.
+        :return: A tuple containing the list of modules in the critical path and the total duration.
+        """
+        if durations is None:
+            durations = self._durations
+
+        total_by_module = {}
+        previous_by_module = {}
+        for module in self._order:
+            # Note: Only consider resolved dependencies, this protect us against circular dependencies.
+            dependencies = [dependency for dependency in self._dependencies[module] if dependency in total_by_module]
+            previous = max(dependencies, key=lambda dependency: total_by_module[dependency]) if dependencies else None
+            previous_by_module[module] = previous
+            total_by_module[module] = durations.get(module, 0.0) + total_by_module.get(previous, 0.0)
+
+        if not total_by_module:
+            return [], 0.0
+
+        module = max(self._order, key=lambda module: total_by_module[module])
+        total = total_by_module[module]
+        path = []
+        while module is not None:
+            path.append(module)
+            module = previous_by_module[module]
+        return list(reversed(path)), total
@@ -4,6 +4,7 @@ import logging as log
 import pymel.core as pymel
 from classNode import Node
 from omtk.core import classNode
+from omtk.core import className
 from omtk.libs import libRigging, libAttr, libPymel
 from omtk.libs import libPymel
 from omtk.libs import libAttr
@@ -101,7 +102,7 @@ class BaseCtrl(Node):
             super(BaseCtrl, self).build(name=None, *args, **kwargs)
 
         if name:
-            self.node.rename(name)
+            self.node.rename(className.reserve_name(name, owner=self))
 
         # Create an intermediate parent if necessary
         if self._create_offset:
@@ -298,13 +299,7 @@ class BaseCtrl(Node):
         target_names = []
 
         # Resolve modules
-        modules = set()
-        while jnt:
-            module = rig.get_module_by_input(jnt)
-            if module:
-                modules.add(module)
-                #targets.update(module.get_pin_locations())
-            jnt = jnt.getParent()
+        modules = rig.get_module_chain_by_input(jnt)
 
         for module in modules:
             for target, target_name in module.get_pin_locations():
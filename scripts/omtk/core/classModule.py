@@ -1,4 +1,6 @@
 import pymel.core as pymel
+import hashlib
+import json
 import logging
 import re
 logging.basicConfig()
@@ -204,32 +206,32 @@ class Module(object):
     # of the objects can be random if the user didn't care enough.
     #
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('input',))
     def jnts(self):
         fn_is_jnt = lambda obj: libPymel.isinstance_of_transform(obj, pymel.nodetypes.Joint)
         jnts = filter(fn_is_jnt, self.input)
         return jnts
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts',))
     def jnt(self):
         """
         Return the first input joint. Usefull for system like Avars that only handle one influence.
         """
         return next(iter(self.jnts), None)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('input',))
     def chains(self):
         return libPymel.get_chains_from_objs(self.input)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('chains',))
     def chain(self):
         return next(iter(self.chains), None)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts',))
     def chains_jnt(self):
         return libPymel.get_chains_from_objs(self.jnts)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('chains_jnt',))
     def chain_jnt(self):
         return next(iter(self.chains_jnt), None)
 
@@ -240,6 +242,7 @@ class Module(object):
         self.grp_rig = None
         self.canPinTo = True  # If raised, the network can be used as a space-switch pin-point
         self.globalScale = None  # Each module is responsible for handling it scale!
+        self.build_fingerprint = None  # The fingerprint of the module when it was built. (see get_fingerprint)
 
         if input:
             if not isinstance(input, list):
@@ -307,6 +310,41 @@ class Module(object):
             if parent_obj:
                 self.parent_to(parent_obj)
 
+    def get_fingerprint(self):
+        """
+        Compute a hash representing everything that can affect the result of the build.
+        This include the serializable configuration, the inputs names and the inputs world matrices.
+        Used by Rig.build(incremental=True) to know if a module need to be rebuilt.
+        Note that since the inputs world matrices are used, the rig is expected to be in it's bind pose.
+        :return: A string.
+        """
+        def is_basic_value(val):
+            if isinstance(val, (list, tuple)):
+                return all(is_basic_value(subval) for subval in val)
+            return val is None or isinstance(val, (bool, int, long, float, basestring))
+
+        data = [self.__class__.__name__]
+
+        # Hash the configuration.
+        for key, val in sorted(self.__dict__.iteritems()):
+            if key.startswith('_') or key == 'build_fingerprint':
+                continue
+            if is_basic_value(val):
+                data.append((key, val))
+
+        # Hash the inputs
+        for obj in self.input:
+            if not libPymel.is_valid_PyNode(obj):
+                data.append(None)
+                continue
+            data.append(obj.longName())
+            if isinstance(obj, pymel.nodetypes.Transform):
+                tm = obj.getMatrix(worldSpace=True)
+                data.append(tuple(round(val, 4) for row in tm for val in row))
+
+        # json don't differentiate str and unicode values, they become unicode when imported from a network.
+        return hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()
+
     def get_parent_obj(self, rig):
         """
         :return: The object to act as the parent of the module if applicable.
@@ -358,11 +396,10 @@ class Module(object):
             self.grp_rig = None
 
         self.globalScale = None
+        self.build_fingerprint = None
 
         # Reset any cached properties
-        # todo: ensure it's the best way
-        if '_cache' in self.__dict__:
-            self.__dict__.pop('_cache')
+        libPython.invalidate_cached_properties(self)
 
     def get_parent(self, parent):
         """
@@ -1,9 +1,152 @@
 from maya import cmds
+import collections
+import contextlib
 import copy
 
 # TODO: Find a way to have different naming for different production.
 # Maybe handle it in the rig directly?
 
+_registry = None  # The active NameRegistry, see use_registry.
+
+
+class NameRegistry(object):
+    """
+    Keep track of used names to resolve unique names without querying maya for each candidate.
+    The names reserved by the registry are remembered so two requests for the same name won't collide
+    even if the first one was not created yet.
+    Each time a requested name need to be changed, a collision is recorded.
+    See tests/doctest_className.txt for examples.
+    """
+    str_format = '{0}{1}'
+
+    def __init__(self, names=None, fn_exists=None, fn_names=None):
+        """
+        :param names: The names already in use.
+        :param fn_exists: An optional function used to validate a candidate name before returning it.
+        This protect us against names that were created without the registry knowing it.
+        :param fn_names: An optional function returning the names already in use.
+        It is only called the first time the registry is queried.
+        """
+        self._names = set(names) if names else set()
+        self._fn_names = fn_names
+        self._next_index_by_name = {}
+        self._collisions = []
+        self._fn_exists = fn_exists
+
+    @classmethod
+    def from_scene(cls):
+        """
+        Create a registry from the nodes in the scene.
+        The scene is queried once, the first time the registry is used.
+        """
+        # Note: ls return the shortest unique path, cmds.objExists compare against the node name.
+        def fn_names():
+            return (name.split('|')[-1] for name in cmds.ls() or [])
+        return cls(fn_exists=cmds.objExists, fn_names=fn_names)
+
+    def is_primed(self):
+        """
+        :return: True if the names already in use were resolved.
+        """
+        return self._fn_names is None
+
+    def _get_names(self):
+        if self._fn_names is not None:
+            self._names.update(self._fn_names())
+            self._fn_names = None
+        return self._names
+
+    def __contains__(self, name):
+        return name in self._get_names()
+
+    def __len__(self):
+        return len(self._get_names())
+
+    def is_unique(self, name):
+        return name not in self._get_names()
+
+    def add(self, name):
+        self._get_names().add(name)
+
+    def remove(self, name):
+        self._get_names().discard(name)
+
+    def _is_available(self, name):
+        names = self._get_names()
+        if name in names:
+            return False
+        if self._fn_exists and self._fn_exists(name):
+            names.add(name)
+            return False
+        return True
+
+    def get_unique_name(self, name):
+        """
+        :return: The provided name if available, otherwise the name with the smallest available numeric suffix.
+        """
+        if self._is_available(name):
+            return name
+
+        # Resume where we stopped the last time to prevent re-testing the same suffixes.
+        i = self._next_index_by_name.get(name, 1)
+        while not self._is_available(self.str_format.format(name, i)):
+            i += 1
+        self._next_index_by_name[name] = i + 1
+        return self.str_format.format(name, i)
+
+    def reserve(self, name, owner=None):
+        """
+        Resolve a unique name and flag it as used.
+        :param owner: The object requesting the name, used in the collision report.
+        :return: The reserved name.
+        """
+        unique_name = self.get_unique_name(name)
+        if unique_name != name:
+            self._collisions.append((name, unique_name, owner))
+        self._get_names().add(unique_name)
+        return unique_name
+
+    def get_collisions(self):
+        """
+        :return: A list of tuple (requested name, reserved name, owner) for each name that needed to be changed.
+        """
+        return list(self._collisions)
+
+    def get_collisions_report(self):
+        """
+        :return: A dict of reserved names by requested name.
+        """
+        report = collections.OrderedDict()
+        for requested, reserved, _ in self._collisions:
+            report.setdefault(requested, []).append(reserved)
+        return report
+
+
+@contextlib.contextmanager
+def use_registry(registry):
+    """
+    Make BaseName.get_unique_name use the provided registry until the context exit.
+    """
+    global _registry
+    previous = _registry
+    _registry = registry
+    try:
+        yield registry
+    finally:
+        _registry = previous
+
+
+def reserve_name(name, owner=None):
+    """
+    Reserve a name in the active registry, see use_registry.
+    Used when creating nodes so two nodes created during a build never share the same name.
+    :param owner: The object requesting the name, used in the collision report.
+    :return: The reserved name, or the provided name if no registry is active.
+    """
+    if _registry is None:
+        return name
+    return _registry.reserve(name, owner=owner)
+
 class BaseName(object):
     """
     This class handle the naming of object.
@@ -152,6 +295,10 @@ class BaseName(object):
         self.tokens.insert(0, prefix)
 
     def get_unique_name(self, name):
+        # If a registry is active (ex: during a build), use it instead of querying maya for each candidate.
+        if _registry is not None:
+            return _registry.reserve(name, owner=self)
+
         if cmds.objExists(name):
             i = 1
             while cmds.objExists(name + str(i)):
@@ -1,4 +1,5 @@
 import pymel.core as pymel
+from omtk.core import className
 from omtk.libs import libPymel
 from omtk.libs import libRigging
 
@@ -31,7 +32,7 @@ class Node(object):
     def build(self, name=None, *args, **kwargs):
         self.node = self.__createNode__(*args, **kwargs)
         if name:
-            self.node.rename(name)  # TODO: Prevent name collision?
+            self.node.rename(className.reserve_name(name, owner=self))
 
     # TODO: If it work well, implement the logic in classCtrl!
     def add_layer(self, name=None):
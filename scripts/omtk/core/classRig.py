@@ -5,11 +5,15 @@ import time
 from omtk.modules import rigFaceAvarGrps
 from omtk.core.classCtrl import BaseCtrl
 from omtk.core.classNode import Node
+from omtk.core.classBuildPlan import BuildPlan
 from omtk.core import className
 from omtk.core import classModule
+from omtk.libs import libGeometry
 from omtk.libs import libPymel
 from omtk.libs import libPython
 from omtk.libs import libRigging
+from omtk.libs import libSkinning
+from omtk.libs import libTelemetry
 import logging
 log = logging.getLogger('omtk')
 
@@ -89,13 +93,15 @@ class Rig(object):
     # collections.MutableSequence implementation
     #
     def __getitem__(self, item):
-        self.modules.__getitem__(item)
+        return self.modules.__getitem__(item)
 
     def __setitem__(self, index, value):
         self.modules.__setitem__(index, value)
+        self.invalidate_module_index()
 
     def __delitem__(self, index):
         self.modules.__delitem__(index)
+        self.invalidate_module_index()
 
     def __len__(self):
         return self.modules.__len__()
@@ -103,6 +109,7 @@ class Rig(object):
     def insert(self, index, value):
         self.modules.insert(index, value)
         value._parent = self # Store the parent for optimized network serialization (see libs.libSerialization)
+        self.invalidate_module_index()
 
     def __iter__(self):
         return iter(self.modules)
@@ -117,6 +124,11 @@ class Rig(object):
         self.layer_anm = None
         self.layer_geo = None
         self.layer_rig = None
+        self._build_plan = None
+        self._modules_by_input = None  # see get_module_by_input
+        self._modules_by_input_signature = None
+        self._module_name_registry = None  # see _get_module_name_registry
+        self._name_registry = None  # see get_name_registry
 
     def __str__(self):
         return '{0} <{1}>'.format(self.name, self.__class__.__name__)
@@ -135,6 +147,8 @@ class Rig(object):
         except (AttributeError, TypeError):
             pass
 
+        self.invalidate_module_index()
+
 
     #
     # Main implementation
@@ -143,16 +157,43 @@ class Rig(object):
     def _is_name_unique(self, name):
         return not any((True for module in self.modules if module.name == name))
 
+    def _get_module_name_registry(self):
+        # Note: libSerialization don't call __init__, the attribute might not exist.
+        registry = getattr(self, '_module_name_registry', None)
+        if registry is None:
+            registry = self._module_name_registry = className.NameRegistry(module.name for module in self.modules or [])
+        return registry
+
     def _get_unique_name(self, name):
-        if self._is_name_unique(name):
-            return name
+        return self._get_module_name_registry().get_unique_name(name)
 
-        str_format = '{0}{1}'
+    def rename_module(self, module, name):
+        """
+        Rename a module and keep the module names registry up to date.
+        """
+        registry = self._get_module_name_registry()
+        if not any(other is not module and other.name == module.name for other in self.modules):
+            registry.remove(module.name)
+        module.name = name
+        registry.add(name)
+        libPython.invalidate_memoized(module)  # The nomenclature depend on the name
 
-        i = 1
-        while not self._is_name_unique(str_format.format(name, i)):
-            i += 1
-        return str_format.format(name, i)
+    def get_name_registry(self):
+        """
+        :return: The registry of scene names used by the current or last build.
+        It is primed from the scene the first time it is accessed.
+        """
+        registry = getattr(self, '_name_registry', None)
+        if registry is None:
+            registry = self._name_registry = className.NameRegistry.from_scene()
+        return registry
+
+    def get_name_collisions(self):
+        """
+        :return: A list of tuple (requested name, reserved name, owner) for names that needed to be changed.
+        """
+        registry = getattr(self, '_name_registry', None)
+        return registry.get_collisions() if registry else []
 
     def add_module(self, cls_name, *args, **kwargs):
         #if not isinstance(part, Module):
@@ -167,10 +208,11 @@ class Rig(object):
 
         # Resolve name to use
         default_name = instance.get_default_name(self)
-        default_name = self._get_unique_name(default_name)  # Ensure name is unique
+        default_name = self._get_module_name_registry().reserve(default_name, owner=instance)  # Ensure name is unique
         instance.name = default_name
 
         self.modules.append(instance)
+        self._modules_by_input = None  # see invalidate_module_index, the module names registry is already up to date.
         return instance
 
     def is_built(self):
@@ -206,13 +248,18 @@ class Rig(object):
     def _is_influence(self, jnt):
         return True
 
-    def get_potential_influences(self):
+    def get_potential_influences(self, snapshot=None):
         """
         Return all objects that are being seem as potential influences for the rig.
         Mainly used by the uiLogic.
-        :key: Provide a function for filtering the results.
+        :param snapshot: An optional libPymel.SceneSnapshot to use instead of querying maya.
         """
-        result = pymel.ls(type='joint') + list(set([shape.getParent() for shape in pymel.ls(type='nurbsSurface')]))
+        if snapshot is not None:
+            result = snapshot.ls(type='joint') + list(set(
+                snapshot.get_parent(shape) for shape in snapshot.ls(type='nurbsSurface')
+            ))
+        else:
+            result = pymel.ls(type='joint') + list(set([shape.getParent() for shape in pymel.ls(type='nurbsSurface')]))
         return filter(self._is_influence, result)
 
     @libPython.memoized
@@ -269,6 +316,7 @@ class Rig(object):
         """
         self.pre_build()
 
+    @libTelemetry.traced('pre_build', category='phase')
     def pre_build(self, create_grp_jnt=True, create_grp_anm=True, create_grp_rig=True, create_grp_geo=True, create_display_layers=True):
         # Ensure we got a root joint
         # If needed, parent orphan joints to this one
@@ -340,14 +388,54 @@ class Rig(object):
                 self.layer_geo.color.set(12)  # Green?
                 self.layer_geo.displayType.set(2)  # Frozen
 
-    def build(self, **kwargs):
+    def _unbuild_dirty_modules(self, plan):
+        """
+        Unbuild any built module that changed since it was built and any module depending on them.
+        :param plan: The BuildPlan to use to resolve the dependent modules.
+        :return: A dict of reason by unbuilt modules.
+        """
+        reason_by_module = {}
+        for module in plan:
+            if not module.is_built():
+                continue
+            if module.build_fingerprint is None:
+                reason_by_module[module] = "no fingerprint recorded"
+            elif module.build_fingerprint != module.get_fingerprint():
+                reason_by_module[module] = "configuration or inputs changed"
+
+        for module in reason_by_module.keys():
+            for dependent in plan.get_dependents(module, recursive=True):
+                if dependent not in reason_by_module and dependent.is_built():
+                    reason_by_module[dependent] = "depend on {0}".format(module)
+
+        # Unbuild in reverse order so the dependents are unbuilt first.
+        for module in reversed(list(plan)):
+            if module in reason_by_module:
+                log.info("Unbuilding {0}: {1}".format(module, reason_by_module[module]))
+                module.unbuild()
+
+        return reason_by_module
+
+    @libTelemetry.traced('Rig.build', category='rig')
+    def build(self, incremental=False, **kwargs):
+        """
+        :param incremental: If True, only the modules that changed since their last build (and their dependents) will be rebuilt.
+        :param kwargs: Potential parameters to pass recursively to the build method of each module.
+        :return: True if successful.
+        """
         # Aboard if already built
-        if self.is_built():
+        if not incremental and self.is_built():
             log.warning("Can't build {0} because it's already built!".format(self))
             return False
 
         sTime = time.time()
 
+        # The scene is about to change, discard any cached query.
+        # The deformation index is rebuilt once on the first query of the build. (see libSkinning)
+        libPython.invalidate_all_memoized()
+        libSkinning.invalidate_deformation_index()
+        self.invalidate_module_index()
+
         #
         # Prebuild
         #
@@ -358,18 +446,39 @@ class Rig(object):
         # Build
         #
 
-        modules = sorted(self.modules, key=(lambda module: libPymel.get_num_parents(module.chain_jnt.start)))
-        for module in modules:
-            #try:
-            if not module.is_built():
-                print("Building {0}...".format(module))
-                module.build(self, **kwargs)
-                self.post_buid_module(module)
-                #except Exception, e:
-                #    logging.error("\n\nAUTORIG BUILD FAIL! (see log)\n")
-                #    traceback.print_stack()
-                #    logging.error(str(e))
-                #    raise e
+        plan = self.get_build_plan()
+        reason_by_dirty_module = self._unbuild_dirty_modules(plan) if incremental else {}
+
+        # The name registry query the scene once, the first time a node name is reserved during the build.
+        self._name_registry = className.NameRegistry.from_scene()
+
+        # Group the modules modifications in a single undo chunk and skip the pymel layer when possible.
+        # The mesh snapshots are validated once, building the modules deform the meshes they query.
+        with libRigging.batch(), className.use_registry(self._name_registry), libGeometry.snapshot_session():
+            for module in plan:
+                #try:
+                if not module.is_built():
+                    log.info("Building {0}...".format(module))
+                    module_sTime = time.time()
+                    with libTelemetry.span(module.name, category='module', cls=module.__class__.__name__):
+                        with libTelemetry.span('build', category='phase'):
+                            module.build(self, **kwargs)
+                        with libTelemetry.span('post_buid_module', category='phase'):
+                            self.post_buid_module(module)
+                    # Note that the fingerprint is computed after the build since it is compared against built modules.
+                    module.build_fingerprint = module.get_fingerprint()
+                    plan.set_duration(module, time.time() - module_sTime)
+                    if module in reason_by_dirty_module:
+                        plan.set_status(module, plan.STATUS_REBUILT, reason_by_dirty_module[module])
+                    else:
+                        plan.set_status(module, plan.STATUS_BUILT)
+                    #except Exception, e:
+                    #    logging.error("\n\nAUTORIG BUILD FAIL! (see log)\n")
+                    #    traceback.print_stack()
+                    #    logging.error(str(e))
+                    #    raise e
+                else:
+                    plan.set_status(module, plan.STATUS_SKIPPED, "unchanged" if incremental else "already built")
 
         # Connect global scale to jnt root
         if self.grp_rig:
@@ -380,10 +489,33 @@ class Rig(object):
                 pymel.connectAttr(self.grp_anm.globalScale, self.grp_jnt.scaleY, force=True)
                 pymel.connectAttr(self.grp_anm.globalScale, self.grp_jnt.scaleZ, force=True)
 
-        print ("[classRigRoot.Build] took {0} ms".format(time.time() - sTime))
+        log.info("[classRigRoot.Build] took {0:.3f} seconds".format(time.time() - sTime))
+
+        for module, status, reason in plan.get_report():
+            if status == plan.STATUS_SKIPPED:
+                log.info("Skipped {0}: {1}".format(module, reason))
+
+        for requested, reserved, owner in self._name_registry.get_collisions():
+            log.warning("Name {0} was already used, {1} was used instead.".format(requested, reserved))
+
+        self._build_plan = plan
 
         return True
 
+    def get_build_plan(self, modules=None):
+        """
+        Resolve the dependencies between the modules.
+        :param modules: The modules to include in the plan. By default all modules are used.
+        :return: A BuildPlan instance. Iterating it yield the modules in the order they need to be built.
+        """
+        return BuildPlan(self, modules=modules)
+
+    def get_last_build_plan(self):
+        """
+        :return: The BuildPlan used by the last build. It contain the build time of each module.
+        """
+        return self._build_plan
+
     def post_buid_module(self, module):
         # Raise warnings if a module leave junk in the scene.
         if module.grp_anm and not module.grp_anm.getChildren():
@@ -419,11 +551,16 @@ class Rig(object):
             pymel.connectAttr(self.grp_anm.globalScale, module.globalScale, force=True)
 
 
+    @libTelemetry.traced('Rig.unbuild', category='rig')
     def unbuild(self, **kwargs):
         """
         :param kwargs: Potential parameters to pass recursively to the unbuild method of each module.
         :return: True if successful.
         """
+        # The scene is about to change, discard any cached query.
+        libPython.invalidate_all_memoized()
+        self.invalidate_module_index()
+
         # Unbuild all children
         for child in self.modules:
             if child.is_built():
@@ -460,10 +597,94 @@ class Rig(object):
     # Utility methods
     #
 
+    def invalidate_module_index(self):
+        """
+        Flag the input to module index and the module names registry as dirty. They will be rebuilt on the next query.
+        This need to be called when the modules or their inputs are modified outside of the Rig methods.
+        """
+        self._modules_by_input = None
+        self._module_name_registry = None
+
+    def _get_module_index_signature(self):
+        # Cheap enough to be checked on each query, notice modules and inputs that were added, removed or replaced.
+        return tuple(
+            (id(module), id(module.input), len(module.input) if module.input else 0) for module in self.modules or []
+        )
+
+    def _get_module_index(self):
+        # Note: libSerialization don't call __init__, the attributes might not exist.
+        index = getattr(self, '_modules_by_input', None)
+        signature = self._get_module_index_signature()
+
+        # Protect us against modules that modified their inputs without invalidating the index. (ex: during their build)
+        if index is not None and signature != getattr(self, '_modules_by_input_signature', None):
+            index = None
+
+        if index is None:
+            index = {}
+            for module in self.modules or []:
+                if not module.input:
+                    continue
+                for obj in module.input:
+                    modules = index.setdefault(obj, [])
+                    if module not in modules:
+                        modules.append(module)
+            self._modules_by_input = index
+            self._modules_by_input_signature = signature
+        return index
+
+    def _get_modules_by_input(self, index, obj):
+        # Replacing an input in place keep the same signature (see invalidate_module_index),
+        # at least ignore the modules that don't use obj anymore.
+        return [module for module in index.get(obj, ()) if module.input and obj in module.input]
+
+    def get_modules_by_input(self, obj):
+        """
+        :return: All the modules that use obj as an input, in declaration order.
+        """
+        return self._get_modules_by_input(self._get_module_index(), obj)
+
     def get_module_by_input(self, obj):
-        for module in self.modules:
-            if obj in module.input:
-                return module
+        """
+        :return: The first module that use obj as an input, if any.
+        """
+        return next(iter(self.get_modules_by_input(obj)), None)
+
+    def get_module_chains_by_inputs(self, objs):
+        """
+        Resolve the module owning each provided object and each of it's parents.
+        Like get_module_by_input, only the first module using an object as input is considered it's owner.
+        The ancestors are shared between the objects so each of them is only resolved once.
+        :param objs: A list of pymel.PyNode.
+        :return: A dict of modules by object. The modules are unique and sorted from the nearest to the farthest.
+        """
+        index = self._get_module_index()
+        chain_by_obj = {}
+
+        def _get_chain(obj):
+            # Walk upward until we reach an object already resolved.
+            stack = []
+            while obj is not None and obj not in chain_by_obj:
+                stack.append(obj)
+                obj = obj.getParent()
+
+            chain = chain_by_obj[obj] if obj is not None else []
+            for node in reversed(stack):
+                module = next(iter(self._get_modules_by_input(index, node)), None)
+                if module is not None and module not in chain:
+                    chain = [module] + chain
+                chain_by_obj[node] = chain
+            return chain
+
+        return dict((obj, list(_get_chain(obj))) for obj in objs if obj is not None)
+
+    def get_module_chain_by_input(self, obj):
+        """
+        :return: The modules owning obj or any of it's parents, from the nearest to the farthest.
+        """
+        if obj is None:
+            return []
+        return self.get_module_chains_by_inputs([obj])[obj]
 
     #
     # Facial and avars utility methods
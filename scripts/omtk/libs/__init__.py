@@ -9,24 +9,34 @@ if re.match('maya.*', os.path.basename(sys.executable), re.IGNORECASE):
 import libAttr
 import libCtrlShapes
 import libFormula
+import libGeometry
+import libNetwork
 import libPython
 import libQt
 import libPymel
 import libSkeleton
 import libRigging
+import libSegments
+import libSerializationIO
 import libSkinning
 import libStringMap
+import libTelemetry
 import libUtils
 
 def _reload():
     reload(libAttr)
     reload(libCtrlShapes)
     reload(libFormula)
+    reload(libGeometry)
+    reload(libNetwork)
     reload(libPython)
     reload(libQt)
     reload(libPymel)
     reload(libSkeleton)
     reload(libRigging)
+    reload(libSegments)
+    reload(libSerializationIO)
     reload(libSkinning)
     reload(libStringMap)
+    reload(libTelemetry)
     reload(libUtils)
\ No newline at end of file
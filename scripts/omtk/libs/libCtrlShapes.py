@@ -170,7 +170,17 @@ def _get_bounds_using_raycast(positions, dirs, geometries, parent_tm=None, filte
     min_x = max_x = min_y = max_y = min_z = max_z = None
     parent_tm_inv = parent_tm.inverse()
 
-    # Ray-cast
+    # Ray-cast every positions in every directions at once.
+    origins = [pos for pos in positions for dir in dirs]
+    directions = [dir for pos in positions for dir in dirs]
+    if libRigging.numpy is not None and origins:
+        _, points = libRigging.ray_cast_batch(origins, directions, geometries)
+        points = points[~libRigging.numpy.isnan(points[:, 0])]
+        ray_cast_positions = [pymel.datatypes.Point(*point) for point in points.tolist()]
+    else:
+        ray_cast_positions = [libRigging.ray_cast_nearest(pos, dir, geometries) for pos, dir in zip(origins, directions)]
+        ray_cast_positions = [pos for pos in ray_cast_positions if pos is not None]
+
     for pos in positions:
         #x = pos.x
         #y = pos.y
@@ -195,29 +205,25 @@ def _get_bounds_using_raycast(positions, dirs, geometries, parent_tm=None, filte
         if max_z is None or z_local > max_z:
             max_z = z_local
 
-        for dir in dirs:
-            ray_cast_pos = libRigging.ray_cast_nearest(pos, dir, geometries, debug=False)
-            if ray_cast_pos is None:
-                continue
-
-            if parent_tm is not None:
-                ray_cast_pos = ray_cast_pos * parent_tm_inv
-
-            x = ray_cast_pos.x
-            y = ray_cast_pos.y
-            z = ray_cast_pos.z
-            if min_x is None or x < min_x:
-                min_x = x
-            if max_x is None or x > max_x:
-                max_x = x
-            if min_y is None or y < min_y:
-                min_y = y
-            if max_y is None or y > max_y:
-                max_y = y
-            if min_z is None or z < min_z:
-                min_z = z
-            if max_z is None or z > max_z:
-                max_z = z
+    for ray_cast_pos in ray_cast_positions:
+        if parent_tm is not None:
+            ray_cast_pos = ray_cast_pos * parent_tm_inv
+
+        x = ray_cast_pos.x
+        y = ray_cast_pos.y
+        z = ray_cast_pos.z
+        if min_x is None or x < min_x:
+            min_x = x
+        if max_x is None or x > max_x:
+            max_x = x
+        if min_y is None or y < min_y:
+            min_y = y
+        if max_y is None or y > max_y:
+            max_y = y
+        if min_z is None or z < min_z:
+            min_z = z
+        if max_z is None or z > max_z:
+            max_z = z
 
     return min_x, max_x, min_y, max_y, min_z, max_z
 
@@ -0,0 +1,732 @@
+"""
+Snapshot of maya meshes in numpy arrays and geometry queries (ray casts, closest points, bounds) using a
+bounding volume hierarchy (BVH) of the triangles.
+Once a snapshot is taken, the queries don't hit maya. The BVH classes only use numpy so they can be tested and
+benchmarked without a maya scene.
+
+The snapshots are cached by mesh and reused as long as the points and the topology don't change. Maya callbacks
+flag a snapshot as dirty when it's mesh change so the points are only read again when needed.
+
+Usage:
+    snapshot = libGeometry.get_mesh_snapshot(mesh)
+    distances, points, triangles = snapshot.ray_cast(origins, directions)
+    points, distances, triangles, barycentrics = snapshot.get_closest_points(positions)
+    points, uvs = snapshot.get_closest_points_and_uvs(positions)
+"""
+import collections
+import contextlib
+import hashlib
+import logging
+
+import pymel.core as pymel
+from maya import cmds
+from maya import OpenMaya
+
+from omtk.libs import libPython
+
+# numpy is not shipped with every maya version, it is needed by every function of this module.
+numpy = None
+if libPython.does_module_exist('numpy'):
+    import numpy
+
+log = logging.getLogger('omtk')
+
+# Maximum number of triangles in a BVH leaf.
+LEAF_SIZE = 8
+
+# Maximum number of mesh snapshots to keep in memory.
+MAX_CACHE_SIZE = 32
+
+
+#
+# Triangles
+#
+
+def _dot(a, b):
+    return (a * b).sum(axis=1)
+
+
+def intersect_triangles(origins, directions, v0, v1, v2, tolerance=1.0e-9):
+    """
+    Vectorized Moller-Trumbore ray/triangle intersection. Each ray is tested against the triangle of the same index.
+    :return: The ray parameter of each intersection (n,). Missed triangles have nan values.
+    """
+    e1 = v1 - v0
+    e2 = v2 - v0
+    pvec = numpy.cross(directions, e2)
+    det = _dot(e1, pvec)
+    valid = numpy.abs(det) > 1.0e-15  # parallel to the triangle
+    inv_det = 1.0 / numpy.where(valid, det, 1.0)
+
+    tvec = origins - v0
+    u = _dot(tvec, pvec) * inv_det
+    qvec = numpy.cross(tvec, e1)
+    v = _dot(directions, qvec) * inv_det
+    t = _dot(e2, qvec) * inv_det
+
+    hit = valid & (u >= -tolerance) & (v >= -tolerance) & (u + v <= 1.0 + tolerance) & (t > tolerance)
+    return numpy.where(hit, t, numpy.nan)
+
+
+def get_closest_points_on_triangles(positions, a, b, c):
+    """
+    Vectorized closest point on triangle. (see Real-Time Collision Detection, Christer Ericson, 5.1.5)
+    Each position is tested against the triangle of the same index.
+    :return: The closest points (n, 3) and their barycentric coordinates (n, 3).
+    """
+    ab = b - a
+    ac = c - a
+    ap = positions - a
+    bp = positions - b
+    cp = positions - c
+    d1 = _dot(ab, ap)
+    d2 = _dot(ac, ap)
+    d3 = _dot(ab, bp)
+    d4 = _dot(ac, bp)
+    d5 = _dot(ab, cp)
+    d6 = _dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    def _safe_div(num, den):
+        return num / numpy.where(den == 0, 1.0, den)
+
+    # Inside the face region
+    denom = _safe_div(1.0, va + vb + vc)
+    v = vb * denom
+    w = vc * denom
+    bary = numpy.column_stack((1.0 - v - w, v, w))
+
+    # The regions are applied from the lowest priority to the highest.
+    regions = []
+
+    # Edge region BC
+    w = _safe_div(d4 - d3, (d4 - d3) + (d5 - d6))
+    regions.append(((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), (numpy.zeros_like(w), 1.0 - w, w)))
+
+    # Edge region AC
+    w = _safe_div(d2, d2 - d6)
+    regions.append(((vb <= 0) & (d2 >= 0) & (d6 <= 0), (1.0 - w, numpy.zeros_like(w), w)))
+
+    # Vertex region C
+    regions.append(((d6 >= 0) & (d5 <= d6), (0.0, 0.0, 1.0)))
+
+    # Edge region AB
+    v = _safe_div(d1, d1 - d3)
+    regions.append(((vc <= 0) & (d1 >= 0) & (d3 <= 0), (1.0 - v, v, numpy.zeros_like(v))))
+
+    # Vertex region B
+    regions.append(((d3 >= 0) & (d4 <= d3), (0.0, 1.0, 0.0)))
+
+    # Vertex region A
+    regions.append(((d1 <= 0) & (d2 <= 0), (1.0, 0.0, 0.0)))
+
+    for mask, vals in regions:
+        for i, val in enumerate(vals):
+            bary[:, i] = numpy.where(mask, val, bary[:, i])
+
+    points = a * bary[:, 0:1] + b * bary[:, 1:2] + c * bary[:, 2:3]
+    return points, bary
+
+
+#
+# BVH
+#
+
+class BVH(object):
+    """
+    Bounding volume hierarchy of the triangles of a mesh.
+    The nodes are stored in flat arrays and the queries traverse the tree breadth-first for all the queries at once.
+    :param points: The position of each vertex (n, 3).
+    :param triangles: The vertex indices of each triangle (m, 3).
+    """
+    def __init__(self, points, triangles, leaf_size=LEAF_SIZE):
+        self.points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        self.triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape(-1, 3)
+        self.leaf_size = leaf_size
+
+        self.node_min = None  # bounding box minimum of each node (k, 3)
+        self.node_max = None  # bounding box maximum of each node (k, 3)
+        self.node_left = None  # index of the first child, -1 for leaves
+        self.node_right = None  # index of the second child, -1 for leaves
+        self.node_start = None  # index of the first triangle of a leaf in self.order
+        self.node_count = None  # number of triangles of a leaf, 0 for inner nodes
+        self.order = None  # triangle indices sorted by leaf
+
+        self._build()
+
+    def __len__(self):
+        return len(self.node_min)
+
+    def __str__(self):
+        return '<BVH {0} triangles, {1} nodes>'.format(len(self.triangles), len(self))
+
+    def _get_triangle_points(self, triangles):
+        tris = self.triangles[triangles]
+        return self.points[tris[:, 0]], self.points[tris[:, 1]], self.points[tris[:, 2]]
+
+    def _build(self):
+        num_triangles = len(self.triangles)
+        v0, v1, v2 = self._get_triangle_points(numpy.arange(num_triangles))
+        tri_min = numpy.minimum(numpy.minimum(v0, v1), v2)
+        tri_max = numpy.maximum(numpy.maximum(v0, v1), v2)
+        centroids = (v0 + v1 + v2) / 3.0
+
+        order = numpy.arange(num_triangles)
+        node_min = []
+        node_max = []
+        node_left = []
+        node_right = []
+        node_start = []
+        node_count = []
+
+        def _add_node(start, end):
+            indices = order[start:end]
+            node_min.append(tri_min[indices].min(axis=0) if len(indices) else numpy.zeros(3))
+            node_max.append(tri_max[indices].max(axis=0) if len(indices) else numpy.zeros(3))
+            node_left.append(-1)
+            node_right.append(-1)
+            node_start.append(start)
+            node_count.append(end - start)
+            return len(node_min) - 1
+
+        stack = [(_add_node(0, num_triangles), 0, num_triangles)]
+        while stack:
+            node, start, end = stack.pop()
+            count = end - start
+            if count <= self.leaf_size:
+                continue
+
+            # Split at the median centroid along the longest axis.
+            indices = order[start:end]
+            sub_centroids = centroids[indices]
+            extent = sub_centroids.max(axis=0) - sub_centroids.min(axis=0)
+            axis = int(numpy.argmax(extent))
+            if extent[axis] <= 0:
+                continue  # All the centroids are at the same position, keep it as a leaf.
+            mid = count // 2
+            order[start:end] = indices[numpy.argpartition(sub_centroids[:, axis], mid)]
+
+            left = _add_node(start, start + mid)
+            right = _add_node(start + mid, end)
+            node_left[node] = left
+            node_right[node] = right
+            node_count[node] = 0
+            stack.append((left, start, start + mid))
+            stack.append((right, start + mid, end))
+
+        self.node_min = numpy.array(node_min, dtype=numpy.float64).reshape(-1, 3)
+        self.node_max = numpy.array(node_max, dtype=numpy.float64).reshape(-1, 3)
+        self.node_left = numpy.array(node_left, dtype=numpy.int64)
+        self.node_right = numpy.array(node_right, dtype=numpy.int64)
+        self.node_start = numpy.array(node_start, dtype=numpy.int64)
+        self.node_count = numpy.array(node_count, dtype=numpy.int64)
+        self.order = order
+
+    def _expand_leaves(self, query_ids, node_ids):
+        """
+        Convert (query, leaf) pairs to (query, triangle) pairs.
+        """
+        counts = self.node_count[node_ids]
+        total = counts.sum()
+        rep_queries = numpy.repeat(query_ids, counts)
+        # Offset of each pair in the leaf, then the position of the leaf triangles in self.order.
+        offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        triangles = self.order[numpy.repeat(self.node_start[node_ids], counts) + offsets]
+        return rep_queries, triangles
+
+    def _expand_children(self, query_ids, node_ids):
+        return (
+            numpy.concatenate((query_ids, query_ids)),
+            numpy.concatenate((self.node_left[node_ids], self.node_right[node_ids]))
+        )
+
+    def get_bounds(self):
+        """
+        :return: The minimum and maximum of the bounding box of the mesh.
+        """
+        return self.node_min[0].copy(), self.node_max[0].copy()
+
+    def get_triangles_in_bounds(self, bound_min, bound_max):
+        """
+        :return: The sorted indices of the triangles whose bounding box overlap the provided bounding box.
+        """
+        bound_min = numpy.asarray(bound_min, dtype=numpy.float64)
+        bound_max = numpy.asarray(bound_max, dtype=numpy.float64)
+        result = []
+        node_ids = numpy.zeros(1, dtype=numpy.int64)
+        while len(node_ids):
+            overlap = numpy.all((self.node_min[node_ids] <= bound_max) & (self.node_max[node_ids] >= bound_min), axis=1)
+            node_ids = node_ids[overlap]
+            is_leaf = self.node_left[node_ids] == -1
+            if is_leaf.any():
+                leaves = node_ids[is_leaf]
+                _, triangles = self._expand_leaves(numpy.zeros(len(leaves), dtype=numpy.int64), leaves)
+                v0, v1, v2 = self._get_triangle_points(triangles)
+                tri_min = numpy.minimum(numpy.minimum(v0, v1), v2)
+                tri_max = numpy.maximum(numpy.maximum(v0, v1), v2)
+                overlap = numpy.all((tri_min <= bound_max) & (tri_max >= bound_min), axis=1)
+                result.append(triangles[overlap])
+            node_ids = node_ids[~is_leaf]
+            node_ids = numpy.concatenate((self.node_left[node_ids], self.node_right[node_ids]))
+
+        if not result:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.sort(numpy.concatenate(result))
+
+    def ray_cast(self, origins, directions, farthest=False, tolerance=1.0e-9):
+        """
+        :param origins: The origin of each ray (n, 3).
+        :param directions: The direction of each ray (n, 3), they don't need to be normalized.
+        :param farthest: If True, the farthest hit of each ray is returned instead of the nearest.
+        :return: The distance of each hit (n,), the position of each hit (n, 3) and the triangle hit (n,).
+        Rays that don't hit anything have nan distances and positions and -1 triangles.
+        """
+        origins = numpy.asarray(origins, dtype=numpy.float64).reshape(-1, 3)
+        directions = numpy.asarray(directions, dtype=numpy.float64).reshape(-1, 3)
+        num_rays = len(origins)
+
+        # Normalize the directions so the ray parameter is the distance.
+        lengths = numpy.sqrt(_dot(directions, directions))
+        directions = directions / numpy.where(lengths == 0, 1.0, lengths)[:, numpy.newaxis]
+        # Avoid divisions by zero in the slab test.
+        safe_directions = numpy.where(numpy.abs(directions) < 1.0e-12, 1.0e-12, directions)
+        inv_directions = 1.0 / safe_directions
+
+        best = numpy.full(num_rays, -numpy.inf if farthest else numpy.inf)
+        best_triangles = numpy.full(num_rays, -1, dtype=numpy.int64)
+
+        ray_ids = numpy.arange(num_rays)[lengths > 0]
+        node_ids = numpy.zeros(len(ray_ids), dtype=numpy.int64)
+        while len(ray_ids):
+            # Slab test
+            o = origins[ray_ids]
+            inv = inv_directions[ray_ids]
+            t1 = (self.node_min[node_ids] - o) * inv
+            t2 = (self.node_max[node_ids] - o) * inv
+            t_min = numpy.minimum(t1, t2).max(axis=1)
+            t_max = numpy.maximum(t1, t2).min(axis=1)
+            hit = t_max >= numpy.maximum(t_min, 0.0)
+            if not farthest:
+                hit &= t_min <= best[ray_ids]
+            ray_ids = ray_ids[hit]
+            node_ids = node_ids[hit]
+
+            is_leaf = self.node_left[node_ids] == -1
+            if is_leaf.any():
+                rep_rays, triangles = self._expand_leaves(ray_ids[is_leaf], node_ids[is_leaf])
+                v0, v1, v2 = self._get_triangle_points(triangles)
+                t = intersect_triangles(origins[rep_rays], directions[rep_rays], v0, v1, v2, tolerance=tolerance)
+                valid = ~numpy.isnan(t)
+                rep_rays = rep_rays[valid]
+                triangles = triangles[valid]
+                t = t[valid]
+                if farthest:
+                    numpy.maximum.at(best, rep_rays, t)
+                else:
+                    numpy.minimum.at(best, rep_rays, t)
+                is_best = t == best[rep_rays]
+                best_triangles[rep_rays[is_best]] = triangles[is_best]
+
+            ray_ids, node_ids = self._expand_children(ray_ids[~is_leaf], node_ids[~is_leaf])
+
+        missed = best_triangles == -1
+        distances = numpy.where(missed, numpy.nan, best)
+        points = origins + directions * distances[:, numpy.newaxis]
+        return distances, points, best_triangles
+
+    def get_closest_points(self, positions):
+        """
+        :param positions: The query positions (n, 3).
+        :return: The closest point on the mesh (n, 3), the distance to it (n,), the triangle containing it (n,)
+        and it's barycentric coordinates in the triangle (n, 3).
+        """
+        positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+        num_queries = len(positions)
+
+        best = numpy.full(num_queries, numpy.inf)  # squared distance to the closest triangle found
+        bound = numpy.full(num_queries, numpy.inf)  # squared distance that we know contain a triangle
+        best_points = numpy.full((num_queries, 3), numpy.nan)
+        best_barycentrics = numpy.full((num_queries, 3), numpy.nan)
+        best_triangles = numpy.full(num_queries, -1, dtype=numpy.int64)
+
+        # Start with a tight upper bound by descending toward the nearest leaf of each query.
+        node_ids = numpy.zeros(num_queries, dtype=numpy.int64)
+        while True:
+            is_inner = self.node_left[node_ids] != -1
+            if not is_inner.any():
+                break
+            inner = node_ids[is_inner]
+            p = positions[is_inner]
+            left = self.node_left[inner]
+            right = self.node_right[inner]
+            dist_left = ((p - numpy.clip(p, self.node_min[left], self.node_max[left])) ** 2).sum(axis=1)
+            dist_right = ((p - numpy.clip(p, self.node_min[right], self.node_max[right])) ** 2).sum(axis=1)
+            node_ids[is_inner] = numpy.where(dist_left <= dist_right, left, right)
+        rep_queries, triangles = self._expand_leaves(numpy.arange(num_queries), node_ids)
+        if len(triangles):
+            v0, v1, v2 = self._get_triangle_points(triangles)
+            points, _ = get_closest_points_on_triangles(positions[rep_queries], v0, v1, v2)
+            dist = ((points - positions[rep_queries]) ** 2).sum(axis=1)
+            dist[numpy.isnan(dist)] = numpy.inf
+            numpy.minimum.at(bound, rep_queries, dist)
+
+        query_ids = numpy.arange(num_queries)
+        node_ids = numpy.zeros(len(query_ids), dtype=numpy.int64)
+        while len(query_ids):
+            p = positions[query_ids]
+            node_min = self.node_min[node_ids]
+            node_max = self.node_max[node_ids]
+
+            # The nearest point of the box is a lower bound, the farthest corner is an upper bound
+            # since the box contain at least one triangle.
+            nearest = numpy.clip(p, node_min, node_max)
+            dist_min = ((p - nearest) ** 2).sum(axis=1)
+            farthest = numpy.maximum(numpy.abs(p - node_min), numpy.abs(p - node_max))
+            dist_max = (farthest ** 2).sum(axis=1)
+            numpy.minimum.at(bound, query_ids, dist_max)
+
+            keep = dist_min <= bound[query_ids]
+            query_ids = query_ids[keep]
+            node_ids = node_ids[keep]
+
+            is_leaf = self.node_left[node_ids] == -1
+            if is_leaf.any():
+                rep_queries, triangles = self._expand_leaves(query_ids[is_leaf], node_ids[is_leaf])
+                v0, v1, v2 = self._get_triangle_points(triangles)
+                points, barycentrics = get_closest_points_on_triangles(positions[rep_queries], v0, v1, v2)
+                dist = ((points - positions[rep_queries]) ** 2).sum(axis=1)
+                dist[numpy.isnan(dist)] = numpy.inf
+                numpy.minimum.at(best, rep_queries, dist)
+                numpy.minimum.at(bound, rep_queries, dist)
+                is_best = dist == best[rep_queries]
+                best_points[rep_queries[is_best]] = points[is_best]
+                best_barycentrics[rep_queries[is_best]] = barycentrics[is_best]
+                best_triangles[rep_queries[is_best]] = triangles[is_best]
+
+            query_ids, node_ids = self._expand_children(query_ids[~is_leaf], node_ids[~is_leaf])
+
+        return best_points, numpy.sqrt(best), best_triangles, best_barycentrics
+
+
+#
+# Mesh snapshots
+#
+
+def get_points_hash(points):
+    """
+    :return: A hash of the points positions, used to know if a mesh was deformed.
+    """
+    return hashlib.md5(numpy.ascontiguousarray(points, dtype=numpy.float64).tostring()).hexdigest()
+
+
+class MeshSnapshot(object):
+    """
+    World-space points and triangles of a mesh. The BVH is only built on the first query.
+    :param points: The world position of each vertex (n, 3).
+    :param triangles: The vertex indices of each triangle (m, 3).
+    :param triangle_faces: The polygon index of each triangle (m,).
+    :param uvs: The u and v values of each uv (k, 2).
+    :param triangle_uvs: The uv indices of each triangle (m, 3), -1 if the polygon have no uvs.
+    """
+    def __init__(self, points, triangles, triangle_faces=None, topology=None, uvs=None, triangle_uvs=None):
+        self.points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        self.triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape(-1, 3)
+        self.triangle_faces = numpy.asarray(triangle_faces, dtype=numpy.int64) \
+            if triangle_faces is not None else numpy.arange(len(self.triangles))
+        self.topology = topology
+        self.uvs = numpy.asarray(uvs, dtype=numpy.float64).reshape(-1, 2) if uvs is not None else None
+        self.triangle_uvs = numpy.asarray(triangle_uvs, dtype=numpy.int64).reshape(-1, 3) \
+            if triangle_uvs is not None else None
+        self.points_hash = get_points_hash(self.points)
+        self._bvh = None
+
+    def __str__(self):
+        return '<MeshSnapshot {0} points, {1} triangles>'.format(len(self.points), len(self.triangles))
+
+    @property
+    def bvh(self):
+        if self._bvh is None:
+            self._bvh = BVH(self.points, self.triangles)
+        return self._bvh
+
+    def get_bounds(self):
+        if not len(self.points):
+            return None
+        return self.points.min(axis=0), self.points.max(axis=0)
+
+    def get_triangles_in_bounds(self, bound_min, bound_max):
+        return self.bvh.get_triangles_in_bounds(bound_min, bound_max)
+
+    def ray_cast(self, origins, directions, farthest=False, tolerance=1.0e-9):
+        return self.bvh.ray_cast(origins, directions, farthest=farthest, tolerance=tolerance)
+
+    def get_closest_points(self, positions):
+        return self.bvh.get_closest_points(positions)
+
+    def get_uvs(self, triangles, barycentrics):
+        """
+        Interpolate the uvs at positions defined by a triangle and barycentric coordinates.
+        :return: The u and v values (n, 2). Positions on polygons without uvs have nan values.
+        """
+        triangles = numpy.asarray(triangles, dtype=numpy.int64)
+        barycentrics = numpy.asarray(barycentrics, dtype=numpy.float64).reshape(-1, 3)
+        result = numpy.full((len(triangles), 2), numpy.nan)
+        if self.uvs is None or not len(self.uvs):
+            return result
+
+        valid = triangles != -1
+        uv_ids = numpy.full((len(triangles), 3), -1, dtype=numpy.int64)
+        uv_ids[valid] = self.triangle_uvs[triangles[valid]]
+        valid &= numpy.all(uv_ids != -1, axis=1)
+
+        uv_ids = uv_ids[valid]
+        bary = barycentrics[valid]
+        result[valid] = self.uvs[uv_ids[:, 0]] * bary[:, 0:1] + \
+                        self.uvs[uv_ids[:, 1]] * bary[:, 1:2] + \
+                        self.uvs[uv_ids[:, 2]] * bary[:, 2:3]
+        return result
+
+    def get_closest_points_and_uvs(self, positions):
+        """
+        :return: The closest point on the mesh (n, 3) and the uvs at this point (n, 2).
+        """
+        points, _, triangles, barycentrics = self.get_closest_points(positions)
+        return points, self.get_uvs(triangles, barycentrics)
+
+
+def _get_mesh_fn(mesh):
+    return OpenMaya.MFnMesh(mesh.__apimdagpath__())
+
+
+def _get_mesh_topology(fn_mesh):
+    """
+    :return: A cheap signature of the mesh topology.
+    """
+    return fn_mesh.numVertices(), fn_mesh.numPolygons(), fn_mesh.numFaceVertices(), fn_mesh.numUVs()
+
+
+def _read_mesh_points(mesh):
+    # xform is much faster than iterating over a MPointArray in python.
+    vals = cmds.xform('{0}.vtx[*]'.format(mesh.longName()), query=True, worldSpace=True, translation=True)
+    return numpy.array(vals or [], dtype=numpy.float64).reshape(-1, 3)
+
+
+def _read_mesh_triangles(fn_mesh):
+    """
+    :return: The vertex indices of each triangle (m, 3) and the polygon index of each triangle (m,).
+    """
+    counts = OpenMaya.MIntArray()
+    vertices = OpenMaya.MIntArray()
+    fn_mesh.getTriangles(counts, vertices)
+    counts = numpy.array(list(counts), dtype=numpy.int64)
+    triangles = numpy.array(list(vertices), dtype=numpy.int64).reshape(-1, 3)
+    triangle_faces = numpy.repeat(numpy.arange(len(counts)), counts)
+    return triangles, triangle_faces
+
+
+def _read_mesh_uvs(fn_mesh, triangles, triangle_faces):
+    """
+    :return: The u and v values of each uv (k, 2) and the uv indices of each triangle (m, 3).
+    """
+    us = OpenMaya.MFloatArray()
+    vs = OpenMaya.MFloatArray()
+    fn_mesh.getUVs(us, vs)
+    uvs = numpy.column_stack((numpy.array(list(us), dtype=numpy.float64), numpy.array(list(vs), dtype=numpy.float64)))
+
+    vertex_counts = OpenMaya.MIntArray()
+    vertex_ids = OpenMaya.MIntArray()
+    fn_mesh.getVertices(vertex_counts, vertex_ids)
+    uv_counts = OpenMaya.MIntArray()
+    uv_ids = OpenMaya.MIntArray()
+    fn_mesh.getAssignedUVs(uv_counts, uv_ids)
+    vertex_counts = numpy.array(list(vertex_counts), dtype=numpy.int64)
+    vertex_ids = numpy.array(list(vertex_ids), dtype=numpy.int64)
+    uv_counts = numpy.array(list(uv_counts), dtype=numpy.int64)
+    uv_ids = numpy.array(list(uv_ids), dtype=numpy.int64)
+
+    # The uvs are assigned per face-vertex. The triangles only know their polygon and vertices so we need to find
+    # the face-vertex of each triangle corner by searching (polygon, vertex) keys.
+    num_vertices = int(vertex_ids.max()) + 1 if len(vertex_ids) else 1
+    face_vertex_faces = numpy.repeat(numpy.arange(len(vertex_counts)), vertex_counts)
+    keys = face_vertex_faces * num_vertices + vertex_ids
+    order = numpy.argsort(keys, kind='mergesort')
+    corner_keys = (triangle_faces[:, numpy.newaxis] * num_vertices + triangles).ravel()
+    face_vertices = order[numpy.searchsorted(keys[order], corner_keys)]
+
+    # Polygons without uvs have no entry in uv_ids.
+    has_uvs = uv_counts[face_vertex_faces] > 0
+    uv_offsets = numpy.cumsum(uv_counts) - uv_counts
+    vertex_offsets = numpy.cumsum(vertex_counts) - vertex_counts
+    uv_positions = uv_offsets[face_vertex_faces] + numpy.arange(len(vertex_ids)) - vertex_offsets[face_vertex_faces]
+    face_vertex_uvs = numpy.full(len(vertex_ids), -1, dtype=numpy.int64)
+    face_vertex_uvs[has_uvs] = uv_ids[uv_positions[has_uvs]]
+
+    return uvs, face_vertex_uvs[face_vertices].reshape(-1, 3)
+
+
+class _SnapshotEntry(object):
+    """
+    A cached snapshot and the callbacks that flag it as dirty when the mesh or it's parents change.
+    """
+    __slots__ = ('handle', 'snapshot', 'dirty', 'callback_ids')
+
+    def __init__(self, mobj, snapshot):
+        self.handle = OpenMaya.MObjectHandle(mobj)
+        self.snapshot = snapshot
+        self.dirty = False
+        self.callback_ids = []
+
+    def is_node(self, mobj):
+        # The hashCode of a MObjectHandle is not unique, make sure the entry is about the same node.
+        return self.handle.isValid() and self.handle.object() == mobj
+
+    def remove_callbacks(self):
+        for callback_id in self.callback_ids:
+            OpenMaya.MMessage.removeCallback(callback_id)
+        self.callback_ids = []
+
+
+def _on_mesh_dirty(*args):
+    # The client data is always the last argument.
+    entry = _snapshot_by_key.get(args[-1])
+    if entry is not None:
+        entry.dirty = True
+
+
+def _add_snapshot_callbacks(entry, mesh, key):
+    """
+    Flag the entry as dirty when the mesh is evaluated again (deformation, topology change) or when one of it's
+    parents move. Validating a snapshot read all the points so we only do it when maya tell us something changed.
+    """
+    entry.callback_ids.append(OpenMaya.MNodeMessage.addNodeDirtyCallback(entry.handle.object(), _on_mesh_dirty, key))
+    # addWorldMatrixModifiedCallback is not available in older maya versions, in that case we can't trust the
+    # snapshot when it's parents move.
+    if hasattr(OpenMaya.MDagMessage, 'addWorldMatrixModifiedCallback'):
+        entry.callback_ids.append(
+            OpenMaya.MDagMessage.addWorldMatrixModifiedCallback(mesh.__apimdagpath__(), _on_mesh_dirty, key)
+        )
+    else:
+        entry.dirty = True
+
+
+def _discard_entry(entry):
+    if entry is not None:
+        entry.remove_callbacks()
+
+
+# Remove the callbacks registered by a previous import of the module.
+for _entry in globals().get('_snapshot_by_key', {}).values():
+    for _callback_id in getattr(_entry, 'callback_ids', []):
+        OpenMaya.MMessage.removeCallback(_callback_id)
+_snapshot_by_key = collections.OrderedDict()
+
+
+# The keys of the snapshots validated during the active session, None outside of a session.
+_session_keys = None
+
+
+def _get_key(mesh):
+    return OpenMaya.MObjectHandle(mesh.__apimobject__()).hashCode()
+
+
+@contextlib.contextmanager
+def snapshot_session():
+    """
+    Validate each snapshot at most once until the context exit, the following calls to get_mesh_snapshot trust it.
+    Used by builds that query the same meshes while modifying the scene.
+    (ex: the face ctrls are constrained to joints that deform the mesh they are snapped on)
+    """
+    global _session_keys
+    if _session_keys is not None:  # already in a session
+        yield
+        return
+    _session_keys = set()
+    try:
+        yield
+    finally:
+        _session_keys = None
+
+
+def get_mesh_snapshot(mesh, check=True):
+    """
+    :param mesh: A pymel.nodetypes.Mesh or it's transform.
+    :param check: If True and the mesh changed since the snapshot was taken, the cached snapshot is validated
+    against the current points and topology of the mesh. If False, the cached snapshot is always trusted.
+    Inside a snapshot_session, the snapshot is only validated the first time.
+    :return: A MeshSnapshot of the mesh in world space.
+    """
+    if numpy is None:
+        raise Exception("numpy is required to snapshot meshes.")
+
+    if isinstance(mesh, pymel.nodetypes.Transform):
+        mesh = mesh.getShape()
+    if not isinstance(mesh, pymel.nodetypes.Mesh):
+        raise Exception("Expected a mesh, got {0}".format(mesh))
+
+    mobj = mesh.__apimobject__()
+    key = _get_key(mesh)
+    entry = _snapshot_by_key.pop(key, None)
+    if entry is not None and not entry.is_node(mobj):
+        _discard_entry(entry)
+        entry = None
+    snapshot = entry.snapshot if entry is not None else None
+    if _session_keys is not None:
+        if key in _session_keys:
+            check = False
+        _session_keys.add(key)
+
+    if snapshot is not None and check and entry.dirty:
+        fn_mesh = _get_mesh_fn(mesh)
+        topology = _get_mesh_topology(fn_mesh)
+        if topology != snapshot.topology:
+            log.debug("Topology of {0} changed, discarding it's snapshot.".format(mesh))
+            snapshot = None
+        else:
+            points = _read_mesh_points(mesh)
+            if get_points_hash(points) != snapshot.points_hash:
+                log.debug("{0} was deformed, discarding it's snapshot.".format(mesh))
+                # The topology did not change, we can reuse the triangles and the uvs.
+                snapshot = MeshSnapshot(
+                    points, snapshot.triangles, snapshot.triangle_faces, topology=topology,
+                    uvs=snapshot.uvs, triangle_uvs=snapshot.triangle_uvs
+                )
+
+    if snapshot is None:
+        fn_mesh = _get_mesh_fn(mesh)
+        triangles, triangle_faces = _read_mesh_triangles(fn_mesh)
+        uvs, triangle_uvs = _read_mesh_uvs(fn_mesh, triangles, triangle_faces)
+        snapshot = MeshSnapshot(
+            _read_mesh_points(mesh), triangles, triangle_faces, topology=_get_mesh_topology(fn_mesh),
+            uvs=uvs, triangle_uvs=triangle_uvs
+        )
+
+    if entry is None:
+        entry = _SnapshotEntry(mobj, snapshot)
+        _add_snapshot_callbacks(entry, mesh, key)
+    else:
+        entry.snapshot = snapshot
+        if check:
+            entry.dirty = False
+
+    # Keep the most recently used snapshots.
+    _snapshot_by_key[key] = entry
+    while len(_snapshot_by_key) > MAX_CACHE_SIZE:
+        _discard_entry(_snapshot_by_key.popitem(last=False)[1])
+
+    return snapshot
+
+
+def invalidate_mesh_snapshot(mesh=None):
+    """
+    :param mesh: The mesh to discard from the cache. If None, the whole cache is discarded.
+    """
+    if mesh is None:
+        for entry in _snapshot_by_key.values():
+            _discard_entry(entry)
+        _snapshot_by_key.clear()
+        return
+    if isinstance(mesh, pymel.nodetypes.Transform):
+        mesh = mesh.getShape()
+    _discard_entry(_snapshot_by_key.pop(_get_key(mesh), None))
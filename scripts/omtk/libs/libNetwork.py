@@ -0,0 +1,842 @@
+"""
+Index of the serialized network nodes in the scene.
+libSerialization.getNetworksByClass scan every network in the scene and import_network rebuild the python instances
+each time it is called. Both are expensive in scenes that contain a lot of serialized objects.
+
+The index remember the networks of each class the first time a class is queried, then maintain itself using
+node added/removed callbacks. Imported instances are memoized per network and invalidated as soon as any attribute
+of the network (or any network it depend on) change.
+
+Usage:
+    networks = libNetwork.get_networks_by_class('Rig')
+    rigs = [libNetwork.import_network(network) for network in networks]
+
+Networks can also be imported lazily. The returned object only read it's attributes (and import it's child networks)
+when they are accessed. This is useful for tools that only need a small part of a rig (ex: animation tools).
+    limb = libNetwork.import_network_lazy(network)
+    limb.snap_ik_to_fk()
+"""
+import inspect
+import logging
+
+import libSerialization
+import pymel.core as pymel
+from maya import OpenMaya
+
+log = logging.getLogger('omtk')
+
+# Attribute messages that can affect the result of an import.
+_ATTR_CHANGE_MASK = (
+    OpenMaya.MNodeMessage.kConnectionMade |
+    OpenMaya.MNodeMessage.kConnectionBroken |
+    OpenMaya.MNodeMessage.kAttributeSet |
+    OpenMaya.MNodeMessage.kAttributeAdded |
+    OpenMaya.MNodeMessage.kAttributeRemoved |
+    OpenMaya.MNodeMessage.kAttributeArrayAdded |
+    OpenMaya.MNodeMessage.kAttributeArrayRemoved
+)
+
+
+def _get_key(obj):
+    """
+    :return: A key that identify a node for it's whole lifetime, even if it is renamed.
+    """
+    if isinstance(obj, pymel.PyNode):
+        obj = obj.__apimobject__()
+    return OpenMaya.MObjectHandle(obj).hashCode()
+
+
+def get_child_networks(network):
+    """
+    :return: All the networks recursively connected to the provided network attributes, including itself.
+    """
+    result = []
+    known = set()
+    stack = [network]
+    while stack:
+        node = stack.pop()
+        key = _get_key(node)
+        if key in known:
+            continue
+        known.add(key)
+        result.append(node)
+        # Children networks are connected to their parent attributes.
+        stack.extend(pymel.listConnections(node, source=True, destination=False, type='network') or [])
+    return result
+
+
+class NetworkIndex(object):
+    def __init__(self):
+        self._networks_by_cls = {}  # class name -> list of network PyNode
+        self._pending = []  # MObjectHandle of the networks created since the last query
+        self._instance_by_key = {}  # (network key, import kwargs) -> imported instance
+        self._memo_keys_by_dependency = {}  # network key -> set of memo keys to invalidate when it change
+        self._attr_callback_by_key = {}  # network key -> callback id
+        self._stale_callback_ids = []  # callbacks that can't be removed while they are executing
+        self._callback_ids = []
+
+        self.num_hits = 0
+        self.num_misses = 0
+
+    #
+    # Callbacks
+    #
+
+    def register_callbacks(self):
+        if self._callback_ids:
+            return
+        self._callback_ids = [
+            OpenMaya.MDGMessage.addNodeAddedCallback(self._on_network_added, 'network'),
+            OpenMaya.MDGMessage.addNodeRemovedCallback(self._on_network_removed, 'network'),
+            OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterOpen, self._on_scene_changed),
+            OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterNew, self._on_scene_changed)
+        ]
+
+    def unregister_callbacks(self):
+        self.clear()
+        for callback_id in self._callback_ids:
+            OpenMaya.MMessage.removeCallback(callback_id)
+        self._callback_ids = []
+        self._remove_stale_callbacks()
+
+    def _remove_stale_callbacks(self):
+        for callback_id in self._stale_callback_ids:
+            try:
+                OpenMaya.MMessage.removeCallback(callback_id)
+            except RuntimeError:  # The node was deleted and took it's callbacks with it.
+                pass
+        self._stale_callback_ids = []
+
+    def _on_network_added(self, mobj, *args):
+        # Note: The attributes are not set yet when the node is created, the class is resolved on the next query.
+        if self._networks_by_cls:
+            self._pending.append(OpenMaya.MObjectHandle(mobj))
+
+    def _on_network_removed(self, mobj, *args):
+        key = _get_key(mobj)
+        for cls_name, networks in self._networks_by_cls.iteritems():
+            self._networks_by_cls[cls_name] = [network for network in networks if _get_key(network) != key]
+        self._invalidate_dependency(key)
+
+    def _on_network_attr_changed(self, msg, plug, other_plug, key):
+        if msg & _ATTR_CHANGE_MASK:
+            self._invalidate_dependency(key)
+
+    def _on_scene_changed(self, *args):
+        self.clear()
+
+    #
+    # Networks
+    #
+
+    def clear(self):
+        self._networks_by_cls = {}
+        self._pending = []
+        self.clear_imports()
+
+    def _process_pending(self):
+        pending = self._pending
+        self._pending = []
+        for handle in pending:
+            if not handle.isValid():
+                continue
+            network = pymel.PyNode(handle.object())
+            for cls_name, networks in self._networks_by_cls.iteritems():
+                if network not in networks and libSerialization.isNetworkInstanceOfClass(network, cls_name):
+                    networks.append(network)
+
+    def get_networks_by_class(self, cls_name):
+        """
+        Equivalent to libSerialization.getNetworksByClass.
+        The scene is only scanned the first time a class is queried.
+        """
+        self.register_callbacks()
+        self._process_pending()
+
+        networks = self._networks_by_cls.get(cls_name)
+        if networks is None:
+            networks = self._networks_by_cls[cls_name] = list(libSerialization.getNetworksByClass(cls_name))
+        return list(networks)
+
+    #
+    # Imports
+    #
+
+    def clear_imports(self):
+        self._instance_by_key = {}
+        self._memo_keys_by_dependency = {}
+        self._stale_callback_ids.extend(self._attr_callback_by_key.values())
+        self._attr_callback_by_key = {}
+
+    def invalidate_network(self, network):
+        """
+        Forget the memoized imports of a network and of the networks connected to it.
+        Used when an imported instance was modified in a way that can't be exported. (ex: a failed build)
+        """
+        for node in get_child_networks(network):
+            self._invalidate_dependency(_get_key(node))
+
+    def _invalidate_dependency(self, key):
+        memo_keys = self._memo_keys_by_dependency.pop(key, None)
+        if memo_keys:
+            for memo_key in memo_keys:
+                self._instance_by_key.pop(memo_key, None)
+
+        callback_id = self._attr_callback_by_key.pop(key, None)
+        if callback_id is not None:
+            self._stale_callback_ids.append(callback_id)
+
+    def _watch(self, network, memo_key, recursive=True):
+        """
+        Invalidate a memoized import when the network, or any network it is connected to, change.
+        """
+        for node in get_child_networks(network) if recursive else [network]:
+            key = _get_key(node)
+            self._memo_keys_by_dependency.setdefault(key, set()).add(memo_key)
+            if key not in self._attr_callback_by_key:
+                self._attr_callback_by_key[key] = OpenMaya.MNodeMessage.addAttributeChangedCallback(
+                    node.__apimobject__(), self._on_network_attr_changed, key
+                )
+
+    def import_network(self, network, use_cache=True, **kwargs):
+        """
+        Equivalent to libSerialization.import_network but memoized.
+        Note that the same instance is returned until the network change,
+        modifications done to the instance without exporting it will be visible to the next caller.
+        :param use_cache: If False, the network is always imported.
+        """
+        self._remove_stale_callbacks()
+        if not use_cache:
+            return libSerialization.import_network(network, **kwargs)
+
+        instance = self.get_imported(network, **kwargs)
+        if instance is not None:
+            self.num_hits += 1
+            return instance
+
+        self.num_misses += 1
+        instance = libSerialization.import_network(network, **kwargs)
+        if instance is not None:
+            self.set_imported(network, instance, **kwargs)
+        return instance
+
+    def get_imported(self, network, **kwargs):
+        """
+        :return: The memoized import of a network if any.
+        """
+        return self._instance_by_key.get((_get_key(network), tuple(sorted(kwargs.iteritems()))))
+
+    def set_imported(self, network, instance, **kwargs):
+        """
+        Memoize an instance imported by other means. (ex: from a cache)
+        """
+        memo_key = (_get_key(network), tuple(sorted(kwargs.iteritems())))
+        self.register_callbacks()
+        self._instance_by_key[memo_key] = instance
+        self._watch(network, memo_key)
+
+    def import_network_lazy(self, network):
+        """
+        Import a network as a lazy object. The attributes and child networks are only resolved on first access.
+        The lazy objects are memoized per network and invalidated when their network change.
+        """
+        self._remove_stale_callbacks()
+        memo_key = ('lazy', _get_key(network))
+        try:
+            instance = self._instance_by_key[memo_key]
+            self.num_hits += 1
+            return instance
+        except KeyError:
+            pass
+
+        self.num_misses += 1
+        instance = _create_lazy(network, self)
+        if instance is not None:
+            self.register_callbacks()
+            self._instance_by_key[memo_key] = instance
+            # Since the child networks are resolved separately, we only need to watch the network itself.
+            self._watch(network, memo_key, recursive=False)
+
+            # Mimic libSerialization behavior, this only resolve the few attributes the callbacks touch.
+            # The instance is memoized first since the callback can resolve networks referencing it.
+            if is_lazy(instance):
+                fn = getattr(instance, '__callbackNetworkPostBuild__', None)
+                if fn:
+                    fn()
+        return instance
+
+    def get_stats(self):
+        return {
+            'classes': dict((cls_name, len(networks)) for cls_name, networks in self._networks_by_cls.iteritems()),
+            'imports': len(self._instance_by_key),
+            'hits': self.num_hits,
+            'misses': self.num_misses
+        }
+
+
+# Remove the callbacks registered by a previous import of the module.
+if globals().get('_index') is not None:
+    _index.unregister_callbacks()
+_index = NetworkIndex()
+
+
+def get_index():
+    return _index
+
+
+def get_networks_by_class(cls_name):
+    return _index.get_networks_by_class(cls_name)
+
+
+def import_network(network, use_cache=True, **kwargs):
+    return _index.import_network(network, use_cache=use_cache, **kwargs)
+
+
+def import_network_lazy(network):
+    return _index.import_network_lazy(network)
+
+
+def invalidate_network(network):
+    _index.invalidate_network(network)
+
+
+def invalidate():
+    """
+    Forget all the indexed networks and memoized imports.
+    """
+    _index.clear()
+
+
+#
+# Lazy import
+#
+
+# Attributes used internally by libSerialization.
+_INTERNAL_ATTR_NAMES = ('_class', '_class_module', '_uid')
+
+
+class _LazyMixin(object):
+    """
+    Mixed with the class of a serialized object to resolve it's attributes from it's network on first access.
+    Resolved values are stored in the instance like any other attribute.
+    """
+    def __getattr__(self, name):
+        # Don't interfere with python internals.
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        pending = self.__dict__.get('_lazy_pending')
+        if pending and name in pending:
+            return _resolve_attr(self, name)
+
+        # Delegate to the original class if it also resolve attributes dynamically. (ex: classNode.Node)
+        for cls in type(self).__mro__[2:]:
+            fn = cls.__dict__.get('__getattr__')
+            if fn is not None:
+                _materialize_attrs(self)
+                return fn(self, name)
+
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+
+_lazy_cls_by_cls = {}
+
+
+def _get_lazy_cls(cls):
+    lazy_cls = _lazy_cls_by_cls.get(cls)
+    if lazy_cls is None:
+        lazy_cls = _lazy_cls_by_cls[cls] = type(cls.__name__, (_LazyMixin, cls), {'__module__': cls.__module__})
+    return lazy_cls
+
+
+def _resolve_class(network):
+    """
+    :return: The class of the object serialized in a network or None if it can't be resolved.
+    """
+    if not network.hasAttr('_class'):
+        return None
+    cls_name = network.attr('_class').get().split('.')[-1]
+
+    if network.hasAttr('_class_module'):
+        try:
+            module = __import__(network.attr('_class_module').get(), fromlist=[cls_name])
+            return getattr(module, cls_name)
+        except (ImportError, AttributeError):
+            pass
+
+    from omtk.libs import libPython
+    from omtk.core import classModule, classNode, classRig
+    for base_class in (classRig.Rig, classModule.Module, classNode.Node):
+        cls = libPython.get_class_def(cls_name, base_class=base_class)
+        if cls is not None:
+            return cls
+
+
+def _create_lazy(network, index):
+    cls = _resolve_class(network)
+    if cls is None:
+        log.warning("Can't resolve class of {0}, importing it completely.".format(network))
+        return libSerialization.import_network(network)
+
+    lazy_cls = _get_lazy_cls(cls)
+    try:
+        instance = lazy_cls()
+    except TypeError:  # __init__ need arguments
+        instance = lazy_cls.__new__(lazy_cls)
+
+    names = set(
+        name for name in pymel.listAttr(network, userDefined=True) or []
+        if '.' not in name and name not in _INTERNAL_ATTR_NAMES
+    )
+    # Remove the default values set by __init__ so the serialized values are resolved instead.
+    for name in names:
+        instance.__dict__.pop(name, None)
+
+    instance.__dict__['_network'] = network
+    instance.__dict__['_lazy_index'] = index
+    instance.__dict__['_lazy_pending'] = names
+
+    # Attributes that also exist on the class would shadow the serialized value and __getattr__ would never be
+    # called for them, resolve them now.
+    for name in list(names):
+        if hasattr(cls, name):
+            _resolve_attr(instance, name)
+
+    return instance
+
+
+def _read_plug(plug, index):
+    """
+    :return: The value represented by a message plug. Child networks are imported lazily.
+    """
+    inputs = plug.inputs(plugs=True)
+    if not inputs:
+        return None
+    source = inputs[0]
+    node = source.node()
+    if source.longName() != 'message':
+        return source
+    if isinstance(node, pymel.nodetypes.Network) and node.hasAttr('_class'):
+        return index.import_network_lazy(node)
+    return node
+
+
+def _read_attr(attr, index):
+    if attr.isMulti():
+        if attr.type() == 'message':
+            return [_read_plug(attr.elementByLogicalIndex(i), index) for i in attr.getArrayIndices()]
+        return [attr.elementByLogicalIndex(i).get() for i in attr.getArrayIndices()]
+    if attr.type() == 'message':
+        return _read_plug(attr, index)
+    return attr.get()
+
+
+def _resolve_attr(obj, name):
+    """
+    Read a pending attribute of a lazy object from it's network and store it in the instance.
+    """
+    obj.__dict__['_lazy_pending'].discard(name)
+    val = _read_attr(obj.__dict__['_network'].attr(name), obj.__dict__['_lazy_index'])
+    obj.__dict__[name] = val
+    return val
+
+
+def _materialize_attrs(obj):
+    pending = obj.__dict__.get('_lazy_pending')
+    while pending:
+        _resolve_attr(obj, next(iter(pending)))
+
+
+def is_lazy(obj):
+    return isinstance(obj, _LazyMixin)
+
+
+def materialize(obj, recursive=False):
+    """
+    Resolve all the attributes of a lazy object and convert it to it's original class.
+    This need to be done before exporting the object since libSerialization rely on the class of the object.
+    :param recursive: If True, lazy objects referenced by the object will also be materialized.
+    :return: The provided object.
+    """
+    known = set()
+    stack = [obj]
+    while stack:
+        val = stack.pop()
+        if id(val) in known:
+            continue
+        known.add(id(val))
+
+        if isinstance(val, (list, tuple)):
+            if recursive:
+                stack.extend(val)
+            continue
+        if not is_lazy(val):
+            continue
+
+        _materialize_attrs(val)
+        for name in ('_lazy_index', '_lazy_pending'):
+            val.__dict__.pop(name, None)
+        val.__class__ = type(val).__mro__[2]
+        if recursive:
+            stack.extend(val.__dict__.values())
+    return obj
+
+
+#
+# Differential export
+#
+
+class _FallbackError(Exception):
+    """
+    Raised when a differential export is not possible and the whole network need to be re-exported.
+    """
+
+
+class _NeverExportedError(_FallbackError):
+    """
+    Raised when the object to export differentially don't have a network yet.
+    """
+
+
+def _accept_argument(fn, name):
+    try:
+        argspec = inspect.getargspec(fn)
+    except TypeError:  # not a python function
+        return False
+    return name in argspec.args or argspec.keywords is not None
+
+
+def _check_diff_support():
+    """
+    Raise a _FallbackError if the installed libSerialization don't provide what DiffExporter need.
+    """
+    try:
+        import libSerialization.cache
+    except ImportError:
+        raise _FallbackError("libSerialization.cache is not available.")
+    if not hasattr(libSerialization.cache, 'Cache'):
+        raise _FallbackError("libSerialization.cache.Cache is not available.")
+    for fn_name, arg_name in (('export_dict', 'recursive'), ('export_network', 'cache')):
+        fn = getattr(libSerialization, fn_name, None)
+        if fn is None or not _accept_argument(fn, arg_name):
+            raise _FallbackError("libSerialization.{0} don't support the {1} argument.".format(fn_name, arg_name))
+
+
+# Maya attribute types compatible with each python type. Used to know if an attribute can be updated in place.
+_ATTR_TYPES_BY_PYTHON_TYPE = (
+    (bool, ('bool',)),
+    ((int, long), ('long', 'short', 'byte', 'enum')),
+    (float, ('double', 'float', 'doubleLinear', 'doubleAngle')),
+    (basestring, ('string',))
+)
+
+_KIND_NONE = 'none'
+_KIND_BASIC = 'basic'
+_KIND_NODE = 'node'
+_KIND_ATTRIBUTE = 'attribute'
+_KIND_LIST = 'list'
+_KIND_COMPLEX = 'complex'
+_KIND_OTHER = 'other'
+
+
+def _get_kind(val):
+    if val is None:
+        return _KIND_NONE
+    if isinstance(val, (bool, int, long, float, basestring)):
+        return _KIND_BASIC
+    if isinstance(val, pymel.Attribute):
+        return _KIND_ATTRIBUTE
+    if isinstance(val, pymel.PyNode):
+        return _KIND_NODE
+    if isinstance(val, (list, tuple)):
+        return _KIND_LIST
+    if isinstance(val, (dict, set)) or isinstance(val, (pymel.datatypes.Vector, pymel.datatypes.Matrix)):
+        return _KIND_OTHER
+    if hasattr(val, '__dict__'):
+        return _KIND_COMPLEX
+    return _KIND_OTHER
+
+
+def _is_attr_compatible(attr, val):
+    attr_type = attr.type()
+    for python_types, attr_types in _ATTR_TYPES_BY_PYTHON_TYPE:
+        if isinstance(val, python_types):
+            return attr_type in attr_types
+    return False
+
+
+def _can_diff_attr_by_name(name):
+    return not name.startswith('_') or name in ('_class', '_class_module')
+
+
+class DiffExporter(object):
+    """
+    Update the networks of an already exported object graph instead of re-creating all of them.
+    The object graph is compared against the existing networks:
+    - Attributes that don't exist anymore are removed.
+    - Existing attributes are updated in place and existing connections are kept when possible.
+    - Objects that don't have a network yet, or that changed in a way that can't be updated in place
+      (ex: new attribute, type or list size change), have their network (and only it) re-exported by libSerialization.
+    - Networks that are not referenced anymore are deleted.
+    """
+    def __init__(self):
+        # libSerialization will re-use any network present in it's cache instead of exporting it again.
+        # This allow us to re-export a single object without re-exporting it's children.
+        from libSerialization.cache import Cache
+        self._cache = Cache()
+        self._network_by_id = {}
+        self._in_progress = set()
+        self._created_networks = []
+
+        self.num_networks_created = 0
+        self.num_networks_deleted = 0
+        self.num_networks_unchanged = 0
+        self.num_attributes_set = 0
+        self.num_attributes_deleted = 0
+        self.num_connections = 0
+
+    def get_report(self):
+        return {
+            'networks_created': self.num_networks_created,
+            'networks_deleted': self.num_networks_deleted,
+            'networks_unchanged': self.num_networks_unchanged,
+            'attributes_set': self.num_attributes_set,
+            'attributes_deleted': self.num_attributes_deleted,
+            'connections': self.num_connections
+        }
+
+    def delete_created_networks(self):
+        """
+        Delete the networks created by the exporter. Used to cleanup after a failed export.
+        """
+        to_delete = [network for network in self._created_networks if network.exists()]
+        if to_delete:
+            pymel.delete(to_delete)
+        self._created_networks = []
+
+    #
+    # Graph traversal
+    #
+
+    def export(self, data, network=None):
+        """
+        :param data: The object to export.
+        :param network: The existing network of the object. If not provided, data._network will be used.
+        :return: The network of the object.
+        """
+        if network is None:
+            network = getattr(data, '_network', None)
+        if network is None or not network.exists():
+            raise _NeverExportedError("{0} was never exported.".format(data))
+
+        previous_networks = get_child_networks(network)
+        result = self._export_obj(data, network=network)
+
+        # Delete the networks that are not used anymore.
+        current_keys = set(_get_key(node) for node in get_child_networks(result))
+        to_delete = [node for node in previous_networks if node.exists() and _get_key(node) not in current_keys]
+        if to_delete:
+            pymel.delete(to_delete)
+            self.num_networks_deleted += len(to_delete)
+
+        return result
+
+    def _export_obj(self, data, network=None):
+        data_id = id(data)
+        result = self._network_by_id.get(data_id)
+        if result is not None:
+            return result
+
+        if data_id in self._in_progress:
+            raise _FallbackError("Found circular reference in {0}".format(data))
+        self._in_progress.add(data_id)
+
+        if network is None:
+            network = getattr(data, '_network', None)
+            if network is not None and not network.exists():
+                network = None
+
+        # Lazy objects need to be converted to their original class before being exported.
+        materialize(data)
+        data_dict = libSerialization.export_dict(data, recursive=False)
+
+        # Children first, this ensure the parent will connect to their up-to-date network.
+        for key, val in data_dict.iteritems():
+            if not _can_diff_attr_by_name(key):
+                continue
+            kind = _get_kind(val)
+            if kind == _KIND_COMPLEX:
+                self._export_obj(val)
+            elif kind == _KIND_LIST:
+                for sub_val in val:
+                    if _get_kind(sub_val) == _KIND_COMPLEX:
+                        self._export_obj(sub_val)
+
+        if network is None or not self._update_network(network, data_dict):
+            old_network = network
+            network = libSerialization.export_network(data, cache=self._cache)
+            self._created_networks.append(network)
+            self.num_networks_created += 1
+            if old_network is not None:
+                pymel.delete(old_network)
+                self.num_networks_deleted += 1
+        else:
+            self.num_networks_unchanged += 1
+
+        self._in_progress.discard(data_id)
+        self._network_by_id[data_id] = network
+        self._cache.set_network_by_id(data_id, network)
+        return network
+
+    #
+    # Attributes
+    #
+
+    def _get_source(self, val):
+        """
+        :return: The plug that need to be connected to a network attribute to represent a value.
+        """
+        kind = _get_kind(val)
+        if kind == _KIND_ATTRIBUTE:
+            return val
+        if kind == _KIND_NODE:
+            return val.message
+        if kind == _KIND_COMPLEX:
+            return self._network_by_id[id(val)].message
+        return None
+
+    def _update_connection(self, attr, val):
+        """
+        :return: False if the attribute can't represent the value.
+        """
+        if attr.type() != 'message' and _get_kind(val) != _KIND_ATTRIBUTE:
+            return False
+        source = self._get_source(val)
+        inputs = attr.inputs(plugs=True)
+        if len(inputs) == 1 and inputs[0] == source:
+            return True
+        pymel.connectAttr(source, attr, force=True)
+        self.num_connections += 1
+        return True
+
+    def _update_value(self, attr, val):
+        if not _is_attr_compatible(attr, val):
+            return False
+        if attr.get() != val:
+            attr.set(val)
+            self.num_attributes_set += 1
+        return True
+
+    def _update_attr(self, attr, val):
+        """
+        Update a network attribute to match a value.
+        :return: False if the attribute can't be updated in place.
+        """
+        kind = _get_kind(val)
+        if kind == _KIND_BASIC:
+            return not attr.isMulti() and self._update_value(attr, val)
+        if kind in (_KIND_NODE, _KIND_ATTRIBUTE, _KIND_COMPLEX):
+            return not attr.isMulti() and self._update_connection(attr, val)
+        if kind == _KIND_LIST:
+            if not attr.isMulti():
+                return False
+            # The list need to have the same size, otherwise we let libSerialization handle it.
+            if list(attr.getArrayIndices()) != range(len(val)):
+                return False
+            for i, sub_val in enumerate(val):
+                sub_kind = _get_kind(sub_val)
+                if sub_kind not in (_KIND_BASIC, _KIND_NODE, _KIND_ATTRIBUTE, _KIND_COMPLEX):
+                    return False
+                sub_attr = attr.elementByLogicalIndex(i)
+                if sub_kind == _KIND_BASIC:
+                    if not self._update_value(sub_attr, sub_val):
+                        return False
+                elif not self._update_connection(sub_attr, sub_val):
+                    return False
+            return True
+
+        # Other types (ex: matrices) are only kept if they did not change.
+        try:
+            return not attr.isMulti() and attr.get() == val
+        except Exception:
+            return False
+
+    def _update_network(self, network, data_dict):
+        """
+        Update the attributes of a network to match the exported dict of an object.
+        :return: False if the network need to be re-exported.
+        """
+        # The class of the object changed.
+        if '_class' in data_dict:
+            if not network.hasAttr('_class') or network.attr('_class').get() != data_dict['_class']:
+                return False
+
+        for key, val in data_dict.iteritems():
+            if not _can_diff_attr_by_name(key) or val is None:
+                continue
+            if not network.hasAttr(key):
+                return False
+            if not self._update_attr(network.attr(key), val):
+                return False
+
+        # Remove attributes of values that are now None or that don't exist anymore.
+        for attr_name in pymel.listAttr(network, userDefined=True) or []:
+            if '.' in attr_name or not _can_diff_attr_by_name(attr_name):
+                continue
+            if data_dict.get(attr_name) is not None or not network.hasAttr(attr_name):
+                continue
+            attr = network.attr(attr_name)
+            if attr.isChild():
+                continue
+            attr.delete()
+            self.num_attributes_deleted += 1
+
+        return True
+
+
+def export_network_diff(data, network=None):
+    """
+    Update the networks of an already exported object to match it's current state.
+    Only the networks and attributes that changed are touched, this is a lot faster than deleting the network
+    and exporting it again and produce smaller undo chunks.
+    If the object was never exported, it is fully exported.
+    :param data: The object to export.
+    :param network: The existing network of the object. If not provided, data._network will be used.
+    :return: A tuple containing the network of the object and a dict reporting the modifications.
+    """
+    exporter = None
+    try:
+        _check_diff_support()
+        exporter = DiffExporter()
+        network = exporter.export(data, network=network)
+        report = exporter.get_report()
+    except _FallbackError as e:
+        # An object that was never exported is expected to be exported completely.
+        if isinstance(e, _NeverExportedError):
+            log.info("{0} was never exported, exporting everything.".format(data))
+        else:
+            log.warning("Can't export {0} differentially, exporting everything. {1}".format(data, e))
+        # Don't leave the networks of a partial export orphaned in the scene.
+        if exporter is not None:
+            exporter.delete_created_networks()
+        if network is None:
+            network = getattr(data, '_network', None)
+        num_deleted = 0
+        if network is not None and network.exists():
+            to_delete = get_child_networks(network)
+            num_deleted = len(to_delete)
+            pymel.delete(to_delete)
+        network = libSerialization.export_network(materialize(data, recursive=True))
+        report = {
+            'networks_created': len(get_child_networks(network)),
+            'networks_deleted': num_deleted,
+            'networks_unchanged': 0,
+            'attributes_set': 0,
+            'attributes_deleted': 0,
+            'connections': 0
+        }
+
+    log.info("Exported {0}: {1}".format(data, ', '.join(
+        '{0} {1}'.format(val, key.replace('_', ' ')) for key, val in sorted(report.iteritems())
+    )))
+    return network, report
@@ -2,6 +2,13 @@ import logging
 
 import pymel.core as pymel
 from maya import OpenMaya
+from omtk.libs import libPython
+from omtk.libs import libSegments
+
+# numpy is not shipped with every maya version, it is only used by SceneSnapshot and SegmentCollection.get_arrays.
+numpy = None
+if libPython.does_module_exist('numpy'):
+    import numpy
 
 
 #
@@ -84,7 +91,306 @@ def duplicate_chain(chain):
     return PyNodeChain(new_chain)
 
 
-def get_num_parents(obj):
+#
+# Scene snapshot
+#
+
+class SceneSnapshot(object):
+    """
+    Read-only view of the scene dag taken in a single pass.
+    Querying a snapshot don't hit maya, this make hierarchy queries (depth, parents, roots) much faster than
+    calling .getParent() recursively on each PyNode.
+    The node are referenced by their index in the snapshot. If numpy is available, the types, parents, depths and
+    is_transform values are stored in numpy arrays and the world matrices in a (n, 4, 4) numpy array,
+    otherwise they are stored in lists and the world matrices are 16-values tuples.
+
+    Note that the snapshot is only invalidated on dag changes (creation, deletion, re-parenting, renaming).
+    If you move nodes, you need to call invalidate_scene_snapshot() yourself.
+
+    Usage:
+        snapshot = libPymel.get_scene_snapshot()
+        snapshot.get_depth(jnt)
+        libPymel.get_chains_from_objs(jnts, snapshot=snapshot)
+    """
+    def __init__(self):
+        self.paths = []  # full path names
+        self.names = []  # shortest unique path names
+        self.types = []  # node type names (ex: 'joint')
+        self.parents = []  # index of the parent or -1 for root nodes
+        self.depths = []  # number of parents
+        self.is_transform = []
+        self.matrices = None  # world matrices
+
+        self._index_by_path = {}
+        self._index_by_name = {}
+        self._children_by_index = None
+        self._indices_by_type = None
+        self._node_by_index = {}
+
+        self._read()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __str__(self):
+        return '<SceneSnapshot {0} nodes>'.format(len(self.paths))
+
+    def _read(self):
+        matrices = []
+
+        it = OpenMaya.MItDag(OpenMaya.MItDag.kDepthFirst, OpenMaya.MFn.kInvalid)
+        dag_path = OpenMaya.MDagPath()
+        fn_dag = OpenMaya.MFnDagNode()
+        while not it.isDone():
+            it.getPath(dag_path)
+            path = dag_path.fullPathName()
+
+            # Ignore the world node and any instance we already know about.
+            if not path or path in self._index_by_path:
+                it.next()
+                continue
+
+            fn_dag.setObject(dag_path)
+            index = len(self.paths)
+
+            # Since we iterate depth-first, the parent is always known before it's children.
+            parent_path = path.rsplit('|', 1)[0]
+            parent = self._index_by_path.get(parent_path, -1)
+
+            self._index_by_path[path] = index
+            name = dag_path.partialPathName()
+            self._index_by_name[name] = index
+            self.paths.append(path)
+            self.names.append(name)
+            self.types.append(fn_dag.typeName())
+            self.parents.append(parent)
+            self.depths.append(self.depths[parent] + 1 if parent != -1 else 0)
+            self.is_transform.append(dag_path.node().hasFn(OpenMaya.MFn.kTransform))
+
+            m = dag_path.inclusiveMatrix()
+            matrices.append(tuple(m(i, j) for i in range(4) for j in range(4)))
+
+            it.next()
+
+        if numpy is not None:
+            self.types = numpy.array(self.types, dtype=object)
+            self.parents = numpy.array(self.parents, dtype=numpy.int64)
+            self.depths = numpy.array(self.depths, dtype=numpy.int64)
+            self.is_transform = numpy.array(self.is_transform, dtype=bool)
+            self.matrices = numpy.array(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+        else:
+            self.matrices = matrices
+
+    #
+    # Conversion
+    #
+
+    def index(self, obj):
+        """
+        :param obj: A pymel.PyNode, a node name or an index.
+        :return: The index of the node in the snapshot or None if it is unknown.
+        """
+        if obj is None:
+            return None
+        if isinstance(obj, (int, long)):
+            return obj
+        if isinstance(obj, basestring):
+            index = self._index_by_path.get(obj)
+            return index if index is not None else self._index_by_name.get(obj)
+        if not isinstance(obj, pymel.nodetypes.DagNode):
+            return None
+        return self._index_by_path.get(obj.longName())
+
+    def get_node(self, index):
+        """
+        :return: The pymel.PyNode associated with an index. PyNodes are only created when needed.
+        """
+        if index is None or index < 0:
+            return None
+        node = self._node_by_index.get(index)
+        if node is None:
+            node = self._node_by_index[index] = pymel.PyNode(self.paths[index])
+        return node
+
+    def get_nodes(self, indices):
+        return [self.get_node(index) for index in indices]
+
+    #
+    # Queries
+    #
+
+    def get_depth(self, obj):
+        """
+        Equivalent to get_num_parents.
+        """
+        index = self.index(obj)
+        return int(self.depths[index]) if index is not None else -1
+
+    def get_parent(self, obj):
+        index = self.index(obj)
+        return self.get_node(int(self.parents[index])) if index is not None else None
+
+    def get_parent_indices(self, obj):
+        """
+        :return: The index of all the parents of obj, from the nearest to the farthest.
+        """
+        result = []
+        index = self.index(obj)
+        if index is None:
+            return result
+        index = int(self.parents[index])
+        while index != -1:
+            result.append(index)
+            index = int(self.parents[index])
+        return result
+
+    def get_parents(self, obj):
+        """
+        Equivalent to get_parents.
+        """
+        return self.get_nodes(self.get_parent_indices(obj))
+
+    def get_root(self, obj):
+        """
+        Equivalent to pymel.nodetypes.DagNode.root.
+        """
+        index = self.index(obj)
+        if index is None:
+            return None
+        while self.parents[index] != -1:
+            index = int(self.parents[index])
+        return self.get_node(index)
+
+    def get_children_indices(self, obj):
+        if self._children_by_index is None:
+            self._children_by_index = [[] for _ in self.paths]
+            for index, parent in enumerate(list(self.parents)):
+                if parent != -1:
+                    self._children_by_index[parent].append(index)
+        index = self.index(obj)
+        return list(self._children_by_index[index]) if index is not None else []
+
+    def get_children(self, obj):
+        return self.get_nodes(self.get_children_indices(obj))
+
+    def get_type(self, obj):
+        index = self.index(obj)
+        return self.types[index] if index is not None else None
+
+    def get_indices_by_type(self, type_name):
+        """
+        :param type_name: A node type name. 'transform' will also match the inherited types. (ex: joints)
+        """
+        if type_name == 'transform':
+            return [index for index, val in enumerate(list(self.is_transform)) if val]
+        if self._indices_by_type is None:
+            self._indices_by_type = {}
+            for index, val in enumerate(list(self.types)):
+                self._indices_by_type.setdefault(val, []).append(index)
+        return list(self._indices_by_type.get(type_name, []))
+
+    def ls(self, type=None):
+        """
+        Equivalent to pymel.ls(type=...) for dag nodes.
+        """
+        if type is None:
+            return self.get_nodes(range(len(self.paths)))
+        types = type if isinstance(type, (list, tuple, set)) else [type]
+        indices = set()
+        for type_name in types:
+            indices.update(self.get_indices_by_type(type_name))
+        return self.get_nodes(sorted(indices))
+
+    def ls_root(self, type=None):
+        """
+        Equivalent to ls_root(type=...).
+        """
+        if type is None:
+            indices = range(len(self.paths))
+        else:
+            indices = self.get_indices_by_type(type)
+        return PyNodeChain(self.get_nodes([index for index in indices if self.parents[index] == -1]))
+
+    def get_world_matrix(self, obj):
+        """
+        :return: The world matrix as a pymel.datatypes.Matrix.
+        """
+        index = self.index(obj)
+        if index is None:
+            return None
+        m = self.matrices[index]
+        if numpy is not None:
+            m = m.flatten().tolist()
+        return pymel.datatypes.Matrix([m[0:4], m[4:8], m[8:12], m[12:16]])
+
+    def get_world_translation(self, obj):
+        """
+        :return: The world translation as a pymel.datatypes.Vector.
+        """
+        index = self.index(obj)
+        if index is None:
+            return None
+        m = self.matrices[index]
+        if numpy is not None:
+            return pymel.datatypes.Vector(*m[3, :3].tolist())
+        return pymel.datatypes.Vector(m[12], m[13], m[14])
+
+    def get_world_translations(self, indices):
+        """
+        :return: The world translation of multiple nodes. A (n, 3) numpy array if numpy is available.
+        """
+        if numpy is not None:
+            return self.matrices[list(indices), 3, :3]
+        return [tuple(self.matrices[index][12:15]) for index in indices]
+
+
+_snapshot = None
+
+
+def _on_dag_changed(*args):
+    global _snapshot
+    _snapshot = None
+
+
+def _add_snapshot_callbacks():
+    global _snapshot_callback_ids
+    if _snapshot_callback_ids:
+        return
+    _snapshot_callback_ids = [
+        OpenMaya.MDGMessage.addNodeAddedCallback(_on_dag_changed, 'dagNode'),
+        OpenMaya.MDGMessage.addNodeRemovedCallback(_on_dag_changed, 'dagNode'),
+        OpenMaya.MDagMessage.addAllDagChangesCallback(_on_dag_changed),
+        OpenMaya.MNodeMessage.addNameChangedCallback(OpenMaya.MObject(), _on_dag_changed),
+        OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterOpen, _on_dag_changed),
+        OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterNew, _on_dag_changed)
+    ]
+
+# Remove the callbacks registered by a previous import of the module.
+for _callback_id in globals().get('_snapshot_callback_ids', []):
+    OpenMaya.MMessage.removeCallback(_callback_id)
+_snapshot_callback_ids = []
+
+
+def get_scene_snapshot():
+    """
+    :return: A SceneSnapshot of the current scene. The same snapshot is returned until the dag change.
+    """
+    global _snapshot
+    if _snapshot is None:
+        _add_snapshot_callbacks()
+        _snapshot = SceneSnapshot()
+    return _snapshot
+
+
+def invalidate_scene_snapshot():
+    global _snapshot
+    _snapshot = None
+
+
+def get_num_parents(obj, snapshot=None):
+    if snapshot is not None:
+        return snapshot.get_depth(obj)
+
     num_parents = -1
     while obj is not None:
         obj = obj.getParent()
@@ -92,23 +398,79 @@ def get_num_parents(obj):
     return num_parents
 
 
-def get_chains_from_objs(objs):
+def _get_cached_parent_fn(snapshot=None):
+    """
+    :return: A function that return the parent of an object. Each object is only queried once.
+    """
+    if snapshot is not None:
+        return snapshot.get_parent
+
+    parent_by_obj = {}
+
+    def _get_parent(obj):
+        try:
+            return parent_by_obj[obj]
+        except KeyError:
+            parent = parent_by_obj[obj] = obj.getParent()
+            return parent
+    return _get_parent
+
+
+def _get_cached_depth_fn(fn_get_parent, snapshot=None):
+    """
+    :return: A function equivalent to get_num_parents that remember the depth of each visited ancestor.
+    """
+    if snapshot is not None:
+        return snapshot.get_depth
+
+    depth_by_obj = {}
+
+    def _get_depth(obj):
+        # Walk upward until we reach an object of known depth.
+        stack = []
+        while obj is not None and obj not in depth_by_obj:
+            stack.append(obj)
+            obj = fn_get_parent(obj)
+
+        depth = depth_by_obj[obj] if obj is not None else -1
+        for node in reversed(stack):
+            depth += 1
+            depth_by_obj[node] = depth
+        return depth
+    return _get_depth
+
+
+def get_chains_from_objs(objs, snapshot=None):
     """
     Take an arbitraty collection of joints and sort them in hyerarchies represented by lists.
+    :param snapshot: An optional SceneSnapshot to resolve the hierarchy without querying maya.
     """
+    fn_get_parent = _get_cached_parent_fn(snapshot=snapshot)
+    fn_get_depth = _get_cached_depth_fn(fn_get_parent, snapshot=snapshot)
+
+    objs = sorted(objs, key=fn_get_depth)
+    known_objs = set(objs)
+
     chains = []
-    objs = sorted(objs, key=get_num_parents)
+    chains_by_obj = {}  # Since we process parents first, we can always know in which chain(s) the parent is.
     for obj in objs:
-        parent = obj.getParent()
-        if parent not in objs:
-            chains.append([obj])
+        parent = fn_get_parent(obj)
+        if parent not in known_objs:
+            chain = [obj]
+            chains.append(chain)
+            chains_by_obj.setdefault(obj, []).append(chain)
         else:
-            for chain in chains:
-                if parent in chain:
-                    chain.append(obj)
+            obj_chains = chains_by_obj.setdefault(obj, [])
+            for chain in chains_by_obj.get(parent, ()):
+                chain.append(obj)
+                if not any(obj_chain is chain for obj_chain in obj_chains):
+                    obj_chains.append(chain)
     return [PyNodeChain(chain) for chain in chains]
 
-def get_parents(obj):
+def get_parents(obj, snapshot=None):
+    if snapshot is not None:
+        return snapshot.get_parents(obj)
+
     parents = []
     while obj.getParent() is not None:
         parent = obj.getParent()
@@ -116,7 +478,7 @@ def get_parents(obj):
         obj = parent
     return parents
 
-def get_tree_from_objs(objs, sort=False):
+def get_tree_from_objs(objs, sort=False, snapshot=None):
     """
     Sort all provided objects in a tree fashion.
     Each elements is a tuple of size 2, containing the object and it's children.
@@ -132,21 +494,39 @@ def get_tree_from_objs(objs, sort=False):
             )
         ]
     )
+    :param snapshot: An optional SceneSnapshot to resolve the hierarchy without querying maya.
     """
+    fn_get_parent = _get_cached_parent_fn(snapshot=snapshot)
+    known_objs = set(objs)
+
     data_by_obj = {}
     ischild_by_obj = {}
     for obj in objs:
         data_by_obj[obj] = (obj, [])
         ischild_by_obj[obj] = False
 
-    for obj in objs:
-        parents = get_parents(obj)
+    # The nearest ancestor (or self) that is in objs, shared between all the objects.
+    nearest_by_obj = {}
 
-        for parent in parents:
-            if parent in objs:
-                data_by_obj[parent][1].append(data_by_obj[obj])
-                ischild_by_obj[obj] = True
+    def _get_nearest(obj):
+        stack = []
+        while obj is not None and obj not in nearest_by_obj:
+            if obj in known_objs:
+                nearest_by_obj[obj] = obj
                 break
+            stack.append(obj)
+            obj = fn_get_parent(obj)
+
+        nearest = nearest_by_obj[obj] if obj is not None else None
+        for node in stack:
+            nearest_by_obj[node] = nearest
+        return nearest
+
+    for obj in objs:
+        parent = _get_nearest(fn_get_parent(obj))
+        if parent is not None:
+            data_by_obj[parent][1].append(data_by_obj[obj])
+            ischild_by_obj[obj] = True
 
     if sort:
         for obj, data in data_by_obj.iteritems():
@@ -170,6 +550,9 @@ def ls(*args, **kwargs):
 
 # Wrapper for pymel.ls that return only objects without parents.
 def ls_root(*args, **kwargs):
+    snapshot = kwargs.pop('snapshot', None)
+    if snapshot is not None:
+        return PyNodeChain(filter(lambda x: snapshot.get_depth(x) == 0, iter(pymel.ls(*args, **kwargs))))
     return PyNodeChain(filter(lambda x: x.getParent() is None, iter(pymel.ls(*args, **kwargs))))
 
 
@@ -304,6 +687,23 @@ class SegmentCollection(object):
         index = self.segments.index(closest_segment)
         return index, ratio
 
+    def get_arrays(self):
+        """
+        :return: The start and end positions of each segment as two (s, 3) numpy arrays.
+        """
+        starts = numpy.array([(segment.pos_s.x, segment.pos_s.y, segment.pos_s.z) for segment in self.segments])
+        ends = numpy.array([(segment.pos_e.x, segment.pos_e.y, segment.pos_e.z) for segment in self.segments])
+        return starts.reshape(-1, 3), ends.reshape(-1, 3)
+
+    def closest_segments(self, positions):
+        """
+        Vectorized equivalent of closest_segment_index for multiple positions.
+        :param positions: A (n, 3) numpy array.
+        :return: The index of the closest segment (n,) and the normalized distance on this segment (n,).
+        """
+        starts, ends = self.get_arrays()
+        return libSegments.get_closest_segments(starts, ends, positions)
+
     def get_knot_weights(self, dropoff=1.0, normalize=True):
         num_knots = len(self.knots)
         knots_weights = []
@@ -1,4 +1,5 @@
 import os, types, imp, logging, re
+from omtk.libs import libTelemetry
 
 logging = logging.getLogger('libPython')
 logging.setLevel(0)
@@ -35,14 +36,28 @@ def frange(start, end=None, inc=None):
     return L
 
 
-import time, functools, collections
+import time, functools, collections, weakref
 
 
 # forked from: https://wiki.python.org/moin/PythonDecoratorLibrary#Cached_Properties
+# modified to support declared dependencies and per-property invalidation
 class cached_property(object):
     '''
     Use this decodator to cache read-only properties value.
+    The value is stored in the instance _cache dict (which is not serialized).
+    If dependencies are provided, the value will be re-computed when any of the dependencies change.
+    A dependency is the name of an attribute or property of the instance (ex: 'input').
+    Lists are compared by their content so in-place modifications (append, remove, etc) are also detected.
+    ex:
+        @libPython.cached_property(depends=('input',))
+        def jnts(self):
+            ...
+    If no dependencies are provided, the value is cached until it is invalidated.
     '''
+    WARNING_THRESHOLD = 1.0  # seconds
+
+    def __init__(self, depends=None):
+        self.depends = tuple(depends) if depends else ()
 
     def __call__(self, fget, doc=None):
         self.fget = fget
@@ -51,57 +66,263 @@ class cached_property(object):
         self.__module__ = fget.__module__
         return self
 
-    def __get__(self, inst, owner):
+    @staticmethod
+    def _get_cache(inst):
         if '_cache' not in inst.__dict__:
             inst._cache = {}
-        cache = inst._cache
+        return inst._cache
+
+    @staticmethod
+    def _get_value_signature(val):
+        """
+        Return a cheap, hashable representation of a dependency value.
+        Since objects like PyNode can be expensive to compare, we rely on their identity.
+        """
+        if isinstance(val, (list, tuple, set)):
+            return (id(val), tuple(id(v) for v in val))
+        if isinstance(val, (basestring, int, long, float, bool, types.NoneType)):
+            return val
+        return id(val)
+
+    def _get_signature(self, inst):
+        if not self.depends:
+            return None
+        return tuple(self._get_value_signature(getattr(inst, name, None)) for name in self.depends)
 
-        if self.__name__ not in cache:
-            st = time.time()
-            cache[self.__name__] = self.fget(inst)
-            et = time.time() - st
-            if (et - st) > 1:  # 1 second
-                print '[cached_properties] Updating took {0:02.4f} seconds: {1}.{2}'.format(et, inst.__class__.__name__,
-                                                                                            self.__name__)
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+
+        cache = self._get_cache(inst)
+        signature = self._get_signature(inst)
+
+        try:
+            cached_signature, val = cache[self.__name__]
+            if cached_signature == signature:
+                return val
+        except KeyError:
+            pass
 
-        return cache[self.__name__]
+        with libTelemetry.span('{0}.{1}'.format(inst.__class__.__name__, self.__name__), category='cached_property'):
+            st = time.time()
+            val = self.fget(inst)
+            duration = time.time() - st
+        if duration > self.WARNING_THRESHOLD:
+            logging.warning('[cached_properties] Updating took {0:02.4f} seconds: {1}.{2}'.format(
+                duration, inst.__class__.__name__, self.__name__
+            ))
+
+        cache[self.__name__] = (signature, val)
+        return val
+
+    def invalidate(self, inst):
+        """
+        Discard the cached value of this property for a specific instance.
+        """
+        cache = inst.__dict__.get('_cache')
+        if cache:
+            cache.pop(self.__name__, None)
+
+
+def invalidate_cached_properties(inst, *names):
+    """
+    Discard the cached properties values of an instance.
+    :param inst: The instance that own the cached properties.
+    :param names: The name of the properties to invalidate. If nothing is provided, all the properties are invalidated.
+    """
+    cache = inst.__dict__.get('_cache')
+    if not cache:
+        return
+    if not names:
+        cache.clear()
+        return
+    for name in names:
+        cache.pop(name, None)
 
 
 # src: https://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
-# modified to support kwargs
+# modified to support kwargs, instance-scoped caches and LRU eviction
+class _WeakArg(object):
+    """
+    Weak reference to a memoized argument used in a cache key.
+    This prevent a cache from keeping it's arguments alive, which would also keep alive the instance owning the
+    cache if an argument reference it (ex: a rig referencing it's modules).
+    Once the argument is collected, the key never match again and is eventually discarded by the cache.
+    """
+    __slots__ = ('ref', 'hash', '__weakref__')
+
+    def __init__(self, arg):
+        self.hash = hash(arg)
+        self.ref = weakref.ref(arg)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, _WeakArg):
+            return False
+        arg = self.ref()
+        other_arg = other.ref()
+        if arg is None or other_arg is None:
+            return False
+        return arg is other_arg or arg == other_arg
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def _get_weak_arg(arg):
+    try:
+        return _WeakArg(arg)
+    except TypeError:  # arg don't support weak references (str, int, tuple, etc)
+        return arg
+
+
+def _unwrap_weak_arg(arg):
+    return arg.ref() if isinstance(arg, _WeakArg) else arg
+
+
 class memoized(object):
     '''Decorator. Caches a function's return value each time it is called.
     If called later with the same arguments, the cached value is returned
     (not reevaluated).
+    When decorating a method, each instance have it's own cache that is weakly referenced.
+    The arguments are also weakly referenced when possible, this mean that the cached values are released
+    with the instance, as long as the values themselves don't reference it.
+    Each cache is bounded and will discard the least recently used values.
     '''
+    MAX_SIZE = 128
+
+    # Keep track of all the memoized functions to support global invalidation.
+    _instances = weakref.WeakSet()
 
-    def __init__(self, func):
+    def __init__(self, func, maxsize=None):
         self.func = func
-        self.cache = {}
+        self.maxsize = maxsize if maxsize is not None else self.MAX_SIZE
+        self._cache_by_owner = weakref.WeakKeyDictionary()
+        self._cache = collections.OrderedDict()  # Used for functions and owners that don't support weak references.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+        memoized._instances.add(self)
+
+    def _get_cache(self, owner):
+        if owner is None:
+            return self._cache
+        try:
+            cache = self._cache_by_owner.get(owner)
+            if cache is None:
+                cache = self._cache_by_owner[owner] = collections.OrderedDict()
+            return cache
+        except TypeError:  # owner don't support weak references
+            return self._cache
 
-    def __call__(self, *args, **kwargs):
-        if not isinstance(args, collections.Hashable):
+    def _call(self, owner, args, kwargs):
+        cache = self._get_cache(owner)
+
+        try:
+            # Include kwargs
+            # src: http://stackoverflow.com/questions/6407993/how-to-memoize-kwargs
+            key = (
+                tuple(_get_weak_arg(arg) for arg in args),
+                frozenset((name, _get_weak_arg(val)) for name, val in kwargs.items())
+            )
+            if cache is self._cache and owner is not None:
+                key = (owner,) + key
+            value = cache.pop(key)
+        except KeyError:
+            pass
+        except TypeError:
             # uncacheable. a list, for instance.
             # better to not cache than blow up.
-            return self.func(*args)
-
-        # Include kwargs
-        # src: http://stackoverflow.com/questions/6407993/how-to-memoize-kwargs
-        key = (args, frozenset(kwargs.items()))
-        if key in self.cache:
-            return self.cache[key]
+            self.uncacheable += 1
+            logging.debug("Can't cache {0} using unhashable arguments {1}".format(self.func.__name__, args))
+            return self.func(*((owner,) + args if owner is not None else args), **kwargs)
         else:
-            value = self.func(*args, **kwargs)
-            self.cache[key] = value
+            # Re-insert the value to mark it as the most recently used.
+            self.hits += 1
+            cache[key] = value
             return value
 
+        self.misses += 1
+        value = self.func(*((owner,) + args if owner is not None else args), **kwargs)
+        cache[key] = value
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def __call__(self, *args, **kwargs):
+        return self._call(None, args, kwargs)
+
     def __repr__(self):
         """Return the function's docstring."""
         return self.func.__doc__
 
     def __get__(self, obj, objtype):
         """Support instance methods."""
-        return functools.partial(self.__call__, obj)
+        if obj is None:
+            return self
+        return functools.partial(self._call_method, obj)
+
+    def _call_method(self, obj, *args, **kwargs):
+        return self._call(obj, args, kwargs)
+
+    def invalidate(self, owner):
+        """
+        Discard the values cached for an instance.
+        For functions, discard the values cached for calls where owner was the first argument.
+        """
+        try:
+            self._cache_by_owner.pop(owner, None)
+        except TypeError:
+            pass
+        for key in self._cache.keys():
+            args = key[0] if len(key) == 2 else key[:1]
+            arg = _unwrap_weak_arg(args[0]) if args else None
+            if args and (arg is owner or arg == owner):
+                self._cache.pop(key)
+
+    def invalidate_all(self):
+        self._cache_by_owner.clear()
+        self._cache.clear()
+
+    def get_stats(self):
+        return {
+            'name': self.func.__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'uncacheable': self.uncacheable,
+            'size': len(self._cache) + sum(len(cache) for cache in self._cache_by_owner.values())
+        }
+
+
+def invalidate_memoized(owner):
+    """
+    Discard any value cached by a memoized function for the provided instance.
+    """
+    for inst in list(memoized._instances):
+        inst.invalidate(owner)
+
+
+def invalidate_all_memoized():
+    """
+    Discard any value cached by any memoized function.
+    This is called automatically on build, unbuild and when a scene is opened.
+    """
+    for inst in list(memoized._instances):
+        inst.invalidate_all()
+
+
+def get_memoized_stats():
+    """
+    :return: A list of dict containing the hits, misses and evictions of each memoized function.
+    """
+    return [inst.get_stats() for inst in memoized._instances]
 
 
 def profiler(func):
@@ -124,12 +345,17 @@ def profiler(func):
 
 
 def log_execution_time(NAME):
+    """
+    Log the execution time of the decorated function.
+    If a libTelemetry session is active, the execution is also recorded as a span.
+    """
     def deco_retry(f):
         def run(*args, **kwargs):
             m_NAME = NAME  # make mutable
             st = time.time()
-            rv = f(*args, **kwargs)
-            print('Process {0} took {1:2.3f} seconds to execute.'.format(m_NAME, time.time() - st))
+            with libTelemetry.span(m_NAME, category='process'):
+                rv = f(*args, **kwargs)
+            logging.info('Process {0} took {1:2.3f} seconds to execute.'.format(m_NAME, time.time() - st))
             return rv
 
         return run
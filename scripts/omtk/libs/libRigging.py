@@ -1,11 +1,20 @@
 from maya import cmds
 from maya import mel
 import pymel.core as pymel
+import contextlib
 import logging
 import libPymel
 import libPython
 from maya import OpenMaya
+from omtk.libs import libGeometry
 from omtk.libs import libPymel
+from omtk.libs import libSkinning
+from omtk.libs import libTelemetry
+
+# numpy is not shipped with every maya version, it is needed by ray_cast_batch.
+numpy = None
+if libPython.does_module_exist('numpy'):
+    import numpy
 
 '''
 This method facilitate the creation of utility nodes by connecting/settings automaticly attributes.
@@ -49,7 +58,11 @@ def connect_or_set_attr(_attr, _val):
             raise TypeError
 
 
+@libTelemetry.traced()
 def create_utility_node(_sClass, *args, **kwargs):
+    if _batch_depth:
+        return _create_utility_node_batched(_sClass, **kwargs)
+
     uNode = pymel.shadingNode(_sClass, asUtility=True)
     for sAttrName, pAttrValue in kwargs.items():
         if not uNode.hasAttr(sAttrName):
@@ -60,6 +73,103 @@ def create_utility_node(_sClass, *args, **kwargs):
     return uNode
 
 
+#
+# Batched DG modifications
+#
+
+# Set to False to globally disable the batch() optimisation. Mainly used for benchmarking.
+ENABLE_BATCH = True
+
+_batch_depth = 0
+_attr_info_by_type = {}  # (node type, attribute name) -> (is_multi, children) or None if the attribute don't exist
+
+
+@contextlib.contextmanager
+def batch():
+    """
+    Context in which create_utility_node skip the pymel layer.
+    - Nodes, connections and values are handled as strings using maya.cmds, no PyNode or Attribute is constructed
+      except for the returned node.
+    - Attributes definitions are queried once per node type.
+    - All the modifications are grouped in a single undo chunk.
+    Note that the modifications are applied immediately since callers frequently read plugs values between two calls.
+    Batches can be nested.
+    """
+    global _batch_depth
+    if not ENABLE_BATCH:
+        yield
+        return
+
+    if _batch_depth == 0:
+        cmds.undoInfo(openChunk=True, chunkName='omtk_batch')
+    _batch_depth += 1
+    try:
+        yield
+    finally:
+        _batch_depth -= 1
+        if _batch_depth == 0:
+            cmds.undoInfo(closeChunk=True)
+
+
+def _get_attr_info(node_type, node_name, attr_name):
+    """
+    :return: A tuple containing if the attribute is a multi and it's children names. None if the attribute don't exist.
+    """
+    key = (node_type, attr_name)
+    try:
+        return _attr_info_by_type[key]
+    except KeyError:
+        pass
+
+    if cmds.attributeQuery(attr_name, node=node_name, exists=True):
+        is_multi = cmds.attributeQuery(attr_name, node=node_name, multi=True)
+        children = cmds.attributeQuery(attr_name, node=node_name, listChildren=True) or []
+        info = (is_multi, children)
+    else:
+        info = None
+    _attr_info_by_type[key] = info
+    return info
+
+
+def _connect_or_set_plug(node_type, node_name, attr_name, plug, val, is_element=False):
+    """
+    String-based equivalent of connect_or_set_attr used in batch mode.
+    """
+    if isinstance(val, (list, tuple)):
+        is_multi, children = _get_attr_info(node_type, node_name, attr_name)
+        if is_multi and not is_element:
+            for i, subval in enumerate(val):
+                _connect_or_set_plug(node_type, node_name, attr_name, '{0}[{1}]'.format(plug, i), subval, is_element=True)
+        elif children:
+            for child, subval in zip(children, val):
+                _connect_or_set_plug(node_type, node_name, child, '{0}.{1}'.format(plug, child), subval)
+        else:
+            raise Exception("Can't apply value {0} on attribute {1}, need an array or compound".format(val, plug))
+    elif isinstance(val, pymel.Attribute):
+        cmds.connectAttr(val.__melobject__(), plug, force=True)
+    elif is_basic_type(val):
+        if isinstance(val, pymel.datatypes.Matrix):
+            cmds.setAttr(plug, *[v for row in val for v in row], type='matrix')
+        elif isinstance(val, pymel.datatypes.Vector):
+            cmds.setAttr(plug, val.x, val.y, val.z)
+        else:
+            cmds.setAttr(plug, val)
+    else:
+        logging.error(
+            '[ConnectOrSetAttr] Invalid value for attribute {0} of type {1} and value {2}'.format(plug, type(val), val))
+        raise TypeError
+
+
+def _create_utility_node_batched(_sClass, **kwargs):
+    node_name = cmds.shadingNode(_sClass, asUtility=True)
+    for attr_name, val in kwargs.items():
+        if _get_attr_info(_sClass, node_name, attr_name) is None:
+            raise Exception(
+                '[CreateUtilityNode] UtilityNode {0} doesn\'t have an {1} attribute.'.format(_sClass, attr_name))
+        _connect_or_set_plug(_sClass, node_name, attr_name, '{0}.{1}'.format(node_name, attr_name), val)
+    return pymel.PyNode(node_name)
+
+
 #
 # CtrlShapes Backup
 #
@@ -408,19 +518,14 @@ def get_affected_geometries(*objs):
     :return: The geometries affected by the object.
     """
     geometries = set()
+    index = libSkinning.get_deformation_index()
 
     for obj in objs:
         if isinstance(obj, pymel.nodetypes.Joint):
             # Collect all geometries affected by the joint.
-            skinClusters = set()
-            for hist in obj.listHistory(future=True):
-                if isinstance(hist, pymel.nodetypes.SkinCluster):
-                    skinClusters.add(hist)
-
-            for skinCluster in skinClusters:
-                for geometry in skinCluster.getOutputGeometry():
-                    if isinstance(geometry, pymel.nodetypes.Mesh):  # Only Mesh are supported for now
-                        geometries.add(geometry)
+            for geometry in index.get_affected_geometries(obj):
+                if isinstance(geometry, pymel.nodetypes.Mesh):  # Only Mesh are supported for now
+                    geometries.add(geometry)
 
     return geometries
 
@@ -461,6 +566,7 @@ def reshape_ctrl(ctrl_shape, ref, multiplier=1.25):
 '''
 
 @libPython.memoized
+@libTelemetry.traced()
 def get_recommended_ctrl_size(obj, default_value=1.0, weight_x=0.0, weight_neg_x=0.0, weight_y=1.0,
                               weight_neg_y=1.0, weight_z=0.0, weight_neg_z=0.0):
     """
@@ -471,13 +577,7 @@ def get_recommended_ctrl_size(obj, default_value=1.0, weight_x=0.0, weight_neg_x
     if isinstance(obj, pymel.nodetypes.Joint):
 
         # Collect all geometries affected by the joint.
-        skinClusters = set()
-        for hist in obj.listHistory(future=True):
-            if isinstance(hist, pymel.nodetypes.SkinCluster):
-                skinClusters.add(hist)
-        geometries = set()
-        for skinCluster in skinClusters:
-            geometries.update(skinCluster.getOutputGeometry())
+        geometries = libSkinning.get_deformation_index().get_affected_geometries(obj)
 
         # Create a number of raycast for each geometry. Use the longuest distance.
         # Note that we are not using the negative Y axis, this give bettern result for example on shoulders.
@@ -500,12 +600,20 @@ def get_recommended_ctrl_size(obj, default_value=1.0, weight_x=0.0, weight_neg_x
             dirs.append(OpenMaya.MVector(-ref_tm.a20, -ref_tm.a21, -ref_tm.a22))  # Z Axis
 
         length = 0
-        results = OpenMaya.MPointArray()
         for geometry in geometries:
+            if numpy is not None:
+                # Keep the nearest hit of each direction.
+                distances, _ = ray_cast_batch([pos] * len(dirs), dirs, [geometry], tolerance=1.0e-10)
+                distances = distances[~numpy.isnan(distances)]
+                if len(distances):
+                    length = max(length, float(distances.max()))
+                continue
+
+            results = OpenMaya.MPointArray()
             mfn_geo = geometry.__apimfn__()
             for dir in dirs:
                 if mfn_geo.intersect(pos, dir, results, 1.0e-10, OpenMaya.MSpace.kWorld):
-                    cur_length = min((results[0].distanceTo(pos) for i in range(results.length())))
+                    cur_length = min((results[i].distanceTo(pos) for i in range(results.length())))
                     if cur_length > length:
                         length = cur_length
         if not length:
@@ -517,6 +625,96 @@ def get_recommended_ctrl_size(obj, default_value=1.0, weight_x=0.0, weight_neg_x
     )
     return default_value
 
+#
+# Ray casting
+#
+
+RAY_CAST_MAX_DISTANCE = 999999.0
+
+
+class _MeshIntersector(object):
+    """
+    Keep a MFnMesh and it's intersection acceleration structure alive between ray casts.
+    Maya keep the acceleration structure in cache as long as we use the same parameters and rebuild it if the mesh change.
+    """
+    def __init__(self, mesh):
+        dag_path = mesh.__apimdagpath__()
+        self._handle = OpenMaya.MObjectHandle(dag_path.node())
+        self.fn = OpenMaya.MFnMesh(dag_path)
+        self.accel_params = self.fn.autoUniformGridParams()
+        self._hit_points = OpenMaya.MFloatPointArray()
+
+    def is_valid(self):
+        return self._handle.isValid()
+
+    def free(self):
+        if self.is_valid():
+            self.fn.freeCachedIntersectionAccelerator()
+
+    def intersect(self, pos, dir, tolerance=1.0e-5):
+        """
+        :return: A list of (x, y, z) tuples for each intersection in front of the ray.
+        """
+        self.fn.allIntersections(
+            OpenMaya.MFloatPoint(pos[0], pos[1], pos[2]),
+            OpenMaya.MFloatVector(dir[0], dir[1], dir[2]),
+            None, None, False,
+            OpenMaya.MSpace.kWorld,
+            RAY_CAST_MAX_DISTANCE,
+            False,
+            self.accel_params,
+            False,
+            self._hit_points, None, None, None, None, None,
+            tolerance
+        )
+        hit_points = self._hit_points
+        return [(hit_points[i].x, hit_points[i].y, hit_points[i].z) for i in range(hit_points.length())]
+
+
+_intersector_by_key = {}
+
+
+def _get_intersector(geometry):
+    """
+    :return: A cached _MeshIntersector for the provided mesh or None if the geometry is not a mesh.
+    """
+    if not isinstance(geometry, pymel.nodetypes.Mesh):
+        return None
+    key = OpenMaya.MObjectHandle(geometry.__apimobject__()).hashCode()
+    intersector = _intersector_by_key.get(key)
+    if intersector is None or not intersector.is_valid():
+        intersector = _intersector_by_key[key] = _MeshIntersector(geometry)
+    return intersector
+
+
+def invalidate_ray_cast_cache():
+    """
+    Release the meshes acceleration structures used by the ray casts.
+    """
+    for intersector in _intersector_by_key.itervalues():
+        intersector.free()
+    _intersector_by_key.clear()
+
+
+def _intersect(pos, dir, geometry, tolerance=1.0e-5):
+    """
+    :return: A list of (x, y, z) tuples for each intersection of a ray with a geometry.
+    """
+    intersector = _get_intersector(geometry)
+    if intersector is not None:
+        return intersector.intersect(pos, dir, tolerance=tolerance)
+
+    # Other geometries (ex: nurbsSurface) use their own intersect method.
+    buffer_results = OpenMaya.MPointArray()
+    geometry.__apimfn__().intersect(
+        OpenMaya.MPoint(pos[0], pos[1], pos[2]),
+        OpenMaya.MVector(dir[0], dir[1], dir[2]),
+        buffer_results, tolerance, OpenMaya.MSpace.kWorld
+    )
+    return [(buffer_results[i].x, buffer_results[i].y, buffer_results[i].z) for i in range(buffer_results.length())]
+
+
+@libTelemetry.traced()
 def ray_cast(pos, dir, geometries, debug=False, tolerance=1.0e-5):
     """
     Simple pymel wrapper for the MFnGeometry intersect method.
@@ -528,22 +726,13 @@ def ray_cast(pos, dir, geometries, debug=False, tolerance=1.0e-5):
     :param debug: If True, spaceLocators will be created at intersection points.
     :return: pymel.datatypes.Point list containing the intersection points.
     """
-    # Cast pos to OpenMaya.MPoint if necessary.
-    if type(pos) != OpenMaya.MPoint:
-        pos = OpenMaya.MPoint(pos.x, pos.y, pos.z)
-
-    # Cast dir to OpenMaya.MVector if necessary.
-    if type(dir) != OpenMaya.MVector:
-        dir = OpenMaya.MVector(dir.x, dir.y, dir.z)
+    pos = (pos.x, pos.y, pos.z)
+    dir = (dir.x, dir.y, dir.z)
 
     results = []
-
-    buffer_results = OpenMaya.MPointArray()
     for geometry in geometries:
-        mfn_geo = geometry.__apimfn__()
-        mfn_geo.intersect(pos, dir, buffer_results, tolerance, OpenMaya.MSpace.kWorld)
-        for i in range(buffer_results.length()):
-            results.append(pymel.datatypes.Point(buffer_results[i]))
+        for hit in _intersect(pos, dir, geometry, tolerance=tolerance):
+            results.append(pymel.datatypes.Point(*hit))
 
     if debug:
         for result in results:
@@ -552,15 +741,152 @@ def ray_cast(pos, dir, geometries, debug=False, tolerance=1.0e-5):
 
     return results
 
-def ray_cast_nearest(pos, *args, **kwargs):
-    results = ray_cast(pos, *args, **kwargs)
-    results = sorted(results, key=lambda x: libPymel.distance_between_vectors(pos, x))
-    return next(iter(results), None)
 
-def ray_cast_farthest(pos, *args, **kwargs):
-    results = ray_cast(pos, *args, **kwargs)
-    results = sorted(results, key=lambda x: libPymel.distance_between_vectors(pos, x))
-    return next(iter(reversed(results)), None)
+def _to_array(vals):
+    """
+    Convert a list of vectors (pymel, OpenMaya or tuples) to a (n, 3) numpy array.
+    """
+    if isinstance(vals, numpy.ndarray):
+        return vals.reshape(-1, 3).astype(numpy.float64)
+    return numpy.array([(val[0], val[1], val[2]) for val in vals], dtype=numpy.float64).reshape(-1, 3)
+
+
+@libTelemetry.traced()
+def ray_cast_batch_all(origins, directions, geometries, tolerance=1.0e-5):
+    """
+    Cast multiple rays against multiple geometries.
+    :param origins: A (n, 3) array or a list of vectors.
+    :param directions: A (n, 3) array or a list of vectors.
+    :param geometries: The geometries to intersect.
+    :return: Every hits as three numpy arrays, the index of the ray (k,), the distance from the ray origin (k,)
+    and the position (k, 3).
+    """
+    if numpy is None:
+        raise Exception("numpy is required by ray_cast_batch.")
+
+    origins = _to_array(origins)
+    directions = _to_array(directions)
+    if len(origins) != len(directions):
+        raise Exception("Expected the same number of origins and directions, got {0} and {1}.".format(
+            len(origins), len(directions)
+        ))
+
+    ray_indices = []
+    points = []
+    for geometry in geometries:
+        for i, (pos, dir) in enumerate(zip(origins.tolist(), directions.tolist())):
+            hits = _intersect(pos, dir, geometry, tolerance=tolerance)
+            ray_indices.extend([i] * len(hits))
+            points.extend(hits)
+
+    ray_indices = numpy.array(ray_indices, dtype=numpy.int64)
+    points = numpy.array(points, dtype=numpy.float64).reshape(-1, 3)
+    distances = numpy.sqrt(((points - origins[ray_indices]) ** 2).sum(axis=1))
+    return ray_indices, distances, points
+
+
+def _select_hits(num_rays, ray_indices, distances, points, farthest=False):
+    """
+    Keep the nearest (or farthest) hit of each ray.
+    :return: The distance (n,) and the position (n, 3) of the selected hits. Rays without hits have nan values.
+    """
+    result_distances = numpy.full(num_rays, numpy.nan)
+    result_points = numpy.full((num_rays, 3), numpy.nan)
+    if not len(ray_indices):
+        return result_distances, result_points
+
+    # Sort the hits by ray, then by distance. The first (or last) hit of each ray is the one we want.
+    order = numpy.lexsort((distances, ray_indices))
+    sorted_rays = ray_indices[order]
+    is_boundary = numpy.ones(len(order), dtype=bool)
+    if farthest:
+        is_boundary[:-1] = sorted_rays[1:] != sorted_rays[:-1]
+    else:
+        is_boundary[1:] = sorted_rays[1:] != sorted_rays[:-1]
+    selected = order[is_boundary]
+
+    result_distances[ray_indices[selected]] = distances[selected]
+    result_points[ray_indices[selected]] = points[selected]
+    return result_distances, result_points
+
+
+def _merge_hits(result_distances, result_points, distances, points, farthest=False):
+    """
+    Update the nearest (or farthest) hits in place with the hits of another geometry.
+    """
+    is_better = ~numpy.isnan(distances)
+    known = ~numpy.isnan(result_distances)
+    if farthest:
+        is_better[known] &= distances[known] > result_distances[known]
+    else:
+        is_better[known] &= distances[known] < result_distances[known]
+    result_distances[is_better] = distances[is_better]
+    result_points[is_better] = points[is_better]
+
+
+@libTelemetry.traced()
+def ray_cast_batch(origins, directions, geometries, farthest=False, tolerance=1.0e-5):
+    """
+    Cast multiple rays against multiple geometries and keep the nearest (or farthest) hit of each ray.
+    Meshes are intersected using their cached BVH (see libGeometry), the other geometries one ray at a time.
+    :param origins: A (n, 3) array or a list of vectors.
+    :param directions: A (n, 3) array or a list of vectors.
+    :param geometries: The geometries to intersect.
+    :param farthest: If True, the farthest hit of each ray is returned instead of the nearest.
+    :return: Two numpy arrays, the distance of each hit (n,) and the position of each hit (n, 3).
+    Rays that don't hit anything have nan values.
+    """
+    if numpy is None:
+        raise Exception("numpy is required by ray_cast_batch.")
+
+    origins = _to_array(origins)
+    directions = _to_array(directions)
+    num_rays = len(origins)
+
+    result_distances = numpy.full(num_rays, numpy.nan)
+    result_points = numpy.full((num_rays, 3), numpy.nan)
+
+    others = []
+    for geometry in geometries:
+        if not isinstance(geometry, pymel.nodetypes.Mesh):
+            others.append(geometry)
+            continue
+        snapshot = libGeometry.get_mesh_snapshot(geometry)
+        distances, points, _ = snapshot.ray_cast(origins, directions, farthest=farthest, tolerance=tolerance)
+        _merge_hits(result_distances, result_points, distances, points, farthest=farthest)
+
+    if others:
+        ray_indices, distances, points = ray_cast_batch_all(origins, directions, others, tolerance=tolerance)
+        distances, points = _select_hits(num_rays, ray_indices, distances, points, farthest=farthest)
+        _merge_hits(result_distances, result_points, distances, points, farthest=farthest)
+
+    return result_distances, result_points
+
+
+def _ray_cast_sorted(pos, dir, geometries, farthest=False, debug=False, tolerance=1.0e-5):
+    if numpy is None:
+        results = ray_cast(pos, dir, geometries, debug=debug, tolerance=tolerance)
+        results = sorted(results, key=lambda x: libPymel.distance_between_vectors(pos, x))
+        return next(iter(reversed(results) if farthest else results), None)
+
+    _, points = ray_cast_batch([pos], [dir], geometries, farthest=farthest, tolerance=tolerance)
+    point = points[0]
+    if numpy.isnan(point[0]):
+        return None
+
+    result = pymel.datatypes.Point(*point.tolist())
+    if debug:
+        loc = pymel.spaceLocator()
+        loc.setTranslation(result)
+    return result
+
+
+def ray_cast_nearest(pos, dir, geometries, **kwargs):
+    return _ray_cast_sorted(pos, dir, geometries, farthest=False, **kwargs)
+
+
+def ray_cast_farthest(pos, dir, geometries, **kwargs):
+    return _ray_cast_sorted(pos, dir, geometries, farthest=True, **kwargs)
 
 # TODO: Benchmark performances
 def snap(obj_dst, obj_src):
@@ -808,7 +1134,9 @@ def get_nearest_affected_mesh(jnt, key=None):
     """
     Return the immediate mesh affected by provided object in the geometry stack.
     """
-    affected_meshes = [hist for hist in jnt.listHistory(future=True) if _filter_shape(hist, key)]
+    affected_meshes = [
+        mesh for mesh in libSkinning.get_deformation_index().get_affected_meshes(jnt) if _filter_shape(mesh, key)
+    ]
 
     return next(iter(affected_meshes), None)
 
@@ -817,7 +1145,9 @@ def get_farest_affected_mesh(jnt, key=None):
     Return the last mesh affected by provided object in the geometry stack.
     Usefull to identify which mesh to use in the 'doritos' setup.
     """
-    affected_meshes = [hist for hist in jnt.listHistory(future=True) if _filter_shape(hist, key)]
+    affected_meshes = [
+        mesh for mesh in libSkinning.get_deformation_index().get_affected_meshes(jnt) if _filter_shape(mesh, key)
+    ]
 
     return next(iter(reversed(affected_meshes)), None)
 
@@ -828,50 +1158,91 @@ def get_multi_attr_available_slot(attr_multi):
         i += 1
     return attr_multi[i]
 
-def get_closest_point_on_mesh(mesh, pos):
-
-
-    # closestPointOnMesh ignores polymesh transforms
-    util_transformGeometry = create_utility_node('transformGeometry',
-                                                 inputGeometry=mesh.outMesh,
-                                                 transform=mesh.worldMatrix
-                                                 )
-
-    # TODO: maybe support multiple uv sets?
-    util_cpom = create_utility_node('closestPointOnMesh',
-        inPosition=pos,
-        inMesh=util_transformGeometry.outputGeometry
-    )
+def get_closest_points_on_mesh(mesh, positions):
+    """
+    Batch alternative to get_closest_point_on_mesh that don't create any node.
+    The mesh snapshot (see libGeometry) is reused between calls as long as the mesh don't change.
+    :param mesh: A pymel.nodetypes.Mesh or it's transform.
+    :param positions: A list of world positions.
+    :return: A list of (position, u, v) tuples. Positions on polygons without uvs have zero uvs.
+    """
+    if isinstance(mesh, pymel.nodetypes.Transform):
+        mesh = mesh.getShape()
+    if not len(positions):
+        return []
+
+    if libGeometry.numpy is not None:
+        snapshot = libGeometry.get_mesh_snapshot(mesh)
+        points, uvs = snapshot.get_closest_points_and_uvs(_to_array(positions))
+        uvs = libGeometry.numpy.nan_to_num(uvs)
+        return [
+            (pymel.datatypes.Vector(*point), u, v) for point, (u, v) in zip(points.tolist(), uvs.tolist())
+        ]
+
+    # Without numpy, query the mesh function set directly.
+    fn_mesh = OpenMaya.MFnMesh(mesh.__apimdagpath__())
+    util_uv = OpenMaya.MScriptUtil()
+    util_uv.createFromList([0.0, 0.0], 2)
+    ptr_uv = util_uv.asFloat2Ptr()
+    results = []
+    for pos in positions:
+        point = OpenMaya.MPoint()
+        fn_mesh.getClosestPoint(OpenMaya.MPoint(pos[0], pos[1], pos[2]), point, OpenMaya.MSpace.kWorld)
+        try:
+            fn_mesh.getUVAtPoint(point, ptr_uv, OpenMaya.MSpace.kWorld)
+            u = OpenMaya.MScriptUtil.getFloat2ArrayItem(ptr_uv, 0, 0)
+            v = OpenMaya.MScriptUtil.getFloat2ArrayItem(ptr_uv, 0, 1)
+        except RuntimeError:  # no uvs
+            u = v = 0.0
+        results.append((pymel.datatypes.Vector(point.x, point.y, point.z), u, v))
+    return results
 
-    pos = util_cpom.position.get()
-    u = util_cpom.parameterU.get()
-    v = util_cpom.parameterV.get()
 
-    pymel.delete(util_transformGeometry)
-    pymel.delete(util_cpom)
+def get_closest_point_on_mesh(mesh, pos):
+    """
+    :return: The closest position on the mesh and it's u and v values.
+    """
+    return get_closest_points_on_mesh(mesh, [pos])[0]
 
-    return pos, u, v
 
-def get_closest_point_on_surface(nurbsSurface, pos):
-    # closestPointOnSurface don't listen to transform so we'll need to duplicate the shape.
-    util_cpos = create_utility_node('closestPointOnSurface',
-        inPosition=pos,
-        inputSurface=nurbsSurface.worldSpace
-    )
+def get_closest_points_on_surface(nurbsSurface, positions, tolerance=1.0e-5):
+    """
+    Batch alternative to get_closest_point_on_surface that don't create any node.
+    :param nurbsSurface: A pymel.nodetypes.NurbsSurface or it's transform.
+    :param positions: A list of world positions.
+    :return: A list of (position, u, v) tuples. The u and v values are normalized.
+    """
+    if isinstance(nurbsSurface, pymel.nodetypes.Transform):
+        nurbsSurface = nurbsSurface.getShape()
 
-    pos = util_cpos.position.get()
-    u = util_cpos.parameterU.get()
-    v = util_cpos.parameterV.get()
+    fn_surface = OpenMaya.MFnNurbsSurface(nurbsSurface.__apimdagpath__())
+    util_u = OpenMaya.MScriptUtil()
+    ptr_u = util_u.asDoublePtr()
+    util_v = OpenMaya.MScriptUtil()
+    ptr_v = util_v.asDoublePtr()
 
     # follicles use normalized uv's when attaching to nurbs so we need to know the uv min max values
     surface_min_u, surface_max_u = nurbsSurface.minMaxRangeU.get()
     surface_min_v, surface_max_v = nurbsSurface.minMaxRangeV.get()
-    u = abs( (u - surface_min_u) / (surface_max_u - surface_min_u) )
-    v = abs( (v - surface_min_v) / (surface_max_v - surface_min_v) )
 
-    pymel.delete(util_cpos)
+    results = []
+    for pos in positions:
+        point = fn_surface.closestPoint(
+            OpenMaya.MPoint(pos[0], pos[1], pos[2]), ptr_u, ptr_v, False, tolerance, OpenMaya.MSpace.kWorld
+        )
+        u = OpenMaya.MScriptUtil.getDouble(ptr_u)
+        v = OpenMaya.MScriptUtil.getDouble(ptr_v)
+        u = abs((u - surface_min_u) / (surface_max_u - surface_min_u))
+        v = abs((v - surface_min_v) / (surface_max_v - surface_min_v))
+        results.append((pymel.datatypes.Vector(point.x, point.y, point.z), u, v))
+    return results
+
 
-    return pos, u, v
+def get_closest_point_on_surface(nurbsSurface, pos):
+    """
+    :return: The closest position on the surface and it's normalized u and v values.
+    """
+    return get_closest_points_on_surface(nurbsSurface, [pos])[0]
 
 # TODO: write an alternative method that work when the mesh have no UVs using pointOnMesh constraint.
 def create_follicle2(shape, u=0, v=0, connect_transform=True):
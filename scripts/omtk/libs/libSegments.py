@@ -0,0 +1,204 @@
+"""
+Segment-based skinning math, see libSkinning.transfer_weights_from_segments.
+This module only use numpy so it can be imported by worker processes and tested without maya.
+
+Usage:
+    indices, ratios = libSegments.get_closest_segments(starts, ends, positions)
+    libSegments.transfer_weights_to_segments(weights, positions, starts, ends, knot_weights)
+"""
+import multiprocessing
+import multiprocessing.sharedctypes
+import os
+import sys
+
+from omtk.libs import libPython
+
+# numpy is not shipped with every maya version, it is needed by every function of this module.
+numpy = None
+if libPython.does_module_exist('numpy'):
+    import numpy
+
+# Number of vertices processed by each task of compute_segments_weights.
+PARALLEL_CHUNK_SIZE = 10000
+
+
+def interp_cubic(x):
+    """
+    src: http://stackoverflow.com/questions/1146281/cubic-curve-smooth-interpolation-in-c-sharp
+    """
+    return (x * x) * (3.0 - (2.0 * x))
+
+
+def get_closest_segments(starts, ends, positions):
+    """
+    Vectorized equivalent of libPymel.SegmentCollection.closest_segment_index for multiple positions.
+    :param starts: The start position of each segment as a (s, 3) numpy array.
+    :param ends: The end position of each segment as a (s, 3) numpy array.
+    :param positions: A (n, 3) numpy array.
+    :return: The index of the closest segment (n,) and the normalized distance on this segment (n,).
+    """
+    bound_min = -0.999999999999  # Damn float imprecision
+    bound_max = 1.0000000000001  # Damn float imprecision
+    positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+    starts = numpy.asarray(starts, dtype=numpy.float64).reshape(-1, 3)
+    ends = numpy.asarray(ends, dtype=numpy.float64).reshape(-1, 3)
+    num_segments = len(starts)
+
+    # Normalized distance of each position on each segment (n, s), see Segment.closest_point_normalized_distance
+    a_to_b = ends - starts
+    ab_lengths = (a_to_b ** 2).sum(axis=1)
+    a_to_p = positions[:, numpy.newaxis, :] - starts[numpy.newaxis, :, :]
+    ratios = (a_to_p * a_to_b[numpy.newaxis, :, :]).sum(axis=2)
+    ratios = numpy.where(
+        numpy.sqrt(ab_lengths) > 0.001, ratios / numpy.where(ab_lengths > 0, ab_lengths, 1.0), 0.0
+    )
+
+    # Like closest_segment, take the first segment that contain the position.
+    # The first and last segments also accept the positions before and after them.
+    is_candidate = (ratios >= bound_min) & (ratios <= bound_max)
+    is_before = ratios[:, 0] < bound_min
+    is_after = ratios[:, -1] > bound_max
+    is_candidate[:, 0] |= is_before
+    is_candidate[:, -1] |= is_after
+
+    found = is_candidate.any(axis=1)
+    if not found.all():
+        raise Exception("Can't resolve segment for {0}".format(positions[~found][0].tolist()))
+
+    indices = numpy.argmax(is_candidate, axis=1)
+    result = ratios[numpy.arange(len(positions)), indices]
+    result[(indices == 0) & is_before] = 0.0
+    result[(indices == num_segments - 1) & is_after] = 1.0
+    return indices, result
+
+
+def get_weights_from_segments(starts, ends, segments_weights, positions):
+    """
+    :param starts: The start position of each segment as a (s, 3) numpy array.
+    :param ends: The end position of each segment as a (s, 3) numpy array.
+    :param segments_weights: The knot weights as returned by SegmentCollection.get_knot_weights.
+    :param positions: A (n, 3) numpy array.
+    :return: A (n, knots) numpy array containing the weights of each position.
+    """
+    segments_weights = numpy.asarray(segments_weights, dtype=numpy.float64)
+    knot_indices, ratios = get_closest_segments(starts, ends, positions)
+    ratios = interp_cubic(ratios)[:, numpy.newaxis]
+    point_weights_inn = segments_weights[knot_indices]
+    point_weights_out = segments_weights[knot_indices + 1]
+    return (point_weights_out - point_weights_inn) * ratios + point_weights_inn
+
+
+def transfer_weights_to_segments(weights, positions, starts, ends, segments_weights):
+    """
+    Distribute the weights of the first column on the other columns using the segments, in place.
+    :param weights: A (vertices, 1 + knots) numpy array.
+    :param positions: A (vertices, 3) numpy array.
+    """
+    mask = weights[:, 0] != 0.0
+
+    # Resolve weight using the vtx/cv position
+    point_weights = get_weights_from_segments(starts, ends, segments_weights, positions[mask])
+
+    # Ensure the total of the new weights match the old weights
+    point_weights *= (weights[mask, 0] / point_weights.sum(axis=1))[:, numpy.newaxis]
+
+    weights[mask, 1:] = point_weights
+    weights[mask, 0] = 0.0  # Remove original weight
+    return weights
+
+
+#
+# Process pool
+#
+
+# The shared memory buffers of a worker process, see _init_worker.
+_shared_positions = None
+_shared_weights = None
+
+
+def _init_worker(positions_buffer, weights_buffer):
+    global _shared_positions, _shared_weights
+    _shared_positions = numpy.frombuffer(positions_buffer, dtype=numpy.float64)
+    _shared_weights = numpy.frombuffer(weights_buffer, dtype=numpy.float64)
+
+
+def _compute_task(task):
+    positions_offset, weights_offset, num_vertices, num_columns, starts, ends, knot_weights = task
+    positions = _shared_positions[positions_offset * 3:(positions_offset + num_vertices) * 3].reshape(-1, 3)
+    weights = _shared_weights[weights_offset:weights_offset + num_vertices * num_columns].reshape(-1, num_columns)
+    transfer_weights_to_segments(weights, positions, starts, ends, knot_weights)
+
+
+def _set_pool_executable():
+    """
+    On Windows the workers are started using sys.executable, inside maya this is maya.exe.
+    Use mayapy instead so we don't start new maya sessions.
+    """
+    if os.name != 'nt' or os.path.basename(sys.executable).lower() != 'maya.exe':
+        return
+    path = os.path.join(os.path.dirname(sys.executable), 'mayapy.exe')
+    if not os.path.exists(path):
+        raise Exception("Can't start worker processes, {0} don't exist.".format(path))
+    multiprocessing.set_executable(path)
+
+
+def compute_segments_weights(jobs, num_processes=1, chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    Compute the weights of multiple jobs, see libSkinning.SegmentsWeightsJob.
+    By default the jobs are computed in the current process. When num_processes is greater than one,
+    the positions and weights of all the jobs are copied in shared memory buffers and each task of a
+    process pool compute a range of vertices in place.
+    Note that the pool is only worth it for very large meshes, starting the workers cost more than
+    computing a typical character.
+    :param jobs: Objects with weights, positions, starts, ends and knot_weights numpy arrays.
+    Their weights are modified in place.
+    :param num_processes: The number of processes to use.
+    :param chunk_size: The number of vertices to compute in each task.
+    """
+    num_tasks = sum((len(job.weights) + chunk_size - 1) // chunk_size for job in jobs)
+    if num_processes <= 1 or num_tasks <= 1:
+        for job in jobs:
+            transfer_weights_to_segments(job.weights, job.positions, job.starts, job.ends, job.knot_weights)
+        return
+
+    # Copy the jobs in shared memory
+    positions_buffer = multiprocessing.sharedctypes.RawArray('d', max(1, sum(job.positions.size for job in jobs)))
+    weights_buffer = multiprocessing.sharedctypes.RawArray('d', max(1, sum(job.weights.size for job in jobs)))
+    shared_positions = numpy.frombuffer(positions_buffer, dtype=numpy.float64)
+    shared_weights = numpy.frombuffer(weights_buffer, dtype=numpy.float64)
+
+    tasks = []
+    weights_offsets = []
+    positions_offset = 0
+    weights_offset = 0
+    for job in jobs:
+        num_vertices, num_columns = job.weights.shape
+        shared_positions[positions_offset * 3:(positions_offset + num_vertices) * 3] = job.positions.ravel()
+        shared_weights[weights_offset:weights_offset + job.weights.size] = job.weights.ravel()
+        for start in range(0, num_vertices, chunk_size):
+            tasks.append((
+                positions_offset + start,
+                weights_offset + start * num_columns,
+                min(chunk_size, num_vertices - start),
+                num_columns,
+                job.starts,
+                job.ends,
+                job.knot_weights
+            ))
+        weights_offsets.append(weights_offset)
+        positions_offset += num_vertices
+        weights_offset += job.weights.size
+
+    _set_pool_executable()
+    pool = multiprocessing.Pool(
+        min(num_processes, num_tasks), initializer=_init_worker, initargs=(positions_buffer, weights_buffer)
+    )
+    try:
+        pool.map(_compute_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Copy the results back in the jobs
+    for job, weights_offset in zip(jobs, weights_offsets):
+        job.weights[:] = shared_weights[weights_offset:weights_offset + job.weights.size].reshape(job.weights.shape)
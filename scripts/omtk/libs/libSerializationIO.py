@@ -0,0 +1,515 @@
+"""
+Conversion of serializable objects (Rig, Module, BaseCtrl, etc) from and to plain python data.
+The plain data only contain builtin types and can be written in any format without relying on maya networks.
+- PyNodes are stored using their uuid (when supported) and their name.
+- Objects are stored once in a table and referenced by index, this support shared and circular references.
+
+This is used to store a binary cache of the rigs next to the scene. When a scene is opened, the rigs can be
+restored from the cache instead of being imported from their networks. The cache is keyed by a hash of the networks
+content so any modification to the networks will invalidate it.
+
+Usage:
+    libSerializationIO.save_cache(rig)
+    rig = libSerializationIO.load_cache(network)  # None if the cache is missing or outdated.
+
+This is also used to export rigs to gzip compressed json-lines files. Each module is written (and read) one at a
+time which keep the memory usage low and allow importing only some modules.
+
+Usage:
+    libSerializationIO.export_json_stream(rigs, '/tmp/rigs.omtk.gz')
+    rigs = libSerializationIO.import_json_stream('/tmp/rigs.omtk.gz', classes=['Arm'])
+"""
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import marshal
+import os
+import zlib
+
+import pymel.core as pymel
+from maya import cmds
+
+log = logging.getLogger('omtk')
+
+_TYPE_REF = 'ref'
+_TYPE_NODE = 'node'
+_TYPE_ATTR = 'attr'
+_TYPE_DICT = 'dict'
+_TYPE_VECTOR = 'vector'
+_TYPE_MATRIX = 'matrix'
+_TYPE_KEY = '_type'
+
+
+#
+# Nodes
+#
+
+def _get_node_uuid(node):
+    """
+    :return: The uuid of the node or None if not supported by the current maya version (pre-2016).
+    """
+    try:
+        return next(iter(cmds.ls(node.__melobject__(), uuid=True) or []), None)
+    except TypeError:
+        return None
+
+
+def _get_node_by_uuid(uuid, name):
+    """
+    Resolve a node from it's uuid, or from it's name if the uuid is unknown.
+    """
+    if uuid:
+        try:
+            names = cmds.ls(uuid, long=True)
+        except TypeError:
+            names = None
+        if names:
+            return pymel.PyNode(names[0])
+    if name and cmds.objExists(name):
+        return pymel.PyNode(name)
+    return None
+
+
+#
+# Plain data conversion
+#
+
+def _can_export_attr_by_name(name):
+    # Same convention as libSerialization, private attributes are not serialized.
+    return not name.startswith('_')
+
+
+class Exporter(object):
+    """
+    Convert an object graph to plain data.
+    :param exclude: Name of attributes to ignore on the root object.
+    :param export_networks: If True, the network of each object is stored. This only make sense for data that
+    will be imported in the same scene. (ex: the binary cache)
+    """
+    def __init__(self, exclude=None, export_networks=True):
+        self.objects = []  # table of exported objects
+        self._index_by_id = {}
+        self._exclude = set(exclude) if exclude else set()
+        self._export_networks = export_networks
+
+    def export_obj(self, obj):
+        """
+        :return: The index of the object in the object table.
+        """
+        index = self._index_by_id.get(id(obj))
+        if index is not None:
+            return index
+
+        # Register the object before exporting it's attributes to support circular references.
+        index = len(self.objects)
+        self._index_by_id[id(obj)] = index
+        data = {'class': obj.__class__.__name__, 'module': obj.__class__.__module__}
+        self.objects.append(data)
+
+        network = getattr(obj, '_network', None) if self._export_networks else None
+        if isinstance(network, pymel.PyNode) and network.exists():
+            data['network'] = self.export_value(network)
+
+        exclude = self._exclude if index == 0 else ()
+        data['attrs'] = dict(
+            (key, self.export_value(val)) for key, val in obj.__dict__.iteritems()
+            if _can_export_attr_by_name(key) and key not in exclude
+        )
+        return index
+
+    def export_value(self, val):
+        if val is None or isinstance(val, (bool, int, long, float, basestring)):
+            return val
+        if isinstance(val, (list, tuple)):
+            return [self.export_value(sub_val) for sub_val in val]
+        if isinstance(val, pymel.Attribute):
+            return {_TYPE_KEY: _TYPE_ATTR, 'node': self.export_value(val.node()), 'attr': val.longName(fullPath=True)}
+        if isinstance(val, pymel.PyNode):
+            if not val.exists():
+                return None
+            return {_TYPE_KEY: _TYPE_NODE, 'uuid': _get_node_uuid(val), 'name': val.longName()}
+        if isinstance(val, pymel.datatypes.Matrix):
+            return {_TYPE_KEY: _TYPE_MATRIX, 'val': [float(v) for row in val for v in row]}
+        if isinstance(val, pymel.datatypes.Vector):
+            return {_TYPE_KEY: _TYPE_VECTOR, 'val': [float(v) for v in val]}
+        if isinstance(val, dict):
+            return {_TYPE_KEY: _TYPE_DICT, 'items': [(self.export_value(k), self.export_value(v)) for k, v in val.iteritems()]}
+        if hasattr(val, '__dict__'):
+            return {_TYPE_KEY: _TYPE_REF, 'index': self.export_obj(val)}
+        log.warning("Can't export value {0} of type {1}".format(val, type(val)))
+        return None
+
+
+class Importer(object):
+    """
+    Convert plain data back to an object graph.
+    :param import_networks: If True, the network stored with each object is restored.
+    """
+    def __init__(self, objects, import_networks=True):
+        self.objects = objects
+        self._obj_by_index = {}
+        self._import_networks = import_networks
+
+    @staticmethod
+    def _resolve_class(cls_name, module_name):
+        module = __import__(module_name, fromlist=[cls_name])
+        return getattr(module, cls_name)
+
+    def import_obj(self, index):
+        obj = self._obj_by_index.get(index)
+        if obj is not None:
+            return obj
+
+        data = self.objects[index]
+        cls = self._resolve_class(data['class'], data['module'])
+        try:
+            obj = cls()
+        except TypeError:  # __init__ need arguments
+            obj = cls.__new__(cls)
+        self._obj_by_index[index] = obj
+
+        for key, val in data['attrs'].iteritems():
+            setattr(obj, key, self.import_value(val))
+
+        network = data.get('network') if self._import_networks else None
+        if network:
+            obj._network = self.import_value(network)
+
+        return obj
+
+    def import_value(self, val):
+        if isinstance(val, list):
+            return [self.import_value(sub_val) for sub_val in val]
+        if not isinstance(val, dict):
+            return val
+
+        val_type = val.get(_TYPE_KEY)
+        if val_type == _TYPE_REF:
+            return self.import_obj(val['index'])
+        if val_type == _TYPE_NODE:
+            return _get_node_by_uuid(val['uuid'], val['name'])
+        if val_type == _TYPE_ATTR:
+            node = self.import_value(val['node'])
+            return node.attr(val['attr']) if node is not None and node.hasAttr(val['attr']) else None
+        if val_type == _TYPE_MATRIX:
+            m = val['val']
+            return pymel.datatypes.Matrix([m[0:4], m[4:8], m[8:12], m[12:16]])
+        if val_type == _TYPE_VECTOR:
+            return pymel.datatypes.Vector(*val['val'])
+        if val_type == _TYPE_DICT:
+            return dict((self.import_value(k), self.import_value(v)) for k, v in val['items'])
+        raise Exception("Unexpected value type {0}".format(val_type))
+
+    def post_import(self):
+        # Mimic libSerialization behavior.
+        for obj in self._obj_by_index.itervalues():
+            fn = getattr(obj, '__callbackNetworkPostBuild__', None)
+            if fn:
+                fn()
+
+
+def export_plain(data, exclude=None, export_networks=True):
+    """
+    :param exclude: Name of attributes to ignore on the root object.
+    :param export_networks: If True, the network of each object is stored. (see Exporter)
+    :return: A plain data representation of an object graph.
+    """
+    exporter = Exporter(exclude=exclude, export_networks=export_networks)
+    root = exporter.export_obj(data)
+    return {'root': root, 'objects': exporter.objects}
+
+
+def import_plain(data, import_networks=True):
+    """
+    :param import_networks: If True, the network stored with each object is restored. (see Importer)
+    :return: The object graph represented by the plain data returned by export_plain.
+    """
+    importer = Importer(data['objects'], import_networks=import_networks)
+    obj = importer.import_obj(data['root'])
+    importer.post_import()
+    return obj
+
+
+#
+# Binary cache
+#
+
+CACHE_VERSION = 1
+CACHE_EXTENSION = '.omtkcache'
+CACHE_FILEINFO_KEY = 'omtk_cache'
+
+# Where to store the cache. Either 'file' (next to the scene) or 'fileInfo' (inside the scene).
+CACHE_LOCATION = 'file'
+
+
+def get_networks_hash(network):
+    """
+    Compute a hash of the content of a network and any network connected to it.
+    This is a lot faster than importing the networks since no python object is created.
+    """
+    from omtk.libs import libNetwork
+
+    data = []
+    for node in libNetwork.get_child_networks(network):
+        node_name = node.name()
+        attrs = []
+        for attr_name in sorted(cmds.listAttr(node_name, userDefined=True) or []):
+            try:
+                attrs.append((attr_name, cmds.getAttr('{0}.{1}'.format(node_name, attr_name))))
+            except (RuntimeError, ValueError):  # message attributes
+                attrs.append((attr_name, None))
+        connections = cmds.listConnections(
+            node_name, source=True, destination=False, connections=True, plugs=True
+        ) or []
+        data.append((node_name, attrs, sorted(connections)))
+
+    data.sort()
+    return hashlib.md5(repr(data)).hexdigest()
+
+
+def _get_cache_key(network):
+    return _get_node_uuid(network) or network.name()
+
+
+def _get_cache_path():
+    scene_path = cmds.file(query=True, sceneName=True)
+    if not scene_path:
+        return None
+    return os.path.splitext(scene_path)[0] + CACHE_EXTENSION
+
+
+def _dumps(data):
+    return zlib.compress(marshal.dumps(data, 2))
+
+
+def _loads(raw):
+    return marshal.loads(zlib.decompress(raw))
+
+
+# The entries returned by _read_cache and the token telling if they are still up to date. (see _get_cache_token)
+_cache_entries = None
+_cache_token = None
+
+
+def _get_cache_token():
+    """
+    :return: A value that change when the cache need to be read again.
+    """
+    if CACHE_LOCATION == 'fileInfo':
+        # The fileInfo only change when we write it or when another scene is opened. (see invalidate_cache)
+        return CACHE_LOCATION, cmds.file(query=True, sceneName=True)
+    path = _get_cache_path()
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    return CACHE_LOCATION, path, (stat.st_mtime, stat.st_size) if stat else None
+
+
+def invalidate_cache():
+    """
+    Forget the cache entries read from the scene or from the cache file.
+    """
+    global _cache_entries, _cache_token
+    _cache_entries = None
+    _cache_token = None
+
+
+def _read_cache():
+    """
+    The cache is only read once as long as the file or the scene don't change.
+    :return: A dict of (hash, plain data) by network key. It should not be modified.
+    """
+    global _cache_entries, _cache_token
+    token = _get_cache_token()
+    if _cache_entries is None or token != _cache_token:
+        _cache_entries = _read_cache_entries()
+        _cache_token = token
+    return _cache_entries
+
+
+def _read_cache_entries():
+    raw = None
+    try:
+        if CACHE_LOCATION == 'fileInfo':
+            val = next(iter(cmds.fileInfo(CACHE_FILEINFO_KEY, query=True) or []), None)
+            raw = base64.b64decode(val) if val else None
+        else:
+            path = _get_cache_path()
+            if path and os.path.exists(path):
+                with open(path, 'rb') as fp:
+                    raw = fp.read()
+        if not raw:
+            return {}
+
+        data = _loads(raw)
+    except (IOError, ValueError, TypeError, EOFError, zlib.error) as e:
+        log.warning("Can't read omtk cache: {0}".format(e))
+        return {}
+
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('entries', {})
+
+
+def _write_cache(entries):
+    global _cache_entries, _cache_token
+    raw = _dumps({'version': CACHE_VERSION, 'entries': entries})
+    if CACHE_LOCATION == 'fileInfo':
+        cmds.fileInfo(CACHE_FILEINFO_KEY, base64.b64encode(raw))
+    else:
+        path = _get_cache_path()
+        if not path:
+            log.debug("Can't save omtk cache for an untitled scene.")
+            return False
+        with open(path, 'wb') as fp:
+            fp.write(raw)
+
+    # No need to read what we just wrote.
+    _cache_entries = entries
+    _cache_token = _get_cache_token()
+    return True
+
+
+def save_cache(rigs):
+    """
+    Store the definition of the provided rigs in the cache.
+    :param rigs: A list of objects that were exported to networks.
+    :return: True if the cache was written.
+    """
+    entries = dict(_read_cache())
+    for rig in rigs:
+        network = getattr(rig, '_network', None)
+        if not isinstance(network, pymel.PyNode) or not network.exists():
+            log.warning("Can't cache {0} since it was never exported.".format(rig))
+            continue
+        entries[_get_cache_key(network)] = (get_networks_hash(network), export_plain(rig))
+    return _write_cache(entries)
+
+
+def load_cache(network):
+    """
+    Restore an object from the cache.
+    :return: The object or None if the cache is missing or don't match the network content.
+    """
+    entry = _read_cache().get(_get_cache_key(network))
+    if entry is None:
+        return None
+
+    hash_expected, data = entry
+    if get_networks_hash(network) != hash_expected:
+        log.info("omtk cache of {0} is outdated.".format(network))
+        return None
+
+    try:
+        return import_plain(data)
+    except Exception as e:
+        log.warning("Can't import {0} from the omtk cache: {1}".format(network, e))
+        return None
+
+
+#
+# Streaming json export
+#
+
+STREAM_VERSION = 1
+STREAM_EXTENSION = '.omtk.gz'
+
+_RECORD_HEADER = 'header'
+_RECORD_RIG = 'rig'
+_RECORD_MODULE = 'module'
+
+
+def _write_record(fp, record):
+    fp.write(json.dumps(record, separators=(',', ':')))
+    fp.write('\n')
+
+
+def export_json_stream(rigs, path, compresslevel=6):
+    """
+    Export rigs to a gzip compressed json-lines file.
+    The rigs are written without their modules, then each module is written on it's own line.
+    Only one module is converted at a time.
+    The networks of the objects are not stored since the file can be imported in another scene.
+    :param rigs: A list of Rig instances.
+    :param path: The destination file.
+    :return: A dict containing the number of rigs and modules exported.
+    """
+    num_modules = 0
+    fp = gzip.open(path, 'wb', compresslevel)
+    try:
+        _write_record(fp, {'type': _RECORD_HEADER, 'version': STREAM_VERSION, 'num_rigs': len(rigs)})
+        for rig_index, rig in enumerate(rigs):
+            _write_record(fp, {
+                'type': _RECORD_RIG,
+                'rig': rig_index,
+                'data': export_plain(rig, exclude=('modules',), export_networks=False)
+            })
+            for module in rig.modules or []:
+                cls = module.__class__
+                _write_record(fp, {
+                    'type': _RECORD_MODULE,
+                    'rig': rig_index,
+                    'name': module.name,
+                    'classes': [base.__name__ for base in cls.__mro__],
+                    'data': export_plain(module, export_networks=False)
+                })
+                num_modules += 1
+    finally:
+        fp.close()
+
+    return {'rigs': len(rigs), 'modules': num_modules}
+
+
+def iter_json_stream(path):
+    """
+    Read the records of a file created by export_json_stream one at a time.
+    """
+    fp = gzip.open(path, 'rb')
+    try:
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        fp.close()
+
+
+def import_json_stream(path, names=None, classes=None):
+    """
+    Import rigs from a file created by export_json_stream.
+    :param names: If provided, only the modules with those names will be imported.
+    :param classes: If provided, only the modules that are instance of those classes names will be imported.
+    :return: A list of Rig instances.
+    """
+    names = set(names) if names else None
+    classes = set(classes) if classes else None
+
+    rigs = []
+    for record in iter_json_stream(path):
+        record_type = record.get('type')
+        if record_type == _RECORD_HEADER:
+            if record.get('version') != STREAM_VERSION:
+                raise Exception("Unsupported file version {0} in {1}".format(record.get('version'), path))
+        elif record_type == _RECORD_RIG:
+            rig = import_plain(record['data'], import_networks=False)
+            rig.modules = []
+            rigs.append(rig)
+        elif record_type == _RECORD_MODULE:
+            # Skip the modules we don't need before converting them.
+            if names is not None and record['name'] not in names:
+                continue
+            if classes is not None and not classes.intersection(record['classes']):
+                continue
+            module = import_plain(record['data'], import_networks=False)
+            rigs[record['rig']].modules.append(module)
+
+    # The rigs were imported without their modules, call their cleaning routine again.
+    for rig in rigs:
+        fn = getattr(rig, '__callbackNetworkPostBuild__', None)
+        if fn:
+            fn()
+
+    return rigs
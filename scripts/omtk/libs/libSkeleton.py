@@ -3,9 +3,15 @@ Various utility methods that help the job of laying out the skeletton for a Rig.
 """
 import pymel.core as pymel
 from omtk.libs import libPymel
+from omtk.libs import libPython
 from maya import OpenMaya
 import math
 
+# numpy is not shipped with every maya version, it is needed by analyse_skeleton.
+numpy = None
+if libPython.does_module_exist('numpy'):
+    import numpy
+
 def mirror_obj(obj_src, obj_dst=None):
     """
     Method to mirror joints in behavior.
@@ -106,3 +112,232 @@ def freeze_selected_joints_rotation():
         transfer_rotation_to_joint_orient(jnt)
 
 
+
+
+#
+# Skeleton analysis
+#
+# The following functions work on a flat representation of the skeletons: the index of the parent of each joint
+# (-1 for roots) and the world position of each joint. All the joints are processed at once using numpy.
+#
+
+def _get_parents_array(parents):
+    """
+    :return: A numpy array of n+1 parent indices where the missing parents point to a sentinel (n) that is it's own parent.
+    """
+    parents = numpy.asarray(parents, dtype=numpy.int64)
+    num_jnts = len(parents)
+    result = numpy.empty(num_jnts + 1, dtype=numpy.int64)
+    result[:num_jnts] = numpy.where(parents < 0, num_jnts, parents)
+    result[num_jnts] = num_jnts
+    return result
+
+
+def get_root_indices(parents):
+    """
+    :param parents: The index of the parent of each joint, -1 for roots.
+    :return: The index of the root of each joint.
+    """
+    parents = numpy.asarray(parents, dtype=numpy.int64)
+    # Pointer jumping, each iteration double the distance covered so this take log(depth) iterations.
+    ptr = numpy.where(parents < 0, numpy.arange(len(parents)), parents)
+    while True:
+        ptr_next = ptr[ptr]
+        if numpy.array_equal(ptr_next, ptr):
+            return ptr
+        ptr = ptr_next
+
+
+def get_depths(parents):
+    """
+    :param parents: The index of the parent of each joint, -1 for roots.
+    :return: The number of parents of each joint.
+    """
+    ptr = _get_parents_array(parents)
+    num_jnts = len(ptr) - 1
+    depths = numpy.zeros(num_jnts + 1, dtype=numpy.int64)
+    depths[:num_jnts] = ptr[:num_jnts] != num_jnts
+    # List ranking, each iteration double the distance covered so this take log(depth) iterations.
+    while True:
+        mask = ptr != num_jnts
+        if not mask.any():
+            return depths[:num_jnts]
+        depths[mask] += depths[ptr[mask]]
+        ptr[mask] = ptr[ptr[mask]]
+
+
+def get_ancestor_indices(parents, level):
+    """
+    :param level: 1 for the parents, 2 for the grand-parents, etc.
+    :return: The index of the ancestor of each joint at the provided level, -1 if there's none.
+    """
+    ptr = _get_parents_array(parents)
+    num_jnts = len(ptr) - 1
+    result = numpy.arange(num_jnts)
+    for _ in range(level):
+        result = ptr[result]
+    return numpy.where(result == num_jnts, -1, result)
+
+
+def get_subtree_mask(parents, mask):
+    """
+    :param mask: A boolean value for each joint.
+    :return: A boolean value for each joint that is True if the joint or one of it's ancestors is True in mask.
+    """
+    ptr = _get_parents_array(parents)
+    num_jnts = len(ptr) - 1
+    result = numpy.zeros(num_jnts + 1, dtype=bool)
+    result[:num_jnts] = mask
+    while True:
+        has_parent = ptr != num_jnts
+        if not has_parent.any():
+            return result[:num_jnts]
+        result[has_parent] |= result[ptr[has_parent]]
+        ptr[has_parent] = ptr[ptr[has_parent]]
+
+
+def get_num_children(parents):
+    parents = numpy.asarray(parents, dtype=numpy.int64)
+    return numpy.bincount(parents[parents >= 0], minlength=len(parents))[:len(parents)]
+
+
+def _get_directions(positions, indices_inn, indices_out):
+    """
+    :return: The normalized direction from each joint in indices_inn to the matching joint in indices_out.
+    """
+    vals = positions[indices_out] - positions[indices_inn]
+    lengths = numpy.sqrt((vals * vals).sum(axis=1))
+    lengths[lengths == 0] = 1.0
+    return vals / lengths[:, numpy.newaxis]
+
+
+def _filter_overlapping_chains(chains, used):
+    """
+    Keep the chains in order, ignoring any chain that contain a joint already used.
+    :param used: A boolean value for each joint, updated with the joints of the accepted chains.
+    """
+    result = []
+    for chain in chains:
+        if used[chain].any():
+            continue
+        used[chain] = True
+        result.append(chain.tolist())
+    return result
+
+
+class SkeletonLayout(object):
+    """
+    Result of analyse_skeleton for a single root. The joints are referenced by their index.
+    """
+    def __init__(self, root, height=0.0, radius=0.0):
+        self.root = root
+        self.height = height
+        self.radius = radius
+        self.legs = []  # [thigh, calf, foot, toe, tip]
+        self.arms = []  # [upperarm, forearm, hand]
+        self.spines = []  # from the bottom to the top
+
+    def __repr__(self):
+        return '<SkeletonLayout root={0} legs={1} arms={2} spines={3}>'.format(
+            self.root, len(self.legs), len(self.arms), len(self.spines)
+        )
+
+
+def analyse_skeleton(parents, positions, leg_direction_max=-0.5, arm_direction_max=0.75, spine_direction_min=0.75):
+    """
+    Detect the legs, the arms and the spines of every skeleton.
+    It is recommended that the 't-pose' or 45 angle 't-pose' is respected.
+    - A leg is a chain of 5 joints ending without children where the first two segments point to the ground.
+    - An arm is a chain of 3 joints where the first segment don't point upward. The last joint (the hand) have either
+      no children or at least two (the fingers).
+    - A spine is a chain of joints pointing upward that is not part of a leg or an arm.
+    :param parents: The index of the parent of each joint, -1 for roots.
+    :param positions: The world position of each joint.
+    :return: A list of SkeletonLayout, one for each root.
+    """
+    if numpy is None:
+        raise Exception("numpy is required to analyse skeletons.")
+
+    positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3)
+    parents = numpy.asarray(parents, dtype=numpy.int64)
+    num_jnts = len(parents)
+    if len(positions) != num_jnts:
+        raise Exception("Expected {0} positions, got {1}".format(num_jnts, len(positions)))
+
+    indices = numpy.arange(num_jnts)
+    roots = get_root_indices(parents)
+    depths = get_depths(parents)
+    num_children = get_num_children(parents)
+    ancestors = [get_ancestor_indices(parents, level) for level in range(1, 5)]
+    used = numpy.zeros(num_jnts, dtype=bool)
+
+    # Legs
+    thigh, calf, foot, toe = ancestors[3], ancestors[2], ancestors[1], ancestors[0]
+    mask = (num_children == 0) & (thigh != -1)
+    candidates = indices[mask]
+    if len(candidates):
+        mask_dir = (_get_directions(positions, thigh[candidates], calf[candidates])[:, 1] < leg_direction_max) & \
+                   (_get_directions(positions, calf[candidates], foot[candidates])[:, 1] < leg_direction_max)
+        candidates = candidates[mask_dir]
+    chains = numpy.column_stack((thigh[candidates], calf[candidates], foot[candidates], toe[candidates], candidates))
+    legs = _filter_overlapping_chains(chains[numpy.argsort(depths[candidates], kind='mergesort')], used)
+
+    # Arms
+    # Prefer the hands (with fingers) since a finger tip could also look like an arm.
+    upperarm, forearm = ancestors[1], ancestors[0]
+    mask = ((num_children == 0) | (num_children >= 2)) & (upperarm != -1) & ~used
+    candidates = indices[mask]
+    if len(candidates):
+        mask_dir = numpy.abs(
+            _get_directions(positions, upperarm[candidates], forearm[candidates])[:, 1]
+        ) <= arm_direction_max
+        candidates = candidates[mask_dir]
+    arms = []
+    for is_hand in (True, False):
+        sub_candidates = candidates[(num_children[candidates] >= 2) == is_hand]
+        sub_candidates = sub_candidates[numpy.argsort(depths[sub_candidates], kind='mergesort')]
+        if not is_hand:
+            # Ignore anything under an hand (the fingers).
+            hands = numpy.zeros(num_jnts, dtype=bool)
+            hands[[arm[-1] for arm in arms]] = True
+            sub_candidates = sub_candidates[~get_subtree_mask(parents, hands)[sub_candidates]]
+        chains = numpy.column_stack((upperarm[sub_candidates], forearm[sub_candidates], sub_candidates))
+        arms.extend(_filter_overlapping_chains(chains, used))
+
+    # Spines
+    parent = ancestors[0]
+    mask = (parent != -1) & ~used
+    candidates = indices[mask]
+    if len(candidates):
+        mask_dir = _get_directions(positions, parent[candidates], candidates)[:, 1] >= spine_direction_min
+        candidates = candidates[mask_dir]
+    is_spine = numpy.zeros(num_jnts, dtype=bool)
+    is_spine[candidates] = True
+    spine_children = {}
+    for index in candidates[numpy.argsort(depths[candidates], kind='mergesort')]:
+        spine_children.setdefault(parent[index], []).append(index)
+    spines = []
+    for index in candidates:
+        if is_spine[parent[index]]:
+            continue  # Not the start of a chain
+        chain = [parent[index], index] if not used[parent[index]] else [index]
+        while chain[-1] in spine_children:
+            chain.append(spine_children[chain[-1]][0])
+        if len(chain) >= 2:
+            used[chain] = True
+            spines.append([int(i) for i in chain])
+
+    # Group everything by root
+    heights = numpy.zeros(num_jnts, dtype=numpy.float64)
+    radiuses = numpy.zeros(num_jnts, dtype=numpy.float64)
+    numpy.maximum.at(heights, roots, positions[:, 1])
+    numpy.maximum.at(radiuses, roots, numpy.sqrt(positions[:, 0] ** 2 + positions[:, 2] ** 2))
+
+    layout_by_root = {}
+    for root in indices[parents < 0]:
+        layout_by_root[root] = SkeletonLayout(int(root), height=float(heights[root]), radius=float(radiuses[root]))
+    for attr, chains in (('legs', legs), ('arms', arms), ('spines', spines)):
+        for chain in chains:
+            getattr(layout_by_root[roots[chain[0]]], attr).append(chain)
+
+    return [layout_by_root[root] for root in sorted(layout_by_root)]
@@ -1,19 +1,489 @@
+import ctypes
+
 import pymel.core as pymel
 from maya import OpenMaya
 from omtk.libs import libPymel
+from omtk.libs import libPython
+from omtk.libs import libSegments
+
+# numpy is not shipped with every maya version, the weights are processed in python if it is missing.
+numpy = None
+if libPython.does_module_exist('numpy'):
+    import numpy
+
+
+#
+# Deformation index
+#
+
+class _NodeKey(object):
+    """
+    A key that identify a node for it's whole lifetime, even if it is renamed.
+    The hashCode of a MObjectHandle is not unique so the keys also compare the nodes themselves.
+    """
+    __slots__ = ('handle', '_hash')
+
+    def __init__(self, mobj):
+        self.handle = OpenMaya.MObjectHandle(mobj)
+        self._hash = self.handle.hashCode()
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, _NodeKey) or self._hash != other._hash:
+            return False
+        if not self.handle.isValid() or not other.handle.isValid():
+            return False
+        return self.handle.object() == other.handle.object()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def _get_key(obj):
+    return _NodeKey(obj.__apimobject__())
+
+
+def _get_shape(obj):
+    if isinstance(obj, pymel.nodetypes.Transform):
+        return next(iter(shape for shape in obj.getShapes() if not shape.intermediateObject.get()), obj)
+    return obj
+
+
+def _get_future_meshes(obj):
+    return [hist for hist in obj.listHistory(future=True) if isinstance(hist, pymel.nodetypes.Mesh)]
+
+
+class DeformationIndex(object):
+    """
+    Index of the deformation relationships in the scene: influence -> skinClusters -> output meshes and
+    the deformer stack of each mesh.
+    The skinClusters and their influences are read once, the rest is only read when needed and kept in cache.
+    This prevent calling listHistory on every joint and mesh.
+
+    The index is invalidated when a deformer is created, deleted or when it's connections change.
+
+    Usage:
+        index = libSkinning.get_deformation_index()
+        index.get_skin_clusters(jnt)
+        index.get_affected_meshes(jnt)
+        index.get_skin_cluster(mesh)
+    """
+    def __init__(self):
+        self._skin_clusters_by_influence = {}
+        self._output_geometries_by_skin_cluster = {}
+        self._future_meshes_by_key = {}
+        self._deformers_by_mesh = {}
+        self._read()
+
+    def __str__(self):
+        return '<DeformationIndex {0} influences>'.format(len(self._skin_clusters_by_influence))
+
+    def _read(self):
+        for skin_cluster in pymel.ls(type='skinCluster'):
+            for influence in skin_cluster.influenceObjects():
+                self._skin_clusters_by_influence.setdefault(_get_key(influence), []).append(skin_cluster)
+
+    def get_skin_clusters(self, influence):
+        """
+        :return: The skinClusters using the provided influence.
+        """
+        return list(self._skin_clusters_by_influence.get(_get_key(influence), []))
+
+    def get_output_geometries(self, skin_cluster):
+        key = _get_key(skin_cluster)
+        geometries = self._output_geometries_by_skin_cluster.get(key)
+        if geometries is None:
+            geometries = self._output_geometries_by_skin_cluster[key] = skin_cluster.getOutputGeometry()
+        return list(geometries)
+
+    def get_affected_geometries(self, influence):
+        """
+        :return: The output geometries of all the skinClusters using the provided influence.
+        """
+        geometries = []
+        for skin_cluster in self.get_skin_clusters(influence):
+            for geometry in self.get_output_geometries(skin_cluster):
+                if geometry not in geometries:
+                    geometries.append(geometry)
+        return geometries
+
+    def _get_future_meshes(self, skin_cluster):
+        key = _get_key(skin_cluster)
+        meshes = self._future_meshes_by_key.get(key)
+        if meshes is None:
+            meshes = self._future_meshes_by_key[key] = _get_future_meshes(skin_cluster)
+        return meshes
+
+    def get_affected_meshes(self, influence):
+        """
+        :return: The meshes affected by the provided influence, from the nearest to the farthest in the geometry stack.
+        """
+        skin_clusters = self.get_skin_clusters(influence)
+        # The future of a single skinCluster is cached, the index is invalidated when it's connections change.
+        if len(skin_clusters) == 1:
+            return list(self._get_future_meshes(skin_clusters[0]))
+
+        # An object that is not an influence can still affect meshes. (ex: a constrained joint)
+        # The index is not invalidated when those connections change so the history is always read.
+        # The same goes for influences of multiple skinClusters, only the history know the order of their meshes.
+        return _get_future_meshes(influence)
+
+    def get_deformers(self, geometry):
+        """
+        :return: The deformers of a geometry, from the last applied to the first.
+        """
+        geometry = _get_shape(geometry)
+        key = _get_key(geometry)
+        deformers = self._deformers_by_mesh.get(key)
+        if deformers is None:
+            deformers = self._deformers_by_mesh[key] = [
+                hist for hist in pymel.listHistory(geometry) if isinstance(hist, pymel.nodetypes.GeometryFilter)
+            ]
+        return list(deformers)
+
+    def get_skin_cluster(self, geometry):
+        return next(iter(
+            deformer for deformer in self.get_deformers(geometry) if isinstance(deformer, pymel.nodetypes.SkinCluster)
+        ), None)
+
+
+_deformation_index = None
+
+
+def _on_deformers_changed(*args):
+    global _deformation_index
+    _deformation_index = None
+
+
+def _on_connection_changed(src_plug, dst_plug, *args):
+    # Only the connections of deformers can change the index.
+    if src_plug.node().hasFn(OpenMaya.MFn.kGeometryFilt) or dst_plug.node().hasFn(OpenMaya.MFn.kGeometryFilt):
+        _on_deformers_changed()
+
+
+def _add_deformation_index_callbacks():
+    global _deformation_index_callback_ids
+    if _deformation_index_callback_ids:
+        return
+    _deformation_index_callback_ids = [
+        OpenMaya.MDGMessage.addNodeAddedCallback(_on_deformers_changed, 'geometryFilter'),
+        OpenMaya.MDGMessage.addNodeRemovedCallback(_on_deformers_changed, 'geometryFilter'),
+        OpenMaya.MDGMessage.addConnectionCallback(_on_connection_changed),
+        OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterOpen, _on_deformers_changed),
+        OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterNew, _on_deformers_changed)
+    ]
+
+# Remove the callbacks registered by a previous import of the module.
+for _callback_id in globals().get('_deformation_index_callback_ids', []):
+    OpenMaya.MMessage.removeCallback(_callback_id)
+_deformation_index_callback_ids = []
+
+
+def get_deformation_index():
+    """
+    :return: A DeformationIndex of the current scene. The same index is returned until the deformers change.
+    """
+    global _deformation_index
+    if _deformation_index is None:
+        _add_deformation_index_callbacks()
+        _deformation_index = DeformationIndex()
+    return _deformation_index
+
+
+def invalidate_deformation_index():
+    global _deformation_index
+    _deformation_index = None
+
 
 def get_skin_cluster(obj):
-    for hist in pymel.listHistory(obj):
-        if isinstance(hist, pymel.nodetypes.SkinCluster):
-            return hist
-    return None
+    return get_deformation_index().get_skin_cluster(obj)
+
+#
+# Weights buffers
+#
+
+def _get_double_buffer(size):
+    """
+    Allocate a buffer of doubles owned by maya and expose it as a numpy array without copying it.
+    The swig pointer is converted to an address so the copies from/to maya arrays happen in C++ and numpy
+    instead of iterating over each element in python.
+    :return: The MScriptUtil owning the buffer, the buffer as a swig double pointer and as a numpy array.
+    The MScriptUtil need to be kept alive as long as the pointer or the numpy array are used.
+    """
+    util = OpenMaya.MScriptUtil()
+    util.createFromList([0.0] * size, size)
+    ptr = util.asDoublePtr()
+    view = numpy.ctypeslib.as_array((ctypes.c_double * size).from_address(int(ptr)))
+    return util, ptr, view
+
+
+def _to_numpy(mdoublearray):
+    """
+    :return: The content of a MDoubleArray as a numpy array.
+    """
+    size = mdoublearray.length()
+    if not size:
+        return numpy.zeros(0, dtype=numpy.float64)
+    try:
+        util, ptr, view = _get_double_buffer(size)
+    except TypeError:  # The swig pointer can't be converted to an address, copy each element.
+        return numpy.fromiter(mdoublearray, dtype=numpy.float64, count=size)
+    mdoublearray.get(ptr)
+    return view.copy()
+
+
+def _to_mdoublearray(values):
+    """
+    :return: The content of a numpy array as a MDoubleArray.
+    """
+    values = numpy.ascontiguousarray(values, dtype=numpy.float64).ravel()
+    size = len(values)
+    if not size:
+        return OpenMaya.MDoubleArray()
+    try:
+        util, ptr, view = _get_double_buffer(size)
+    except TypeError:  # The swig pointer can't be converted to an address, copy each element.
+        util = OpenMaya.MScriptUtil()
+        util.createFromList(values.tolist(), size)
+        return OpenMaya.MDoubleArray(util.asDoublePtr(), size)
+    view[:] = values
+    return OpenMaya.MDoubleArray(ptr, size)
+
+
+class SparseWeights(object):
+    """
+    Skin weights stored as compressed sparse rows (CSR), only the non-zero weights are kept in memory.
+    The weights of vertex v are data[indptr[v]:indptr[v+1]] and their influence indices are
+    indices[indptr[v]:indptr[v+1]], sorted by influence.
+    """
+    def __init__(self, num_vertices, indptr, indices, data):
+        self.num_vertices = num_vertices
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __repr__(self):
+        return '<SparseWeights {0} vertices, {1} weights>'.format(self.num_vertices, self.num_weights)
+
+    @property
+    def num_weights(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    @classmethod
+    def from_coo(cls, num_vertices, rows, columns, values):
+        """
+        :param rows: The vertex index of each weight.
+        :param columns: The influence index of each weight.
+        :param values: The value of each weight.
+        """
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        columns = numpy.asarray(columns, dtype=numpy.int32)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        order = numpy.lexsort((columns, rows))
+        indptr = numpy.zeros(num_vertices + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rows, minlength=num_vertices), out=indptr[1:])
+        return cls(num_vertices, indptr, columns[order], values[order])
+
+    @classmethod
+    def from_dense(cls, weights, influence_indices=None):
+        """
+        :param weights: A (vertices, influences) numpy array.
+        :param influence_indices: The influence index of each column. Default to the column index.
+        """
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        if influence_indices is None:
+            influence_indices = numpy.arange(weights.shape[1])
+        rows, columns = numpy.nonzero(weights)
+        return cls.from_coo(len(weights), rows, numpy.asarray(influence_indices)[columns], weights[rows, columns])
+
+    def _get_rows(self):
+        """
+        :return: The vertex index of each weight.
+        """
+        return numpy.repeat(numpy.arange(self.num_vertices), numpy.diff(self.indptr))
+
+    def get_influences(self):
+        """
+        :return: The sorted indices of the influences having at least one non-zero weight.
+        """
+        return numpy.unique(self.indices)
+
+    def to_dense(self, influence_indices):
+        """
+        :param influence_indices: The influences to extract.
+        :return: A (vertices, influences) numpy array.
+        """
+        influence_indices = numpy.asarray(influence_indices, dtype=numpy.int64).ravel()
+        dense = numpy.zeros((self.num_vertices, len(influence_indices)), dtype=numpy.float64)
+        if not len(influence_indices) or not self.num_weights:
+            return dense
+        order = numpy.argsort(influence_indices)
+        sorted_indices = influence_indices[order]
+        positions = numpy.searchsorted(sorted_indices, self.indices).clip(0, len(sorted_indices) - 1)
+        mask = sorted_indices[positions] == self.indices
+        dense[self._get_rows()[mask], order[positions[mask]]] = self.data[mask]
+        return dense
+
+    def set_influences(self, influence_indices, weights):
+        """
+        Replace all the weights of some influences.
+        :param influence_indices: The influences to replace.
+        :param weights: A (vertices, influences) numpy array containing the new weights.
+        :return: A new SparseWeights instance.
+        """
+        influence_indices = numpy.asarray(influence_indices, dtype=numpy.int64).ravel()
+        weights = numpy.asarray(weights, dtype=numpy.float64).reshape(self.num_vertices, len(influence_indices))
+        keep = ~numpy.in1d(self.indices, influence_indices)
+        new_rows, new_columns = numpy.nonzero(weights)
+        return self.from_coo(
+            self.num_vertices,
+            numpy.concatenate([self._get_rows()[keep], new_rows]),
+            numpy.concatenate([self.indices[keep], influence_indices[new_columns]]),
+            numpy.concatenate([self.data[keep], weights[new_rows, new_columns]])
+        )
+
+    def transfer(self, src_indices, dst_index):
+        """
+        Sparse equivalent of transfer_weights_array.
+        :param src_indices: The influences to transfer from.
+        :param dst_index: The influence to transfer to.
+        :return: A new SparseWeights instance.
+        """
+        src_indices = [index for index in src_indices if index != dst_index]
+        if not src_indices:
+            return self
+        mask = numpy.in1d(self.indices, src_indices)
+        total_weights = numpy.bincount(self._get_rows()[mask], weights=self.data[mask], minlength=self.num_vertices)
+        weights = numpy.zeros((self.num_vertices, len(src_indices) + 1), dtype=numpy.float64)
+        weights[:, -1] = self.to_dense([dst_index])[:, 0] + total_weights
+        return self.set_influences(src_indices + [dst_index], weights)
+
+
+# Number of influences requested at once by get_weights, this bound the size of the dense buffer returned by maya.
+WEIGHTS_CHUNK_SIZE = 16
+
+
+def get_weights(skinCluster, geometry, influence_indices=None, chunk_size=WEIGHTS_CHUNK_SIZE):
+    """
+    Read the weights of a skinned geometry without ever allocating the dense weights of all its influences.
+    :param skinCluster: The skinCluster to read from.
+    :param geometry: The geometry to read from.
+    :param influence_indices: The indices of the influences to read. Default to all the influences.
+    :param chunk_size: The number of influences to read at once.
+    :return: A SparseWeights instance.
+    """
+    if influence_indices is None:
+        influence_indices = range(len(skinCluster.influenceObjects()))
+    influence_indices = list(influence_indices)
+
+    mfnSkinCluster = skinCluster.__apimfn__()
+    geometryDagPath = geometry.__apimdagpath__()
+    component = pymel.api.toComponentMObject(geometryDagPath)
+    num_vertices = OpenMaya.MItGeometry(geometryDagPath).count()
+
+    rows = []
+    columns = []
+    values = []
+    for i in range(0, len(influence_indices), chunk_size):
+        chunk = influence_indices[i:i + chunk_size]
+        influences = OpenMaya.MIntArray()
+        for index in chunk:
+            influences.append(index)
+        weights = OpenMaya.MDoubleArray()
+        mfnSkinCluster.getWeights(geometryDagPath, component, influences, weights)
+        weights = _to_numpy(weights).reshape(num_vertices, len(chunk))
+        chunk_rows, chunk_columns = numpy.nonzero(weights)
+        rows.append(chunk_rows)
+        columns.append(numpy.asarray(chunk, dtype=numpy.int32)[chunk_columns])
+        values.append(weights[chunk_rows, chunk_columns])
+
+    if not rows:
+        return SparseWeights.from_coo(num_vertices, [], [], [])
+    return SparseWeights.from_coo(num_vertices, numpy.concatenate(rows), numpy.concatenate(columns), numpy.concatenate(values))
+
+
+def _get_weighted_influence_indices(skinCluster):
+    """
+    :return: The indices of the influences that have non-zero weights, without reading the weights.
+    """
+    influence_objects = skinCluster.influenceObjects()
+    return sorted(influence_objects.index(influence) for influence in skinCluster.getWeightedInfluence() or [])
+
+
+def set_weights(skinCluster, geometry, weights, influence_indices):
+    """
+    Write the weights of some influences of a skinned geometry, the other influences are not touched.
+    :param skinCluster: The skinCluster to write to.
+    :param geometry: The geometry to write to.
+    :param weights: A SparseWeights instance or a (vertices, influences) numpy array.
+    :param influence_indices: The indices of the influences to write.
+    """
+    influence_indices = list(influence_indices)
+    if isinstance(weights, SparseWeights):
+        weights = weights.to_dense(influence_indices)
+
+    influences = OpenMaya.MIntArray()
+    for index in influence_indices:
+        influences.append(index)
+
+    mfnSkinCluster = skinCluster.__apimfn__()
+    geometryDagPath = geometry.__apimdagpath__()
+    component = pymel.api.toComponentMObject(geometryDagPath)
+    old_weights = OpenMaya.MDoubleArray()
+    mfnSkinCluster.setWeights(geometryDagPath, component, influences, _to_mdoublearray(weights), False, old_weights)
+
+
+def transfer_weights_array(weights, src_indices, dst_index):
+    """
+    Move the weights of multiple influences to another influence.
+    :param weights: A (vertices, influences) numpy array.
+    :param src_indices: The columns to transfer from.
+    :param dst_index: The column to transfer to.
+    :return: A new (vertices, influences) numpy array.
+    """
+    new_weights = numpy.array(weights, dtype=numpy.float64, copy=True)
+    src_indices = list(src_indices)
+    if not src_indices:
+        return new_weights
+    total_weights = new_weights[:, src_indices].sum(axis=1)
+    new_weights[:, src_indices] = 0.0
+    new_weights[:, dst_index] += total_weights
+    return new_weights
+
+
+def _transfer_weights_loop(weights, num_vertices, num_jnts, src_indices, dst_index):
+    """
+    Same as transfer_weights_array but on a flat buffer (list or MDoubleArray) modified in place.
+    Used when numpy is not available.
+    """
+    for v in range(num_vertices):
+        total_weight = 0
+        # Remove source weights
+        for source_index in src_indices:
+            i = source_index + (v * num_jnts)
+            w = weights[i]
+            if w:
+                weights[i] = 0
+                total_weight += w
+        # Apply target weights if necessary
+        if total_weight:
+            i = dst_index + (v * num_jnts)
+            weights[i] += total_weight
+    return weights
+
 
 #@decorators.profiler
 def transfer_weights(obj, sources, target, add_missing_influences=False):
     """
     Transfer skin weights from multiples joints to a specific joint.
     Took 0.193 in Makino.
-    :param obj: The skinned geometry.
+    :param obj: The skinned geometry or a list of skinned geometries.
     :param sources: An array of the joints to transfer from.
     :param target: The joint to transfer to.
     :return:
@@ -21,6 +491,10 @@ def transfer_weights(obj, sources, target, add_missing_influences=False):
     # TODO: Allow the skinCluster to be specified in case a specific geometry is bound to multiple skinClusters.
     # TODO: automatically unlock influences?
     # TODO: add missing influences if necessary?
+    if isinstance(obj, (list, tuple, set)):
+        for sub_obj in obj:
+            transfer_weights(sub_obj, sources, target, add_missing_influences=add_missing_influences)
+        return
 
     # Validate obj type
     if not isinstance(obj, pymel.nodetypes.Mesh):
@@ -46,12 +520,8 @@ def transfer_weights(obj, sources, target, add_missing_influences=False):
     if not sources:
         print "Abording transfering on {0}, nothing to transfer".format(obj.name())
 
-    num_jnts = len(influence_jnts)
     jnt_src_indices = [influence_jnts.index(source) for source in sources]
     jnt_dst_index = influence_jnts.index(target)
-    influences = OpenMaya.MIntArray()
-    for i in range(len(influence_jnts)):
-        influences.append(i)
 
     # Ensure no provided joints are locked
     for source in sources:
@@ -60,6 +530,17 @@ def transfer_weights(obj, sources, target, add_missing_influences=False):
     if target.lockInfluenceWeights.get():
         target.lockInfluenceWeights.set(False)
 
+    # Only the sources and the target are read and written.
+    if numpy is not None:
+        influence_indices = sorted(set(jnt_src_indices + [jnt_dst_index]))
+        weights = get_weights(skinCluster, obj, influence_indices)
+        set_weights(skinCluster, obj, weights.transfer(jnt_src_indices, jnt_dst_index), influence_indices)
+        return
+
+    num_jnts = len(influence_jnts)
+    influences = OpenMaya.MIntArray()
+    for i in range(len(influence_jnts)):
+        influences.append(i)
 
     # Get weights
     old_weights = OpenMaya.MDoubleArray()
@@ -71,20 +552,8 @@ def transfer_weights(obj, sources, target, add_missing_influences=False):
     # Compute new weights
     new_weights = OpenMaya.MDoubleArray()
     new_weights.copy(old_weights)
-    num_vertices = len(obj.vtx)
-    for v in range(num_vertices):
-        total_weight = 0
-        # Remove source weights
-        for source_index in jnt_src_indices:
-            i = source_index + (v * num_jnts)
-            w = new_weights[i]
-            if w:
-                new_weights[i] = 0
-                total_weight += w
-        # Apply target weights if necessary
-        if total_weight:
-            i = jnt_dst_index + (v * num_jnts)
-            new_weights[i] += total_weight
+    num_vertices = old_weights.length() // num_jnts
+    _transfer_weights_loop(new_weights, num_vertices, num_jnts, jnt_src_indices, jnt_dst_index)
 
     mfnSkinCluster.setWeights(geometryDagPath, component, influences, new_weights, old_weights)
 
@@ -150,11 +619,7 @@ def transfer_weights_replace(source, target):
 def interp_linear(r, s, e):
     return (e - s) * r + s
 
-def interp_cubic(x):
-    """
-    src: http://stackoverflow.com/questions/1146281/cubic-curve-smooth-interpolation-in-c-sharp
-    """
-    return (x * x) * (3.0 - (2.0 * x))
+interp_cubic = libSegments.interp_cubic
 
 def _get_point_weights_from_segments_weights(segments, segments_weights, pos):
     knot_index, ratio = segments.closest_segment_index(pos)
@@ -164,16 +629,43 @@ def _get_point_weights_from_segments_weights(segments, segments_weights, pos):
     point_weights = [(weight_out - weight_inn)*interp_cubic(ratio) + weight_inn for weight_inn, weight_out in zip(point_weights_inn, point_weights_out)]
     return point_weights
 
-#@libPython.profiler
-def transfer_weights_from_segments(obj, source, targets, dropoff=2):
+def get_weights_from_segments(segments, segments_weights, positions):
     """
-    Automatically assign skin weights from source to destinations using the vertices position.
+    Vectorized equivalent of _get_point_weights_from_segments_weights.
+    :param segments: A libPymel.SegmentCollection.
+    :param segments_weights: The knot weights as returned by SegmentCollection.get_knot_weights.
+    :param positions: A (n, 3) numpy array.
+    :return: A (n, knots) numpy array containing the weights of each position.
+    """
+    starts, ends = segments.get_arrays()
+    return libSegments.get_weights_from_segments(starts, ends, segments_weights, positions)
+
+def _get_geometry_positions(geometryDagPath):
+    """
+    :return: The world position of all the vtx/cvs of a geometry as a (n, 3) numpy array, in MItGeometry order.
     """
-    # Resolve the world position of the targets
-    dst_positions = []
-    for target in targets:
-        dst_positions.append(target.getTranslation(space='world'))
+    points = OpenMaya.MPointArray()
+    it_geometry = OpenMaya.MItGeometry(geometryDagPath)
+    it_geometry.allPositions(points, OpenMaya.MSpace.kWorld)
+    size = points.length()
+    if not size:
+        return numpy.zeros((0, 3), dtype=numpy.float64)
 
+    # Copy the points (x, y, z, w) in a maya owned buffer exposed to numpy, see _get_double_buffer.
+    try:
+        util, _, view = _get_double_buffer(size * 4)
+        points.get(util.asDouble4Ptr())
+    except TypeError:  # The swig pointer can't be converted to an address, copy each point.
+        return numpy.array(
+            [(points[i].x, points[i].y, points[i].z) for i in xrange(size)], dtype=numpy.float64
+        ).reshape(-1, 3)
+    return view.reshape(size, 4)[:, :3].copy()
+
+def _resolve_segments_influences(obj, source, targets):
+    """
+    :return: The skinCluster of obj, the influence indices of the source followed by the targets and the targets
+    present in the skinCluster. None if the weights can't be transfered.
+    """
     # Resolve skinCluster
     skinCluster = get_skin_cluster(obj)
     if skinCluster is None:
@@ -188,7 +680,7 @@ def transfer_weights_from_segments(obj, source, targets, dropoff=2):
             obj.__melobject__(),
             source.__melobject__()
         ))
-        return False
+        return None
 
     # Resolve targets indices
     targets = [target for target in targets if target in influence_objects]
@@ -196,16 +688,103 @@ def transfer_weights_from_segments(obj, source, targets, dropoff=2):
         pymel.warning("Can't transfer weights from segments in {0}, no targets found in skinCluster.".format(
             obj.__melobject__()
         ))
-        return False
+        return None
     jnt_dst_indexes = [influence_objects.index(target) for target in targets]
 
+    return skinCluster, [jnt_src_index] + jnt_dst_indexes, targets
+
+
+class SegmentsWeightsJob(object):
+    """
+    Everything transfer_weights_from_segments need to know about a geometry, read up front from maya.
+    The weights are computed using numpy only, this allow multiple jobs to be computed on a pool of processes
+    while only the main thread talk to maya.
+    """
+    def __init__(self, weights, positions, starts, ends, knot_weights, skinCluster=None, geometry=None, influence_indices=None):
+        self.weights = weights  # (vertices, 1 + knots), the first column is the source influence.
+        self.positions = positions
+        self.starts = starts
+        self.ends = ends
+        self.knot_weights = knot_weights
+        self.skinCluster = skinCluster
+        self.geometry = geometry
+        self.influence_indices = influence_indices
+
+    @classmethod
+    def from_geometry(cls, obj, source, targets, dropoff=2):
+        """
+        :return: A SegmentsWeightsJob or None if the weights can't be transfered.
+        """
+        resolved = _resolve_segments_influences(obj, source, targets)
+        if resolved is None:
+            return None
+        skinCluster, influence_indices, targets = resolved
+
+        segments = libPymel.SegmentCollection.from_transforms(targets)
+        starts, ends = segments.get_arrays()
+        knot_weights = numpy.array(segments.get_knot_weights(dropoff=dropoff), dtype=numpy.float64)
+
+        # Store the affected joints only
+        weights = get_weights(skinCluster, obj, influence_indices).to_dense(influence_indices)
+        positions = _get_geometry_positions(obj.__apimdagpath__())
+        return cls(weights, positions, starts, ends, knot_weights,
+                   skinCluster=skinCluster, geometry=obj, influence_indices=influence_indices)
+
+    def compute(self):
+        libSegments.transfer_weights_to_segments(self.weights, self.positions, self.starts, self.ends, self.knot_weights)
+
+    def write(self):
+        set_weights(self.skinCluster, self.geometry, self.weights, self.influence_indices)
+
+
+def transfer_weights_from_segments_batch(jobs, dropoff=2, num_processes=1):
+    """
+    Same as transfer_weights_from_segments on multiple geometries.
+    The positions and weights of all the geometries are read first, the weights are computed,
+    then written back to maya.
+    :param jobs: A list of (obj, source, targets) tuples.
+    :param dropoff: See transfer_weights_from_segments.
+    :param num_processes: See libSegments.compute_segments_weights. Default to the current process.
+    """
+    if numpy is None:
+        for obj, source, targets in jobs:
+            transfer_weights_from_segments(obj, source, targets, dropoff=dropoff)
+        return
+
+    segments_jobs = []
+    for obj, source, targets in jobs:
+        job = SegmentsWeightsJob.from_geometry(obj, source, targets, dropoff=dropoff)
+        if job is not None:
+            segments_jobs.append(job)
+
+    libSegments.compute_segments_weights(segments_jobs, num_processes=num_processes)
+
+    for job in segments_jobs:
+        job.write()
+
+#@libPython.profiler
+def transfer_weights_from_segments(obj, source, targets, dropoff=2):
+    """
+    Automatically assign skin weights from source to destinations using the vertices position.
+    """
+    if numpy is not None:
+        job = SegmentsWeightsJob.from_geometry(obj, source, targets, dropoff=dropoff)
+        if job is None:
+            return False
+        job.compute()
+        job.write()
+        return
+
+    resolved = _resolve_segments_influences(obj, source, targets)
+    if resolved is None:
+        return False
+    skinCluster, influence_indices, targets = resolved
 
     # Store the affected joints only
     # This allow us to reference the index to navigate in the weights table.
     mint_influences = OpenMaya.MIntArray()
-    mint_influences.append(jnt_src_index)
-    for dst_index in jnt_dst_indexes:
-        mint_influences.append(dst_index)
+    for index in influence_indices:
+        mint_influences.append(index)
     chunk_size = mint_influences.length()
 
     segments = libPymel.SegmentCollection.from_transforms(targets)
@@ -217,12 +796,12 @@ def transfer_weights_from_segments(obj, source, targets, dropoff=2):
     component = pymel.api.toComponentMObject(geometryDagPath)
     mfnSkinCluster.getWeights(geometryDagPath, component, mint_influences, old_weights)
 
+    knot_weights = segments.get_knot_weights(dropoff=dropoff)
+
     # Compute new weights
     new_weights = OpenMaya.MDoubleArray()
     new_weights.copy(old_weights)
 
-    knot_weights = segments.get_knot_weights(dropoff=dropoff)
-
     it_geometry= OpenMaya.MItGeometry(geometryDagPath)
     vert_index = 0
     while not it_geometry.isDone():
@@ -262,6 +841,21 @@ def assign_weights_from_segments(shape, jnts, dropoff=1.5):
     influence_objects = skinCluster.influenceObjects()
     jnt_indices = [influence_objects.index(jnt) for jnt in jnts]
 
+    segments = libPymel.SegmentCollection.from_transforms(jnts)
+    knot_weights = segments.get_knot_weights(dropoff=dropoff)
+
+    # Only write the joints and the influences that currently have weights.
+    # Note that every other weights are removed since we are re-skinning from scratch.
+    if numpy is not None:
+        influence_indices = sorted(set(_get_weighted_influence_indices(skinCluster)) | set(jnt_indices))
+        positions = _get_geometry_positions(shape.__apimdagpath__())
+        weights = numpy.zeros((len(positions), len(influence_indices)), dtype=numpy.float64)
+        weights[:, [influence_indices.index(index) for index in jnt_indices]] = get_weights_from_segments(
+            segments, knot_weights, positions
+        )
+        set_weights(skinCluster, shape, weights, influence_indices)
+        return
+
     # Create the OpenMaya influence MIntArray
     mint_influences = OpenMaya.MIntArray()
     chunk_size = len(influence_objects)
@@ -277,9 +871,6 @@ def assign_weights_from_segments(shape, jnts, dropoff=1.5):
 
     # Resolve new weights
     # Note that we start with zero weight since we are re-skinning from scratch.
-    segments = libPymel.SegmentCollection.from_transforms(jnts)
-    knot_weights = segments.get_knot_weights(dropoff=dropoff)
-
     new_weights = OpenMaya.MDoubleArray(old_weights.length(), 0)
 
     # Iterate through all vtx/cvs
@@ -287,14 +878,13 @@ def assign_weights_from_segments(shape, jnts, dropoff=1.5):
     vert_index = 0
     while not it_geometry.isDone():
         # Resolve weight using the vtx/cv position
-        memory_location = (chunk_size * vert_index) + jnt_indices[0]
+        memory_location = chunk_size * vert_index
         pos = OpenMaya.MVector(it_geometry.position(OpenMaya.MSpace.kWorld))  # MVector allow us to use .length()
         weights = _get_point_weights_from_segments_weights(segments, knot_weights, pos)
 
-        # Write weights
-        for weight in weights:
-            new_weights[memory_location] = weight
-            memory_location += 1
+        # Write weights, the joints are not necessarily consecutive in the skinCluster.
+        for jnt_index, weight in zip(jnt_indices, weights):
+            new_weights[memory_location + jnt_index] = weight
 
         it_geometry.next()
         vert_index += 1
@@ -302,14 +892,151 @@ def assign_weights_from_segments(shape, jnts, dropoff=1.5):
 
     mfnSkinCluster.setWeights(geometryDagPath, component, mint_influences, new_weights, old_weights)
 
+#
+# Weights snapshots
+#
+
+WEIGHTS_FILE_VERSION = 1
+
+
+def save_weights(meshes, path):
+    """
+    Save the skin weights of multiple meshes in a numpy .npz file.
+    For each mesh, the influence names, the vertex count and the sparse weights are stored.
+    :param meshes: The skinned meshes to save.
+    :param path: The destination .npz file.
+    :return: The names of the saved meshes.
+    """
+    arrays = {}
+    names = []
+    for mesh in meshes:
+        mesh = _get_shape(mesh)
+        skinCluster = get_skin_cluster(mesh)
+        if skinCluster is None:
+            pymel.warning("Can't save weights of {0}, no skinCluster found.".format(mesh.__melobject__()))
+            continue
+
+        weights = get_weights(skinCluster, mesh)
+        key = 'mesh{0}_'.format(len(names))
+        arrays[key + 'influences'] = numpy.array([influence.longName() for influence in skinCluster.influenceObjects()])
+        arrays[key + 'num_vertices'] = numpy.array(weights.num_vertices)
+        arrays[key + 'indptr'] = weights.indptr
+        arrays[key + 'indices'] = weights.indices
+        arrays[key + 'data'] = weights.data
+        names.append(mesh.longName())
+
+    arrays['version'] = numpy.array(WEIGHTS_FILE_VERSION)
+    arrays['meshes'] = numpy.array(names)
+    with open(path, 'wb') as fp:  # Prevent numpy from appending the .npz extension
+        numpy.savez(fp, **arrays)
+    return names
+
+
+def _restore_weights(skinCluster, geometry, weights, influence_names):
+    """
+    Write weights on a skinCluster, matching the influences by name.
+    Missing influences are added to the skinCluster if they exist in the scene.
+    Only the saved influences that have weights and the influences that currently have weights are written,
+    the other influences already have no weights.
+    :param weights: A SparseWeights instance.
+    :param influence_names: The name of the influence of each index used by the weights.
+    """
+    influence_names_current = [influence.longName() for influence in skinCluster.influenceObjects()]
+    weighted_indices = set(weights.get_influences().tolist())
+    saved_indices = []
+    current_indices = []
+    for saved_index, influence_name in enumerate(influence_names):
+        if influence_name not in influence_names_current:
+            if not pymel.objExists(influence_name):
+                pymel.warning("Can't restore influence {0} on {1}, the influence don't exist.".format(
+                    influence_name, geometry.longName()
+                ))
+                continue
+            skinCluster.addInfluence(pymel.PyNode(influence_name), weight=0)
+            influence_names_current.append(influence_name)
+        if saved_index in weighted_indices:
+            saved_indices.append(saved_index)
+            current_indices.append(influence_names_current.index(influence_name))
+
+    # The influences that were not saved lose their weights.
+    influence_indices = sorted(set(current_indices) | set(_get_weighted_influence_indices(skinCluster)))
+    dense_weights = numpy.zeros((weights.num_vertices, len(influence_indices)), dtype=numpy.float64)
+    dense_weights[:, [influence_indices.index(index) for index in current_indices]] = weights.to_dense(saved_indices)
+    set_weights(skinCluster, geometry, dense_weights, influence_indices)
+
+
+def load_weights(path, meshes=None):
+    """
+    Restore the skin weights saved by save_weights.
+    The influences are matched by name, missing influences are added to the skinCluster if they exist in the scene.
+    The weights of each mesh are restored with a single MFnSkinCluster.setWeights call on the influences that
+    have weights.
+    :param path: The .npz file to read.
+    :param meshes: If specified, only restore the weights of these meshes.
+    :return: The names of the restored meshes.
+    """
+    if meshes is not None:
+        meshes = set(_get_shape(mesh).longName() for mesh in meshes)
+
+    restored = []
+    archive = numpy.load(path)
+    try:
+        version = int(archive['version'])
+        if version != WEIGHTS_FILE_VERSION:
+            raise Exception("Unsupported weights file version {0} in {1}".format(version, path))
+
+        for i, name in enumerate(archive['meshes'].tolist()):
+            if meshes is not None and name not in meshes:
+                continue
+            if not pymel.objExists(name):
+                pymel.warning("Can't restore weights of {0}, the mesh don't exist.".format(name))
+                continue
+            mesh = _get_shape(pymel.PyNode(name))
+            skinCluster = get_skin_cluster(mesh)
+            if skinCluster is None:
+                pymel.warning("Can't restore weights of {0}, no skinCluster found.".format(name))
+                continue
+
+            key = 'mesh{0}_'.format(i)
+            num_vertices = int(archive[key + 'num_vertices'])
+            if OpenMaya.MItGeometry(mesh.__apimdagpath__()).count() != num_vertices:
+                pymel.warning("Can't restore weights of {0}, the vertex count changed.".format(name))
+                continue
+            weights = SparseWeights(num_vertices, archive[key + 'indptr'], archive[key + 'indices'], archive[key + 'data'])
+
+            _restore_weights(skinCluster, mesh, weights, archive[key + 'influences'].tolist())
+            restored.append(name)
+    finally:
+        archive.close()
+    return restored
+
+
 #TODO : Reset the bind pose at the same time to prevent any problem
-def reset_skin_cluster(skinCluster):
+def reset_skin_cluster(skinCluster, preserve_weights=False):
+    """
+    Unbind and rebind the geometries of a skinCluster.
+    :param skinCluster: The skinCluster to reset.
+    :param preserve_weights: If True, the weights are saved before the unbind and restored after the rebind.
+    """
     influenceObjs = skinCluster.influenceObjects()
+    geometries = skinCluster.getOutputGeometry()
+
+    saved_weights = []
+    if preserve_weights:
+        if numpy is None:
+            raise Exception("Can't preserve the weights of {0}, numpy is not available.".format(skinCluster.name()))
+        influence_names = [influence.longName() for influence in influenceObjs]
+        for geometry in geometries:
+            saved_weights.append((geometry, get_weights(skinCluster, geometry), influence_names))
+
     pymel.skinCluster(skinCluster, e=True, unbindKeepHistory=True)
-    for obj in skinCluster.getOutputGeometry():
+    for obj in geometries:
         pymel.skinCluster(influenceObjs + [obj], tsb=True)
 
-def reset_selection_skin_cluster():
+    for geometry, weights, influence_names in saved_weights:
+        _restore_weights(get_skin_cluster(geometry), geometry, weights, influence_names)
+
+def reset_selection_skin_cluster(preserve_weights=False):
     # Collect skinClusters
     skinClusters = set()
     for obj in pymel.selected():
@@ -318,4 +1045,4 @@ def reset_selection_skin_cluster():
             skinClusters.add(skinCluster)
 
     for skinCluster in skinClusters:
-        reset_skin_cluster(skinCluster)
+        reset_skin_cluster(skinCluster, preserve_weights=preserve_weights)
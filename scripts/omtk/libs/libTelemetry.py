@@ -0,0 +1,284 @@
+"""
+Structured timing of the rig build.
+A session record nested spans (ex: rig -> module -> phase -> library call) with the number of nodes and connections
+created in each of them. The result can be exported to json or to the chrome trace format (chrome://tracing, speedscope)
+to track build time regressions.
+
+Spans are only recorded when a session is active. Otherwise the overhead is a single check.
+
+Usage:
+    with libTelemetry.session() as session:
+        rig.build()
+    session.export_json('/tmp/build.json')
+    session.export_chrome_trace('/tmp/build.trace.json')
+"""
+import collections
+import contextlib
+import functools
+import json
+import logging
+import time
+
+log = logging.getLogger('omtk')
+
+_session = None
+
+
+class Span(object):
+    """
+    A timed region of the build.
+    The node and connection counts only include what was created directly in the span, not in it's children.
+    """
+    def __init__(self, name, category=None, parent=None, args=None):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.args = args or {}
+        self.children = []
+        self.start = None
+        self.end = None
+        self.num_nodes = 0
+        self.num_connections = 0
+
+    def __str__(self):
+        return '<Span {0} {1:.4f}s>'.format(self.name, self.duration)
+
+    @property
+    def duration(self):
+        if self.start is None:
+            return 0.0
+        end = self.end if self.end is not None else time.time()
+        return end - self.start
+
+    @property
+    def self_duration(self):
+        """
+        :return: The duration of the span minus the duration of it's children.
+        """
+        return self.duration - sum(child.duration for child in self.children)
+
+    def get_total_nodes(self):
+        return self.num_nodes + sum(child.get_total_nodes() for child in self.children)
+
+    def get_total_connections(self):
+        return self.num_connections + sum(child.get_total_connections() for child in self.children)
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            for span in child.walk():
+                yield span
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'category': self.category,
+            'args': self.args,
+            'start': self.start,
+            'duration': self.duration,
+            'num_nodes': self.num_nodes,
+            'num_connections': self.num_connections,
+            'total_nodes': self.get_total_nodes(),
+            'total_connections': self.get_total_connections(),
+            'children': [child.to_dict() for child in self.children]
+        }
+
+
+class Session(object):
+    """
+    Hold the spans recorded between start() and stop().
+    :param track_nodes: If True, maya callbacks will be used to count the created nodes and connections.
+    """
+    def __init__(self, name='omtk', track_nodes=True):
+        self.root = Span(name, category='session')
+        self.track_nodes = track_nodes
+        self._stack = [self.root]
+        self._callbacks = []
+
+    @property
+    def current(self):
+        return self._stack[-1]
+
+    def start(self):
+        self.root.start = time.time()
+        if self.track_nodes:
+            self._add_callbacks()
+
+    def stop(self):
+        self._remove_callbacks()
+        # Close any span left open by an exception.
+        while len(self._stack) > 1:
+            self.end()
+        self.root.end = time.time()
+
+    def begin(self, name, category=None, **kwargs):
+        span = Span(name, category=category, parent=self.current, args=kwargs)
+        self.current.children.append(span)
+        self._stack.append(span)
+        span.start = time.time()
+        return span
+
+    def end(self):
+        span = self._stack.pop()
+        span.end = time.time()
+        return span
+
+    #
+    # Maya callbacks
+    #
+
+    def _on_node_added(self, *args):
+        self.current.num_nodes += 1
+
+    def _on_connection(self, src_plug, dst_plug, made, *args):
+        if made:
+            self.current.num_connections += 1
+
+    def _add_callbacks(self):
+        try:
+            from maya import OpenMaya
+        except ImportError:
+            log.warning("Can't count created nodes and connections outside of maya.")
+            return
+        self._callbacks = [
+            OpenMaya.MDGMessage.addNodeAddedCallback(self._on_node_added, 'dependNode'),
+            OpenMaya.MDGMessage.addConnectionCallback(self._on_connection)
+        ]
+
+    def _remove_callbacks(self):
+        if not self._callbacks:
+            return
+        from maya import OpenMaya
+        for callback_id in self._callbacks:
+            OpenMaya.MMessage.removeCallback(callback_id)
+        self._callbacks = []
+
+    #
+    # Reports
+    #
+
+    def get_summary(self):
+        """
+        Aggregate the spans by name.
+        :return: A list of dict sorted by self duration, the most expensive first.
+        """
+        data_by_name = collections.OrderedDict()
+        for span in self.root.walk():
+            if span is self.root:
+                continue
+            data = data_by_name.get(span.name)
+            if data is None:
+                data = data_by_name[span.name] = {
+                    'name': span.name,
+                    'category': span.category,
+                    'count': 0,
+                    'duration': 0.0,
+                    'self_duration': 0.0,
+                    'num_nodes': 0,
+                    'num_connections': 0
+                }
+            data['count'] += 1
+            data['duration'] += span.duration
+            data['self_duration'] += span.self_duration
+            data['num_nodes'] += span.num_nodes
+            data['num_connections'] += span.num_connections
+        return sorted(data_by_name.values(), key=lambda data: data['self_duration'], reverse=True)
+
+    def to_dict(self):
+        return {
+            'spans': self.root.to_dict(),
+            'summary': self.get_summary()
+        }
+
+    def to_chrome_trace(self):
+        """
+        :return: The spans in the chrome trace event format. Nested 'complete' events are displayed as a flamegraph.
+        """
+        events = []
+        origin = self.root.start or 0.0
+        for span in self.root.walk():
+            args = dict(span.args)
+            args['num_nodes'] = span.num_nodes
+            args['num_connections'] = span.num_connections
+            events.append({
+                'name': span.name,
+                'cat': span.category or '',
+                'ph': 'X',
+                'ts': (span.start - origin) * 1000000.0 if span.start else 0.0,
+                'dur': span.duration * 1000000.0,
+                'pid': 1,
+                'tid': 1,
+                'args': args
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_json(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.to_dict(), fp, indent=4, default=str)
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.to_chrome_trace(), fp, default=str)
+
+
+def get_session():
+    """
+    :return: The active session, if any.
+    """
+    return _session
+
+
+@contextlib.contextmanager
+def session(name='omtk', track_nodes=True):
+    """
+    Record all the spans until the context exit.
+    If a session is already active, it will be re-used.
+    """
+    global _session
+    if _session is not None:
+        yield _session
+        return
+
+    _session = Session(name=name, track_nodes=track_nodes)
+    _session.start()
+    try:
+        yield _session
+    finally:
+        _session.stop()
+        _session = None
+
+
+@contextlib.contextmanager
+def span(name, category=None, **kwargs):
+    """
+    Record the execution time of a block of code in the active session.
+    """
+    if _session is None:
+        yield None
+        return
+
+    current = _session.begin(name, category=category, **kwargs)
+    try:
+        yield current
+    finally:
+        # Ensure we don't close a span that was opened by a parent if the session was switched.
+        if _session is not None and _session.current is current:
+            _session.end()
+
+
+def traced(name=None, category='function'):
+    """
+    Decorator that record a span each time the function is called.
+    :param name: The name of the span. Default to the function name.
+    """
+    def deco(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if _session is None:
+                return func(*args, **kwargs)
+            with span(span_name, category=category):
+                return func(*args, **kwargs)
+        return run
+    return deco
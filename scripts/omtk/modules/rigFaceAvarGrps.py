@@ -46,23 +46,23 @@ class AvarGrp(rigFaceAvar.AbstractAvar):
         # TODO: Find a better way
         return self.jnts[-1]
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts',))
     def jnts_upp(self):
         # TODO: Find a better way
         fnFilter = lambda jnt: 'upp' in jnt.name().lower()
         return filter(fnFilter, self.jnts)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts_upp',))
     def jnt_upp_mid(self):
         return get_average_pos_between_nodes(self.jnts_upp)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts',))
     def jnts_low(self):
         # TODO: Find a better way
         fnFilter = lambda jnt: 'low' in jnt.name().lower()
         return filter(fnFilter, self.jnts)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts_low',))
     def jnt_low_mid(self):
         return get_average_pos_between_nodes(self.jnts_low)
 
@@ -112,7 +112,7 @@ class AvarGrp(rigFaceAvar.AbstractAvar):
         self.avars = []
         self.preDeform = False
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('input',))
     def jnts(self):
         fn_is_nurbsSurface = lambda obj: libPymel.isinstance_of_transform(obj, pymel.nodetypes.Joint)
         return filter(fn_is_nurbsSurface, self.input)
@@ -487,42 +487,42 @@ class AvarGrpLftRgt(AvarGrpOnSurface):
     _CLS_CTRL_LFT = BaseCtrlUpp
     _CLS_CTRL_RGT = BaseCtrlUpp
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts',))
     def jnts_l(self):
         fn_filter = lambda jnt: jnt.getTranslation(space='world').x >= 0
         return filter(fn_filter, self.jnts)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts',))
     def jnts_r(self):
         fn_filter = lambda jnt: jnt.getTranslation(space='world').x < 0
         return filter(fn_filter, self.jnts)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts_l',))
     def jnt_l_mid(self):
         i = (len(self.jnts_l)-1) / 2
         return self.jnts_l[i] if self.jnts_l else None
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('jnts_r',))
     def jnt_r_mid(self):
         i = (len(self.jnts_r)-1) / 2
         return self.jnts_r[i] if self.jnts_r else None
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('avars',))
     def avars_l(self):
         fn_filter = lambda avar: avar.jnt.getTranslation(space='world').x >= 0
         return filter(fn_filter, self.avars)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('avars',))
     def avars_r(self):
         fn_filter = lambda avar: avar.jnt.getTranslation(space='world').x < 0
         return filter(fn_filter, self.avars)
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('avars_l',))
     def avar_l_mid(self):
         i = (len(self.avars_l)-1) / 2
         return self.avars_l[i] if self.avars_l else None
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('avars_r',))
     def avar_r_mid(self):
         i = (len(self.avars_r)-1) / 2
         return self.avars_r[i] if self.avars_l else None
@@ -13,14 +13,14 @@ class Finger(Module):
     Finger rig are similare to the AdditiveFK setup but can have an additional joint for the metacarpal.
     """
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('input',))
     def phalanges(self):
         if len(self.input) == 5:
             return self.input[1:-1]
         else:
             return self.input[:-1]
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('input',))
     def metacarpal(self):
         if len(self.input) == 5:
             return self.input[0]
@@ -52,7 +52,7 @@ class Hand(Module):
         self.metacarpals = []
         self.fk_sys_metacarpals = []
 
-    @libPython.cached_property()
+    @libPython.cached_property(depends=('input',))
     def chains(self):
         """
         Sort the finger chains by their relative position to the hand. This give consistent order.
@@ -182,9 +182,11 @@ class Twistbone(Module):
                     subjnt.lockInfluenceWeights.set(False)
 
             # TODO : Automatically skin the twistbones
+            jobs = []
             for mesh in self.get_farest_affected_meshes(rig):
                 print("{1} --> Assign skin weights on {0}.".format(mesh.name(), self.name))
-                libSkinning.transfer_weights_from_segments(mesh, self.chain_jnt.start, self.subjnts)
+                jobs.append((mesh, self.chain_jnt.start, self.subjnts))
+            libSkinning.transfer_weights_from_segments_batch(jobs)
 
 
         '''
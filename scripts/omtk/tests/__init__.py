@@ -2,4 +2,7 @@ import doctest
 
 def test_all():
     doctest.testfile('doctest_className.txt')
+    doctest.testfile('doctest_libGeometry.txt')
+    doctest.testfile('doctest_libPython.txt')
+    doctest.testfile('doctest_libSkinning.txt')
     doctest.testfile('doctest_rigSqueeze.txt')
\ No newline at end of file
@@ -0,0 +1,643 @@
+"""
+Performance benchmarks.
+Most of them need to be run from a maya session (or mayapy).
+
+>>> from omtk.tests import benchmarks
+>>> benchmarks.run_all()
+"""
+import os
+import time
+
+
+def _get_examples_dir():
+    import omtk
+    return os.path.abspath(os.path.join(os.path.dirname(omtk.__file__), '..', '..', 'examples'))
+
+
+def _print_results(name, results):
+    print('[{0}]'.format(name))
+    for key, val in results:
+        print('    {0}: {1:.4f}'.format(key, val))
+
+
+def benchmark_batch_build(path=None):
+    """
+    Compare the build time of an example rig with and without libRigging.batch.
+    """
+    from maya import cmds
+    from omtk import core
+    from omtk.libs import libRigging
+
+    if path is None:
+        path = os.path.join(_get_examples_dir(), 'rig_example_02.ma')
+
+    results = []
+    try:
+        for enabled in (False, True):
+            libRigging.ENABLE_BATCH = enabled
+            cmds.file(path, open=True, force=True)
+            rig = core.find_one()
+            st = time.time()
+            rig.build()
+            results.append(('batch' if enabled else 'no batch', time.time() - st))
+    finally:
+        libRigging.ENABLE_BATCH = True
+
+    _print_results('build {0}'.format(os.path.basename(path)), results)
+    return results
+
+
+#
+# Hierarchy queries
+#
+
+class _FakeNode(object):
+    """
+    Lightweight stand-in for a pymel.nodetypes.Joint. Only implement what the hierarchy functions need.
+    """
+    def __init__(self, name, parent=None):
+        self._name = name
+        self._parent = parent
+
+    def __repr__(self):
+        return self._name
+
+    def __lt__(self, other):
+        return self._name < other._name
+
+    def getParent(self):
+        return self._parent
+
+
+def _create_synthetic_hierarchy(num_jnts=5000, num_children=3, num_roots=1):
+    """
+    Create a hierarchy where each joint have num_children children until we reach num_jnts.
+    :return: The joints in a random order, like they would be returned by pymel.ls.
+    """
+    import random
+    jnts = [_FakeNode('root{0}'.format(i)) for i in range(num_roots)]
+    i = 0
+    while len(jnts) < num_jnts:
+        parent = jnts[i]
+        for j in range(num_children):
+            jnts.append(_FakeNode('jnt{0}'.format(len(jnts)), parent))
+        i += 1
+    jnts = jnts[:num_jnts]
+    random.Random(0).shuffle(jnts)
+    return jnts
+
+
+def _get_chains_from_objs_legacy(objs):
+    from omtk.libs import libPymel
+    chains = []
+    objs = sorted(objs, key=libPymel.get_num_parents)
+    for obj in objs:
+        parent = obj.getParent()
+        if parent not in objs:
+            chains.append([obj])
+        else:
+            for chain in chains:
+                if parent in chain:
+                    chain.append(obj)
+    return [libPymel.PyNodeChain(chain) for chain in chains]
+
+
+def _get_tree_from_objs_legacy(objs, sort=False):
+    from omtk.libs import libPymel
+    data_by_obj = {}
+    ischild_by_obj = {}
+    for obj in objs:
+        data_by_obj[obj] = (obj, [])
+        ischild_by_obj[obj] = False
+
+    for obj in objs:
+        parents = libPymel.get_parents(obj)
+
+        for parent in parents:
+            if parent in objs:
+                data_by_obj[parent][1].append(data_by_obj[obj])
+                ischild_by_obj[obj] = True
+                break
+
+    if sort:
+        for obj, data in data_by_obj.iteritems():
+            data_by_obj[obj] = sorted(data)
+
+    tree = []
+    for obj, ischild in sorted(ischild_by_obj.iteritems()):
+        if not ischild:
+            tree.append(data_by_obj[obj])
+
+    return (None, tree)
+
+
+def _flatten(data):
+    """
+    Convert nested results to a flat list of (depth, value) without recursion since deep hierarchies
+    would exceed the recursion limit when compared directly.
+    """
+    result = []
+    stack = [(0, data)]
+    while stack:
+        depth, val = stack.pop()
+        if isinstance(val, (list, tuple)):
+            result.append((depth, type(val).__name__, len(val)))
+            stack.extend((depth + 1, child) for child in reversed(val))
+        else:
+            result.append((depth, val))
+    return result
+
+
+def benchmark_hierarchy(num_jnts=5000):
+    """
+    Compare get_chains_from_objs and get_tree_from_objs with their previous implementation.
+    The results are validated against the previous implementation.
+    """
+    from omtk.libs import libPymel
+
+    results = []
+    for name, num_children, num_roots in (('deep', 1, 1), ('wide', 3, 1), ('forest', 2, 10)):
+        jnts = _create_synthetic_hierarchy(num_jnts, num_children=num_children, num_roots=num_roots)
+        # Keep only half of the joints to have missing objects between the hierarchy.
+        subset = jnts[::2]
+
+        for fn_name, fn_new, fn_old in (
+                ('chains', libPymel.get_chains_from_objs, _get_chains_from_objs_legacy),
+                ('tree', libPymel.get_tree_from_objs, _get_tree_from_objs_legacy)
+        ):
+            st = time.time()
+            result_new = fn_new(subset)
+            duration_new = time.time() - st
+
+            st = time.time()
+            result_old = fn_old(subset)
+            duration_old = time.time() - st
+
+            if _flatten(result_new) != _flatten(result_old):
+                raise Exception("{0} result don't match the previous implementation on {1} hierarchy.".format(
+                    fn_name, name
+                ))
+
+            results.append(('{0} {1} old'.format(name, fn_name), duration_old))
+            results.append(('{0} {1} new'.format(name, fn_name), duration_new))
+
+    _print_results('hierarchy {0} joints'.format(num_jnts), results)
+    return results
+
+
+#
+# Skeleton analysis
+#
+
+def _create_synthetic_character(parents, positions, offset_x=0.0, num_fingers=3):
+    """
+    Append a t-posed biped (legs, spine, clavicles, arms and fingers) to the provided parents and positions.
+    """
+    def add(parent, pos):
+        parents.append(parent)
+        positions.append((pos[0] + offset_x, pos[1], pos[2]))
+        return len(parents) - 1
+
+    root = add(-1, (0, 10, 0))
+    pelvis = add(root, (0, 10, 0))
+    for side in (1, -1):
+        thigh = add(pelvis, (side, 10, 0))
+        calf = add(thigh, (side, 5, 0.2))
+        foot = add(calf, (side, 1, 0))
+        toe = add(foot, (side, 0, 1))
+        add(toe, (side, 0, 2))
+    spine = pelvis
+    for i in range(3):
+        spine = add(spine, (0, 11 + i, 0))
+    add(spine, (0, 14, 0))  # head
+    for side in (1, -1):
+        clavicle = add(spine, (side, 13, 0))
+        upperarm = add(clavicle, (side * 2, 13, 0))
+        forearm = add(upperarm, (side * 4, 12.5, 0))
+        hand = add(forearm, (side * 6, 12, 0))
+        for i in range(num_fingers):
+            jnt = hand
+            for j in range(3):
+                jnt = add(jnt, (side * (7 + j), 12, i * 0.2))
+
+
+def benchmark_detect(num_characters=(10, 100, 1000)):
+    """
+    Time the analysis of crowds of synthetic characters. (see core.detect)
+    """
+    from omtk.libs import libSkeleton
+
+    results = []
+    for num in num_characters:
+        parents = []
+        positions = []
+        for i in range(num):
+            _create_synthetic_character(parents, positions, offset_x=i * 20.0)
+
+        st = time.time()
+        layouts = libSkeleton.analyse_skeleton(parents, positions)
+        duration = time.time() - st
+
+        if len(layouts) != num:
+            raise Exception("Expected {0} skeletons, got {1}".format(num, len(layouts)))
+        for layout in layouts:
+            if len(layout.legs) != 2 or len(layout.arms) != 2 or len(layout.spines) != 1:
+                raise Exception("Unexpected layout {0}".format(layout))
+
+        results.append(('{0} characters ({1} joints)'.format(num, len(parents)), duration))
+
+    _print_results('detect', results)
+    return results
+
+
+#
+# Geometry
+#
+
+def _create_synthetic_sphere(num_u=100, num_v=50):
+    """
+    :return: The points and triangles of an uv sphere.
+    """
+    import math
+    points = []
+    triangles = []
+    for i in range(num_v + 1):
+        theta = math.pi * i / num_v
+        for j in range(num_u):
+            phi = 2.0 * math.pi * j / num_u
+            points.append((math.sin(theta) * math.cos(phi), math.cos(theta), math.sin(theta) * math.sin(phi)))
+    for i in range(num_v):
+        for j in range(num_u):
+            a = i * num_u + j
+            b = i * num_u + (j + 1) % num_u
+            triangles.append((a, a + num_u, b))
+            triangles.append((b, a + num_u, b + num_u))
+    return points, triangles
+
+
+def benchmark_geometry(num_queries=1000):
+    """
+    Compare the BVH queries of libGeometry with a brute-force test against all the triangles.
+    The results are validated against the brute-force results.
+    """
+    import numpy
+    from omtk.libs import libGeometry
+
+    points, triangles = _create_synthetic_sphere()
+    points = numpy.array(points)
+    triangles = numpy.array(triangles)
+    v0, v1, v2 = points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+    num_triangles = len(triangles)
+
+    rng = numpy.random.RandomState(0)
+    origins = rng.uniform(-0.5, 0.5, (num_queries, 3))
+    directions = rng.normal(size=(num_queries, 3))
+    directions /= numpy.sqrt((directions ** 2).sum(axis=1))[:, numpy.newaxis]
+    positions = rng.uniform(-2.0, 2.0, (num_queries, 3))
+
+    results = []
+
+    st = time.time()
+    bvh = libGeometry.BVH(points, triangles)
+    results.append(('bvh build ({0} triangles)'.format(num_triangles), time.time() - st))
+
+    st = time.time()
+    distances, _, _ = bvh.ray_cast(origins, directions)
+    results.append(('ray cast bvh', time.time() - st))
+
+    st = time.time()
+    expected = []
+    for origin, direction in zip(origins, directions):
+        t = libGeometry.intersect_triangles(
+            numpy.tile(origin, (num_triangles, 1)), numpy.tile(direction, (num_triangles, 1)), v0, v1, v2
+        )
+        expected.append(numpy.nanmin(t) if not numpy.isnan(t).all() else numpy.nan)
+    results.append(('ray cast brute-force', time.time() - st))
+
+    if not numpy.allclose(distances, expected, equal_nan=True):
+        raise Exception("BVH ray casts don't match the brute-force results.")
+
+    st = time.time()
+    _, distances, _, _ = bvh.get_closest_points(positions)
+    results.append(('closest point bvh', time.time() - st))
+
+    st = time.time()
+    expected = []
+    for position in positions:
+        closest, _ = libGeometry.get_closest_points_on_triangles(
+            numpy.tile(position, (num_triangles, 1)), v0, v1, v2
+        )
+        expected.append(numpy.sqrt(((closest - position) ** 2).sum(axis=1)).min())
+    results.append(('closest point brute-force', time.time() - st))
+
+    if not numpy.allclose(distances, expected):
+        raise Exception("BVH closest points don't match the brute-force results.")
+
+    _print_results('geometry {0} queries'.format(num_queries), results)
+    return results
+
+
+#
+# Skinning
+#
+
+def _create_synthetic_weights(num_vertices=100000, num_influences=50, num_influences_per_vertex=4):
+    """
+    :return: A (vertices, influences) numpy array where each vertex is weighted on a few influences.
+    """
+    import numpy
+    rng = numpy.random.RandomState(0)
+    weights = numpy.zeros((num_vertices, num_influences))
+    rows = numpy.repeat(numpy.arange(num_vertices), num_influences_per_vertex)
+    cols = rng.randint(0, num_influences, num_vertices * num_influences_per_vertex)
+    weights[rows, cols] = rng.uniform(0.1, 1.0, len(rows))
+    weights /= weights.sum(axis=1)[:, numpy.newaxis]
+    return weights
+
+
+def benchmark_transfer_weights(num_vertices=100000, num_influences=50):
+    """
+    Compare the numpy weight transfer with the python loop on a synthetic weight table.
+    The weights start and end in MDoubleArray, like when they are read from and written to a skinCluster,
+    so the conversions from/to numpy are included.
+    The results are validated against the python loop.
+    """
+    import numpy
+    from maya import OpenMaya
+    from omtk.libs import libSkinning
+
+    weights = _create_synthetic_weights(num_vertices, num_influences)
+    src_indices = [1, 2, 3, 4]
+    dst_index = 0
+    influence_indices = sorted(set(src_indices + [dst_index]))
+
+    # What MFnSkinCluster.getWeights return with every influences or only the affected ones.
+    old_weights = libSkinning._to_mdoublearray(weights)
+    old_subset_weights = libSkinning._to_mdoublearray(weights[:, influence_indices])
+
+    results = []
+
+    st = time.time()
+    loop_weights = OpenMaya.MDoubleArray()
+    loop_weights.copy(old_weights)
+    libSkinning._transfer_weights_loop(loop_weights, num_vertices, num_influences, src_indices, dst_index)
+    results.append(('loop', time.time() - st))
+
+    st = time.time()
+    new_weights = libSkinning.transfer_weights_array(libSkinning._to_numpy(old_weights).reshape(num_vertices, -1), src_indices, dst_index)
+    libSkinning._to_mdoublearray(new_weights)
+    results.append(('numpy', time.time() - st))
+
+    st = time.time()
+    sparse_weights = libSkinning.SparseWeights.from_dense(
+        libSkinning._to_numpy(old_subset_weights).reshape(num_vertices, -1), influence_indices
+    )
+    new_subset_weights = sparse_weights.transfer(src_indices, dst_index).to_dense(influence_indices)
+    libSkinning._to_mdoublearray(new_subset_weights)
+    results.append(('numpy affected influences', time.time() - st))
+
+    expected_weights = libSkinning._to_numpy(loop_weights)
+    if not numpy.allclose(new_weights.ravel(), expected_weights):
+        raise Exception("numpy weight transfer don't match the python loop.")
+    if not numpy.allclose(new_subset_weights, expected_weights.reshape(num_vertices, -1)[:, influence_indices]):
+        raise Exception("numpy weight transfer on the affected influences don't match the python loop.")
+
+    _print_results('transfer weights {0} vertices, {1} influences'.format(num_vertices, num_influences), results)
+    return results
+
+
+def _create_synthetic_skin_cluster(num_vertices=100000, num_influences=200):
+    """
+    Create a plane skinned on a chain of joints using the synthetic weights.
+    :return: The mesh, it's skinCluster and the weights as a (vertices, influences) numpy array.
+    """
+    import math
+    import pymel.core as pymel
+    from omtk.libs import libSkinning
+
+    num_subdivisions = max(1, int(math.ceil(math.sqrt(num_vertices))) - 1)
+    transform, _ = pymel.polyPlane(subdivisionsWidth=num_subdivisions, subdivisionsHeight=num_subdivisions)
+    mesh = transform.getShape()
+    pymel.select(clear=True)
+    jnts = [pymel.joint(position=(0, i, 0)) for i in range(num_influences)]
+    skinCluster = pymel.skinCluster(jnts, transform, toSelectedBones=True)
+
+    weights = _create_synthetic_weights(len(mesh.vtx), num_influences)
+    libSkinning.set_weights(skinCluster, mesh, weights, range(num_influences))
+    return mesh, skinCluster, weights
+
+
+def benchmark_sparse_weights(num_vertices=100000, num_influences=200, chunk_size=16):
+    """
+    Compare the memory used to transfer weights on all the influences (dense) with
+    the sparse weights read by libSkinning.get_weights.
+    The memory reported is the size in MB of the numpy buffers needed by each method.
+    The results are validated against the dense transfer.
+    """
+    import numpy
+    from maya import cmds
+    from maya import OpenMaya
+    import pymel.core as pymel
+    from omtk.libs import libSkinning
+
+    cmds.file(new=True, force=True)
+    mesh, skinCluster, _ = _create_synthetic_skin_cluster(num_vertices, num_influences)
+    num_vertices = len(mesh.vtx)
+    src_indices = [1, 2, 3, 4]
+    dst_index = 0
+    influence_indices = sorted(set(src_indices + [dst_index]))
+    megabytes = 1024.0 * 1024.0
+
+    results = []
+
+    # Dense: all influences are read, the whole table is copied when computing the new weights.
+    st = time.time()
+    influences = OpenMaya.MIntArray()
+    for index in range(num_influences):
+        influences.append(index)
+    old_weights = OpenMaya.MDoubleArray()
+    geometryDagPath = mesh.__apimdagpath__()
+    component = pymel.api.toComponentMObject(geometryDagPath)
+    skinCluster.__apimfn__().getWeights(geometryDagPath, component, influences, old_weights)
+    dense_weights = libSkinning._to_numpy(old_weights).reshape(num_vertices, num_influences)
+    new_weights = libSkinning.transfer_weights_array(dense_weights, src_indices, dst_index)
+    results.append(('dense', time.time() - st))
+    results.append(('dense MB', (dense_weights.nbytes + new_weights.nbytes) / megabytes))
+    del old_weights, dense_weights
+
+    # Sparse: the influences are read by chunks, only the transferred influences are written.
+    st = time.time()
+    sparse_weights = libSkinning.get_weights(skinCluster, mesh, chunk_size=chunk_size)
+    new_sparse_weights = sparse_weights.transfer(src_indices, dst_index)
+    written_weights = new_sparse_weights.to_dense(influence_indices)  # What is given to MFnSkinCluster.setWeights.
+    results.append(('sparse', time.time() - st))
+    # get_weights only keep one chunk of dense weights alive at a time.
+    chunk_nbytes = num_vertices * min(chunk_size, num_influences) * numpy.dtype(numpy.float64).itemsize
+    results.append(('sparse MB', max(
+        chunk_nbytes + sparse_weights.nbytes,
+        sparse_weights.nbytes + new_sparse_weights.nbytes + written_weights.nbytes
+    ) / megabytes))
+
+    if not numpy.allclose(new_sparse_weights.to_dense(range(num_influences)), new_weights):
+        raise Exception("Sparse weight transfer don't match the dense weight transfer.")
+
+    _print_results('sparse weights {0} vertices, {1} influences'.format(num_vertices, num_influences), results)
+    return results
+
+
+def benchmark_segments(num_vertices=10000, num_jnts=10):
+    """
+    Compare the vectorized segment projection with the per-vertex projection used by the segment-based skinning.
+    The results are validated against the per-vertex projection.
+    """
+    import numpy
+    import pymel.core as pymel
+    from omtk.libs import libPymel
+    from omtk.libs import libSkinning
+
+    knots = [pymel.datatypes.Vector(0, i * 2.0, i * 0.1) for i in range(num_jnts)]
+    segments = libPymel.SegmentCollection(
+        [libPymel.Segment(pos_s, pos_e) for pos_s, pos_e in zip(knots[:-1], knots[1:])]
+    )
+    knot_weights = segments.get_knot_weights(dropoff=1.5)
+
+    random = numpy.random.RandomState(0)
+    positions = random.uniform(-1.0, 1.0, (num_vertices, 3))
+    positions[:, 1] = random.uniform(-2.0, num_jnts * 2.0, num_vertices)
+
+    results = []
+
+    st = time.time()
+    weights_legacy = [
+        libSkinning._get_point_weights_from_segments_weights(segments, knot_weights, pymel.datatypes.Vector(*pos))
+        for pos in positions.tolist()
+    ]
+    results.append(('per-vertex', time.time() - st))
+
+    st = time.time()
+    weights = libSkinning.get_weights_from_segments(segments, knot_weights, positions)
+    results.append(('numpy', time.time() - st))
+
+    if not numpy.allclose(weights, weights_legacy):
+        raise Exception("Vectorized segment weights don't match the per-vertex weights.")
+
+    _print_results('segments {0} vertices, {1} joints'.format(num_vertices, num_jnts), results)
+    return results
+
+
+def _create_synthetic_segments_jobs(num_meshes=8, num_vertices=100000, num_jnts=10):
+    """
+    :return: SegmentsWeightsJob instances on random vertices around a chain of segments, like a twistbone setup.
+    """
+    import numpy
+    from omtk.libs import libSkinning
+
+    rng = numpy.random.RandomState(0)
+    knots = numpy.array([(0.0, i * 2.0, i * 0.1) for i in range(num_jnts)])
+    knot_weights = numpy.identity(num_jnts)
+    jobs = []
+    for _ in range(num_meshes):
+        positions = rng.uniform(-1.0, 1.0, (num_vertices, 3))
+        positions[:, 1] = rng.uniform(-2.0, num_jnts * 2.0, num_vertices)
+        weights = numpy.zeros((num_vertices, num_jnts + 1))
+        weights[:, 0] = numpy.where(rng.uniform(0.0, 1.0, num_vertices) < 0.8, rng.uniform(0.1, 1.0, num_vertices), 0.0)
+        jobs.append(libSkinning.SegmentsWeightsJob(weights, positions, knots[:-1], knots[1:], knot_weights))
+    return jobs
+
+
+def benchmark_parallel_weights(num_meshes=8, num_vertices=100000, num_processes=None):
+    """
+    Compare the time needed to compute the segments weights of multiple meshes with different number of processes.
+    The process pool creation and the copies from/to the shared memory are included.
+    The results are validated against the serial computation.
+    """
+    import multiprocessing
+    import numpy
+    from omtk.libs import libSegments
+
+    if num_processes is None:
+        num_processes = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+
+    results = []
+    expected_weights = None
+    for num_process in num_processes:
+        jobs = _create_synthetic_segments_jobs(num_meshes, num_vertices)
+        st = time.time()
+        libSegments.compute_segments_weights(jobs, num_processes=num_process)
+        results.append(('{0} processes'.format(num_process), time.time() - st))
+
+        if expected_weights is None:
+            expected_weights = [job.weights for job in jobs]
+        elif not all(numpy.allclose(job.weights, weights) for job, weights in zip(jobs, expected_weights)):
+            raise Exception("Parallel segments weights don't match the serial computation.")
+
+    _print_results('parallel weights {0} meshes, {1} vertices'.format(num_meshes, num_vertices), results)
+    return results
+
+
+#
+# Serialization
+#
+
+def benchmark_serialization(path=None):
+    """
+    Compare the size and the export/import time of the json files created by libSerialization
+    and the compressed json-lines files created by libSerializationIO.
+    """
+    import shutil
+    import tempfile
+    import libSerialization
+    from maya import cmds
+    from omtk import core
+    from omtk.libs import libSerializationIO
+
+    if path is None:
+        path = os.path.join(_get_examples_dir(), 'rig_example_02.ma')
+
+    cmds.file(path, open=True, force=True)
+    rigs = core.find()
+
+    dirname = tempfile.mkdtemp()
+    path_json = os.path.join(dirname, 'rigs.json')
+    path_stream = os.path.join(dirname, 'rigs' + libSerializationIO.STREAM_EXTENSION)
+
+    results = []
+    try:
+        st = time.time()
+        libSerialization.export_json_file_maya(rigs, path_json)
+        results.append(('json export', time.time() - st))
+        st = time.time()
+        libSerialization.import_json_file_maya(path_json)
+        results.append(('json import', time.time() - st))
+        results.append(('json size (kb)', os.path.getsize(path_json) / 1024.0))
+
+        st = time.time()
+        libSerializationIO.export_json_stream(rigs, path_stream)
+        results.append(('stream export', time.time() - st))
+        st = time.time()
+        libSerializationIO.import_json_stream(path_stream)
+        results.append(('stream import', time.time() - st))
+        results.append(('stream size (kb)', os.path.getsize(path_stream) / 1024.0))
+
+        # Partial import of the first module of each rig.
+        names = [rig.modules[0].name for rig in rigs if rig.modules]
+        st = time.time()
+        libSerializationIO.import_json_stream(path_stream, names=names)
+        results.append(('stream partial import', time.time() - st))
+    finally:
+        shutil.rmtree(dirname)
+
+    _print_results('serialization {0}'.format(os.path.basename(path)), results)
+    return results
+
+
+def run_all():
+    benchmark_batch_build()
+    benchmark_hierarchy()
+    benchmark_detect()
+    benchmark_geometry()
+    benchmark_transfer_weights()
+    benchmark_sparse_weights()
+    benchmark_segments()
+    benchmark_parallel_weights()
+    benchmark_serialization()
@@ -8,13 +8,17 @@ import core
 import inspect
 from omtk.core import classModule
 from omtk.core import classRig
+from omtk.libs import libNetwork
 from omtk.libs import libPymel
 from omtk.libs import libPython
+from omtk.libs import libSerializationIO
 from omtk.libs import libSkeleton
 from omtk.libs.libQt import QtCore, QtGui, getMayaWindow
 
 import ui; reload(ui)
 
+_FILE_FILTER = "OMTK (*{0});;JSON (*.json)".format(libSerializationIO.STREAM_EXTENSION)
+
 
 def get_all_QTreeWidgetItem(widget, qt_item=None):
     """
@@ -366,12 +370,8 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
     def export_networks(self):
         path = '/home/rlessard/Desktop/test.json'
 
-        try:
-            pymel.delete(self.root._network)
-        except AttributeError:
-            pass
-
-        net = libSerialization.export_network(self.root) # Export part and only part
+        # Only update the networks that changed. If the rig was never exported, everything will be exported.
+        net, _ = libNetwork.export_network_diff(self.root)
         return net
 
         # libSerialization.export_json_file_maya(path)
@@ -413,10 +413,11 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
 
         self.treeWidget_jnts.clear()
         #all_jnt_roots = libPymel.ls_root(type='joint') + list(set([shape.getParent() for shape in pymel.ls(type='nurbsSurface')]))
-        all_potential_influences = self.root.get_potential_influences()
+        snapshot = libPymel.get_scene_snapshot()
+        all_potential_influences = self.root.get_potential_influences(snapshot=snapshot)
 
         if all_potential_influences :
-            data = libPymel.get_tree_from_objs(all_potential_influences, sort=True)
+            data = libPymel.get_tree_from_objs(all_potential_influences, sort=True, snapshot=snapshot)
 
             self._fill_widget_influences_recursive2(self.treeWidget_jnts.invisibleRootItem(), data)
 
@@ -511,17 +512,24 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
     def on_rebuild(self):
         for qItem in self.treeWidget.selectedItems():
             rig = qItem.rig
+            # Only rebuild the modules that changed.
+            if isinstance(rig, classRig.Rig):
+                rig.build(incremental=True)
+                continue
             if rig.is_built():
                 rig.unbuild()
             rig.build()
         self._update_network(self.root)
 
     def on_import(self):
-        path, _ = QtGui.QFileDialog.getOpenFileName(caption="File Save (.json)", filter="JSON (*.json)")
+        path, _ = QtGui.QFileDialog.getOpenFileName(caption="File Open", filter=_FILE_FILTER)
         if not path:
             return
 
-        new_rigs = libSerialization.import_json_file_maya(path)
+        if path.endswith(libSerializationIO.STREAM_EXTENSION):
+            new_rigs = libSerializationIO.import_json_stream(path)
+        else:
+            new_rigs = libSerialization.import_json_file_maya(path)
         if not new_rigs:
             return
 
@@ -539,8 +547,13 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
     def on_export(self):
         all_rigs = core.find()
 
-        path, _ = QtGui.QFileDialog.getSaveFileName(caption="File Save (.json)", filter="JSON (*.json)")
-        if path:
+        path, _ = QtGui.QFileDialog.getSaveFileName(caption="File Save", filter=_FILE_FILTER)
+        if not path:
+            return
+
+        if path.endswith(libSerializationIO.STREAM_EXTENSION):
+            libSerializationIO.export_json_stream(all_rigs, path)
+        else:
             libSerialization.export_json_file_maya(all_rigs, path)
 
     def on_update(self, *args, **kwargs):
@@ -588,7 +601,7 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
         #Check if the name have changed
         if (item._name != new_text):
             item._name = new_text
-            module.name = new_text
+            self.root.rename_module(module, new_text)
 
             #Update directly the network value instead of re-exporting it
             if hasattr(item, "net"):
@@ -618,6 +631,7 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
             if module.is_built():
                 module.unbuild()
             self.root.modules.remove(module)
+        self.root.invalidate_module_index()
         self.export_networks()
         self.update_ui()
 
@@ -682,6 +696,7 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
                         continue
                     module.input.append(obj)
                     need_update = True
+        self.root.invalidate_module_index()
 
         # TODO: Faster by manually connecting to the inputs?
         if need_update:
@@ -698,6 +713,7 @@ class AutoRig(QtGui.QMainWindow, ui.Ui_MainWindow):
                         continue
                     module.input.remove(obj)
                     need_update = True
+        self.root.invalidate_module_index()
 
         # TODO: Faster by manually connecting to the inputs?
         if need_update: